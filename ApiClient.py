@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+import time
+import random
+from email.utils import parsedate_to_datetime
+from config import *
+from HttpSession import getSession
+from Metrics import registry
+
+requestCount = registry.counter("api_requests_total", "Requests sent to XXX, by status code")
+requestSeconds = registry.histogram("api_request_seconds", "Time XXX took to answer a request")
+retryCount = registry.counter("api_retries_total", "Requests to XXX retried, by reason")
+rateGauge = registry.gauge("api_rate", "Requests per second the rate limiter lets through")
+
+RETRIED_STATUS_CODES = (500, 502, 503, 504)
+
+def backoffDelay(attempt, base=API_BACKOFF_BASE_SECS, maxDelay=API_BACKOFF_MAX_SECS):
+    """
+    Returns how long to wait before retry number 'attempt' (starting from 0).
+    Exponential backoff with full jitter, so that retries of many requests do not arrive together.
+    """
+    return random.uniform(0, min(maxDelay, base * 2 ** attempt))
+
+def parseRetryAfter(value):
+    """
+    Returns the seconds a Retry-After header asks to wait, or None if it cannot be parsed.
+    The header is either a number of seconds or an http date.
+    """
+    if value == None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    try:
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class TokenBucket:
+    """
+    Thread safe token bucket limiting requests to 'rate' per second, allowing bursts of 'burst' requests.
+    The rate is adaptive: 'slowDown' halves it, down to 'minRate', and every 'speedUp' brings it
+    back towards the configured rate by a tenth of it.
+    """
+    def __init__(self, rate=API_RATE, burst=API_BURST, minRate=API_MIN_RATE):
+        self.maxRate = rate
+        self.minRate = min(minRate, rate)
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._lastTime = time.monotonic()
+        self._lock = threading.Lock()
+        rateGauge.set(rate)
+
+    def acquire(self):
+        """
+        Takes a token, sleeping till one is available.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._lastTime) * self.rate)
+                self._lastTime = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def slowDown(self):
+        with self._lock:
+            self.rate = max(self.minRate, self.rate / 2)
+            rateGauge.set(self.rate)
+
+    def speedUp(self):
+        with self._lock:
+            self.rate = min(self.maxRate, self.rate + self.maxRate / 10)
+            rateGauge.set(self.rate)
+
+class ApiClient:
+    """
+    Sends requests to the SEO API through a rate limiter and retries the ones failing temporarily.
+    Has 'get' and 'post' like the requests module, so it can be used in place of it.
+    Connections are kept alive in the http session of the calling thread.
+
+    Every attempt takes a token of the bucket first.
+    429 answers with a Retry-After header are waited out and retried, and the bucket slows down.
+    429 answers without one are returned, as they mean the authorization token is exhausted.
+    5xx answers and connection errors are retried with exponential backoff and jitter.
+    After 'maxRetries' retries, the last answer is returned or the last connection error is raised.
+    """
+    def __init__(self, bucket=None, maxRetries=API_MAX_RETRIES, maxRetryAfter=API_MAX_RETRY_AFTER_SECS, backoffBase=API_BACKOFF_BASE_SECS, backoffMax=API_BACKOFF_MAX_SECS):
+        self.bucket = bucket if bucket != None else TokenBucket()
+        self.maxRetries = maxRetries
+        self.backoffBase = backoffBase
+        self.backoffMax = backoffMax
+        self.maxRetryAfter = maxRetryAfter
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            startTime = time.monotonic()
+            try:
+                resp = self._send(method, url, **kwargs)
+            except requests.exceptions.ConnectionError as ex:
+                requestCount.inc(status="connection_error")
+                if attempt == self.maxRetries:
+                    raise
+                retryCount.inc(reason="connection_error")
+                wait = backoffDelay(attempt, self.backoffBase, self.backoffMax)
+                print("DEBUG: %s %s failed with %s. Retrying in %.1f seconds." % (method, url, type(ex).__name__, wait))
+                time.sleep(wait)
+                attempt += 1
+                continue
+            requestSeconds.observe(time.monotonic() - startTime)
+            requestCount.inc(status=resp.status_code)
+            if resp.status_code == 429:
+                retryAfter = parseRetryAfter(resp.headers.get("Retry-After"))
+                if retryAfter == None or retryAfter > self.maxRetryAfter:
+                    return resp
+                self.bucket.slowDown()
+                if attempt == self.maxRetries:
+                    return resp
+                retryCount.inc(reason="rate_limited")
+                print("DEBUG: %s %s is rate limited. Retrying in %s seconds." % (method, url, retryAfter))
+                time.sleep(retryAfter)
+            elif resp.status_code in RETRIED_STATUS_CODES:
+                if attempt == self.maxRetries:
+                    return resp
+                retryCount.inc(reason="server_error")
+                wait = backoffDelay(attempt, self.backoffBase, self.backoffMax)
+                print("DEBUG: %s %s returned status code %s. Retrying in %.1f seconds." % (method, url, resp.status_code, wait))
+                time.sleep(wait)
+            else:
+                self.bucket.speedUp()
+                return resp
+            attempt += 1
+
+    def _send(self, method, url, **kwargs):
+        return getSession().request(method, url, **kwargs)
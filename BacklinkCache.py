@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sqlite3
+import threading
+import time
+import json
+from config import *
+
+BACKLINKS = "backlinks"
+OVERVIEW = "overview"
+
+class BacklinkCache:
+    """
+    Persistent cache of XXX answers, kept in a single SQLite file and looked up by domain.
+    fileName: SQLite file of the cache. ":memory:" keeps it only for this run.
+    ttl: Entries older than this many seconds are not used.
+    maxBytes: When the stored answers get larger than this, oldest ones are evicted.
+    cacheOnly: When True, XXX is never queried; domains that are not cached are skipped.
+    """
+    def __init__(self, fileName=BC_FILE_NAME, ttl=BC_TTL_SECS, maxBytes=BC_MAX_BYTES, cacheOnly=BC_CACHE_ONLY):
+        self.ttl = ttl
+        self.maxBytes = maxBytes
+        self.cacheOnly = cacheOnly
+        self._lock = threading.Lock()
+        # Used by the scraper thread, created in the main thread
+        self._db = sqlite3.connect(fileName, check_same_thread=False)
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS answers (
+                domain TEXT NOT NULL, kind TEXT NOT NULL, data TEXT NOT NULL, size INTEGER NOT NULL, stored_at REAL NOT NULL,
+                PRIMARY KEY (domain, kind))""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS answers_stored_at ON answers (stored_at)")
+        self._totalBytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM answers").fetchone()[0]
+
+    def get(self, domain, kind):
+        """
+        Returns the cached answer, or None if there is no fresh one.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT data FROM answers WHERE domain = ? AND kind = ? AND stored_at >= ?",
+                (domain, kind, time.time() - self.ttl)).fetchone()
+        if row == None:
+            return None
+        return json.loads(row[0])
+
+    def has(self, domain, kind):
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM answers WHERE domain = ? AND kind = ? AND stored_at >= ?",
+                (domain, kind, time.time() - self.ttl)).fetchone()
+        return row != None
+
+    def put(self, domain, kind, answer):
+        data = json.dumps(answer)
+        with self._lock, self._db:
+            old = self._db.execute("SELECT size FROM answers WHERE domain = ? AND kind = ?", (domain, kind)).fetchone()
+            if old != None:
+                self._totalBytes -= old[0]
+            self._db.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)", (domain, kind, data, len(data), time.time()))
+            self._totalBytes += len(data)
+            if self._totalBytes > self.maxBytes:
+                self._evict()
+
+    def _evict(self):
+        """
+        Deletes expired answers, then oldest ones till the cache fits in maxBytes.
+        """
+        self._db.execute("DELETE FROM answers WHERE stored_at < ?", (time.time() - self.ttl,))
+        self._totalBytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM answers").fetchone()[0]
+        evicted = []
+        for domain, kind, size in self._db.execute("SELECT domain, kind, size FROM answers ORDER BY stored_at"):
+            if self._totalBytes <= self.maxBytes:
+                break
+            evicted.append((domain, kind))
+            self._totalBytes -= size
+        self._db.executemany("DELETE FROM answers WHERE domain = ? AND kind = ?", evicted)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
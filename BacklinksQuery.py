@@ -6,15 +6,33 @@ from config import *
 import twocaptcha
 import os, re
 import json
-from DomainData import DomainData
+from collections import deque
+from LinkGraph import LinkGraph
 from functools import *
 from urllib import parse
-from Export import Export
+from Export import openExporter
+from WorkQueue import WorkQueue
+from PublicSuffix import normalizeDomain
+from TokenPool import TokenPool, TokenPoolExhausted
+from BacklinkCache import BacklinkCache, BACKLINKS, OVERVIEW
+from ApiClient import ApiClient
+from HttpSession import getSession
+from Metrics import registry
+from DomainFilter import DomainFilter
 
 CRAWL_ALREADY_DONE = "Crawl already done"
 CRAWL_STARTED = "Crawl started"
 CRAWL_IN_PROGRESS = "Crawl in progress"
 
+domainCount = registry.counter("bq_domains_total", "Domains processed by backlinks query, by result")
+backlinkCount = registry.counter("bq_backlinks_total", "Backlinks found by backlinks query")
+tokenRenewalCount = registry.counter("bq_token_renewals_total", "Authorization token renewals, by result")
+notYetReadyCount = registry.counter("bq_not_yet_ready_total", "NotYetReady answers to backlink queries")
+taskStartCount = registry.counter("bq_task_starts_total", "Backlink tasks started on XXX")
+cacheLookupCount = registry.counter("bq_cache_lookups_total", "Backlink cache lookups, by kind and result")
+tasksInFlight = registry.gauge("bq_tasks_in_flight", "Backlink tasks started and being polled")
+queueDepth = registry.gauge("bq_queue_depth", "Domains waiting for backlinks query")
+
 class TokenError(Exception):
     """
     Raised when token is not useful, ie. exhausted.
@@ -39,35 +57,59 @@ class NotYetReady(Exception):
 class BacklinksQuery(threading.Thread):
     """
     Queries backlinks for given domains and saves found data.
-    data: is a set of DomainData having backlink information
+    graph: LinkGraph the backlinks found are added to. If not given, a new one is made.
     domains: is a set of domains to query on XXX
+    queue: WorkQueue the domains are taken from. If not given, one is made of 'domains'.
     reportNoFollowLinks: When True, 'onExternalSearchDomainFound' is called with no follow links. 
-    Regardless of what this value is, 'data' always has no follow link data if they exist.
-    exportFileName: Name of the csv file which has backlinks info
+    Regardless of what this value is, 'graph' always has no follow link data if they exist.
+    exportFileName: Name of the csv file, or the SQLite database if it ends with .sqlite or .db, which has backlinks info
     proxies: Each used once for token request. Can be empty.
     tokens: Debug feature. Prerequested tokens goes here. Can be empty.
+    tokenService: Solves captchas and requests tokens for the token pool. By default XXX is used.
+    backlinkCache: BacklinkCache in front of XXX. By default the one configured in config.py is used.
+    append: If True, the export file is appended to instead of being overwritten, ie. when resuming.
+    apiClient: ApiClient the requests to XXX are sent with. By default one rate limited as configured in config.py is used.
+    domainFilter: DomainFilter of the domains never queried. By default the blocklist and known giants of config.py.
     
-    onExternalSearchDomainFound: is a callback that is called when backlinks information arrives. 
-    If it is not set, than these values are printed.
+    onExternalSearchDomainFound: is a callback that is called when backlinks information arrives, with the
+    referring domains, their depth and {domain: signals} for their priorities, see PriorityScheduler.
+    If it is not set, than the domains are printed.
     errorCallback: Currently called only when an unexpected error occurred and the state has to be saved.
+
+    Cheap checks come first: blocked domains are skipped without a request and domains with a cached
+    overview are checked against BACKLINK_DOMAIN_FILTER before their backlink task is started.
+    A backlink task is started at most once for a domain.
+
+    When BQ_MAX_TASKS_IN_FLIGHT is more than 1, backlink tasks of that many domains are started first
+    and their results are then polled in turns, collecting whichever is ready.
     """
     HEADERS = {"of_domain": "of_domain", "url_from": "url_from", "url_to": "url_to", "title": "title", "anchor": "anchor", "nofollow": "nofollow", "inlink_rank": "page_rank", "domain_inlink_rank": "domain_rank", "first_seen": "first_seen", "last_visited": "last_visited", "date_lost": "date_lost"}
     
-    def __init__(self, domains, reportNoFollowLinks, exportFileName, proxies, tokens):
+    def __init__(self, domains, reportNoFollowLinks, exportFileName, proxies, tokens, queue=None, tokenService=None, backlinkCache=None, append=False, apiClient=None, domainFilter=None, graph=None):
         threading.Thread.__init__(self)
         self.proxies = proxies
         self.tokens = tokens
-        self.domains = set(domains)
-        self._processedDomains = set()
-        self.data = set()
-        self.onExternalSearchDomainFound = print
+        # Tokens are requested in background, so that a renewal does not wait for a captcha to be solved
+        self.tokenPool = TokenPool(tokenService if tokenService != None else DefaultTokenService(), tokens, proxies)
+        self.backlinkCache = backlinkCache if backlinkCache != None else BacklinkCache()
+        self.apiClient = apiClient if apiClient != None else ApiClient()
+        self.domainFilter = domainFilter if domainFilter != None else DomainFilter()
+        self._startedTasks = set()                  # Domains whose backlink task is started
+        self.queue = queue if queue != None else WorkQueue(domains)
+        # Domains the journal of the queue has seen completed are not processed again
+        self._processedDomains = set(self.queue.journal.processed) if self.queue.journal != None else set()
+        self.graph = graph if graph != None else LinkGraph()
+        self.onExternalSearchDomainFound = lambda domains, depth, signals: print(domains)
         self.errorCallback = print
         self.reportNoFollowLinks = reportNoFollowLinks
-        self.exporter = Export(exportFileName, BacklinksQuery.HEADERS)
+        self.exporter = openExporter(exportFileName, BacklinksQuery.HEADERS, "backlinks", EX_BUFFERED, EX_BATCH_SIZE, EX_FLUSH_INTERVAL_SECS, append)
         self._stopSignalReceived = False
+        queueDepth.setFunction(lambda: len(self.queue))
     
     def stop(self):
         self._stopSignalReceived = True
+        self.queue.close()
+        self.tokenPool.stop()
     
     def __del__(self):
         self.exporter.close()
@@ -78,96 +120,232 @@ class BacklinksQuery(threading.Thread):
     def setErrorCallback(self, callback):
         self.errorCallback = callback
 
-    def onBacklinkSearchDomainFound(self, domains):
-        self.feed(domains)
+    def onBacklinkSearchDomainFound(self, domains, depth=0, signals=None):
+        self.feed(domains, depth, signals)
 
-    def feed(self, domains):
+    def feed(self, domains, depth=0, signals=None):
         """
         Adds domains to be queried
         """
         print("BacklinksQuery is fed")
-        self.domains = self.domains.union(domains)
+        self.queue.put(domains, depth, signals)
 
     def _checkDomainValiditySafe(self, domain):
         """
-        Handles internal server error and token error.
+        Handles token error by renewing the token once.
+        InternalServerError is raised only after the retries of the api client.
         """
         try:
             return self.checkDomainValidity(domain)
-        except InternalServerError:
-            print("Checking domain validity gave InternalServerError. Waiting 10 seconds and trying again.")
-            time.sleep(10)
-            return self._checkDomainValiditySafe(domain)
         except TokenError:
             if not self._renewTokenSafely():
                 raise TokenError()
-            return self._checkDomainValiditySafe(domain)
+            return self.checkDomainValidity(domain)
 
     def _renewTokenSafely(self):
         try:
             self.authToken = str(self.getAuthorizationToken())
             HEADERS_BACKLINKS["Authorization"] = self.authToken
+            tokenRenewalCount.inc(result="ok")
             return True
         except TokenError:
             print("Token Request has failed. Abort.")
+            tokenRenewalCount.inc(result="failed")
             return False
 
     def run(self):
+        self.tokenPool.start()
         if not self._renewTokenSafely():
             # If cannot renew, return
             return
         print("Auth Token: ", self.authToken)
         try:
-            while not self._stopSignalReceived:
-                toBeProcessed = self.domains.difference(self._processedDomains)
-                if len(toBeProcessed) == 0:
-                    print("BacklinksQuery is waiting for input")
-                    time.sleep(5)
-                    continue
-                newExternalSearchDomains = []
-                for domain in toBeProcessed:
-                    shallStartTask = True
-                    shallStartTask = self._startTaskIfNeededSafe(shallStartTask, domain)
-                    if (not self._checkDomainValiditySafe(domain)):
-                            print("Domain '%s' is filtered out." % domain)
-                            continue
-                    print("BacklinksQuery is looking up for %s"%domain)
-                    domainBacklinks = self.getBacklinksSafe(domain, shallStartTask)
-                    if domainBacklinks == None:
-                        # Invalid domain, skip
-                        print("Domain '%s' is being skipped."%domain)
-                        continue
-                    for bl in domainBacklinks:
-                        bl["of_domain"] = domain
-                        self.exporter.writerow(bl)                                      # Save to csv
-                        if not self.reportNoFollowLinks and bl["nofollow"]:
-                            continue
-                        fromDomain = parse.urlparse(str(bl["url_from"])).netloc
-                        newExternalSearchDomains.append(fromDomain)
-                self._processedDomains = self._processedDomains.union(toBeProcessed)    # They are now processed
-                if len(newExternalSearchDomains) != 0:
-                    self.onExternalSearchDomainFound(newExternalSearchDomains)
+            if min(BQ_MAX_TASKS_IN_FLIGHT, BQ_TOKEN_TASK_QUOTA) > 1:
+                self._runPipelined()
+            else:
+                self._runSerial()
         except Exception as ex:     # getBacklinksSafe may raise TokenError
             self.errorCallback(ex)
 
+    def _runSerial(self):
+        while not self._stopSignalReceived:
+            if len(self.queue) == 0:
+                print("BacklinksQuery is waiting for input")
+            domain = self.queue.get()
+            if domain == None:
+                # Queue is closed
+                break
+            self.processDomain(domain)
+            self._markProcessed(domain)                              # It is now processed
+
+    def _runPipelined(self):
+        """
+        Keeps backlink tasks of up to BQ_MAX_TASKS_IN_FLIGHT domains started, but never more than
+        BQ_TOKEN_TASK_QUOTA, and polls them round robin. Sleeps only when none of them was ready in a whole round.
+        """
+        window = min(BQ_MAX_TASKS_IN_FLIGHT, BQ_TOKEN_TASK_QUOTA)
+        inFlight = deque()
+        notReadyCount = 0                   # NotYetReady answers in a row
+        while not self._stopSignalReceived:
+            while len(inFlight) < window:
+                if len(inFlight) == 0 and len(self.queue) == 0:
+                    print("BacklinksQuery is waiting for input")
+                # Block for input only if there is nothing to poll
+                domain = self.queue.get(timeout=0 if len(inFlight) != 0 else None)
+                if domain == None:
+                    break
+                task = self._startDomain(domain)
+                if task == None:
+                    self._markProcessed(domain)
+                    continue
+                inFlight.append(task)
+            tasksInFlight.set(len(inFlight))
+            if len(inFlight) == 0:
+                # Queue is closed and nothing is left to poll
+                break
+            task = inFlight.popleft()
+            try:
+                domainBacklinks = self._pollBacklinks(task)
+            except NotYetReady:
+                notYetReadyCount.inc()
+                task["polls"] += 1
+                if task["polls"] == BQ_MAX_NOT_YET_READY_POLLS:
+                    print("ERROR: %s NotYetReady errors are received for domain '%s'. Skipping." % (task["polls"], task["domain"]))
+                    domainCount.inc(result="skipped")
+                    self._markProcessed(task["domain"])
+                else:
+                    inFlight.append(task)
+                notReadyCount += 1
+                if len(inFlight) != 0 and notReadyCount >= len(inFlight):
+                    print("None of the %s backlink tasks is ready. Waiting for %s seconds." % (len(inFlight), BQ_NOT_YET_READY_WAIT_SECS))
+                    time.sleep(BQ_NOT_YET_READY_WAIT_SECS)
+                    notReadyCount = 0
+                continue
+            notReadyCount = 0
+            self._saveBacklinks(task["domain"], domainBacklinks)
+            self._markProcessed(task["domain"])                      # It is now processed
+
+    def _startDomain(self, domain):
+        """
+        Checks validity of a domain and starts its backlink task if it passes.
+        Returns a task entry to be polled with '_pollBacklinks', or None if domain is filtered out.
+        """
+        if self.domainFilter.isBlocked(domain):
+            print("Domain '%s' is blocked." % domain)
+            domainCount.inc(result="blocked")
+            return None
+        try:
+            # Backlinks are queried from XXX only if they are not cached
+            backlinksCached = self.backlinkCache.has(domain, BACKLINKS)
+            overviewCached = self.backlinkCache.has(domain, OVERVIEW)
+            shallStartTask = not self.backlinkCache.cacheOnly and not backlinksCached
+            if shallStartTask and not overviewCached:
+                # XXX gives the overview only after the task is started
+                shallStartTask = self._startTaskIfNeededSafe(True, domain)
+            # Cached backlinks are filtered only by a cached overview, they need no task to be started for one
+            if (not backlinksCached or overviewCached) and not self._checkDomainValiditySafe(domain):
+                print("Domain '%s' is filtered out." % domain)
+                domainCount.inc(result="filtered")
+                return None
+            # Only the domains that pass get their task started, if it was not started for the overview
+            shallStartTask = self._startTaskIfNeededSafe(shallStartTask, domain)
+        except InternalServerError:
+            print("XXX kept giving InternalServerError for domain '%s'. Skipping." % domain)
+            domainCount.inc(result="skipped")
+            return None
+        print("BacklinksQuery is looking up for %s"%domain)
+        return {"domain": domain, "shallStartTask": shallStartTask, "polls": 0}
+
+    def _pollBacklinks(self, task):
+        """
+        Queries backlinks of a started task once.
+        Returns backlinks, or None if domain related error is found.
+        Raises NotYetReady if the task shall be polled again later, ie. it is not done or XXX gave InternalServerError.
+        Raises TokenError if the token is exhausted and cannot be renewed.
+        """
+        domain = task["domain"]
+        try:
+            task["shallStartTask"] = self._startTaskIfNeededSafe(task["shallStartTask"], domain)
+            return self.getBacklinksCached(domain)
+        except TokenError:
+            if not self._renewTokenSafely():
+                self.errorCallback("BacklinksQuery could not get a valid token. Abort.")
+                raise TokenError()
+            # Poll again with the new token in its turn
+            raise NotYetReady()
+        except InternalServerError:
+            print("XXX has given InternalServerError for domain '%s'. Polling again in its turn." % domain)
+            raise NotYetReady()
+
+    def processDomain(self, domain):
+        """
+        Queries backlinks of a domain, saves them and reports the domains they come from.
+        """
+        task = self._startDomain(domain)
+        if task == None:
+            return
+        domainBacklinks = self.getBacklinksSafe(domain, task["shallStartTask"])
+        self._saveBacklinks(domain, domainBacklinks)
+
+    def _saveBacklinks(self, domain, domainBacklinks):
+        """
+        Saves backlinks of a domain and reports the domains they come from.
+        """
+        if domainBacklinks == None:
+            # Invalid domain, skip
+            print("Domain '%s' is being skipped."%domain)
+            domainCount.inc(result="skipped")
+            return
+        domainCount.inc(result="saved")
+        backlinkCount.inc(len(domainBacklinks))
+        self.graph.addBacklinks(domain, [(str(bl["url_from"]), bl["nofollow"]) for bl in domainBacklinks])
+        parentPriority = self.queue.priority(domain)
+        newExternalSearchDomains = {}                                       # Domain: signals, in the order found
+        for bl in domainBacklinks:
+            bl["of_domain"] = domain
+            self.exporter.writerow(bl)                                      # Save to csv
+            if not self.reportNoFollowLinks and bl["nofollow"]:
+                continue
+            fromDomain = normalizeDomain(str(bl["url_from"]))
+            signals = newExternalSearchDomains.setdefault(fromDomain, {"links": 0, "parentPriority": parentPriority})
+            signals["links"] += 1
+            # Ranks of the best backlink from the domain
+            for name, field in (("domainInlinkRank", "domain_inlink_rank"), ("inlinkRank", "inlink_rank")):
+                value = bl.get(field)
+                if isinstance(value, (int, float)) and value > signals.get(name, value - 1):
+                    signals[name] = value
+        if len(newExternalSearchDomains) != 0:
+            self.onExternalSearchDomainFound(list(newExternalSearchDomains), self.queue.depth(domain) + 1, newExternalSearchDomains)
+
+    def _markProcessed(self, domain):
+        self._processedDomains.add(domain)
+        # Journaled as completed only once its rows are on the disk, so that a crash cannot lose them
+        self.exporter.afterWritten(lambda: self.queue.completed(domain))
+
     def saveState(self, fileName):
-        ext = {"domains": list(self.domains), "_processedDomains": list(self._processedDomains)}
+        ext = {"domains": list(self.queue.known()), "_processedDomains": list(self._processedDomains), "schedule": self.queue.schedule()}
         with open(fileName, 'w') as f:
             json.dump(ext, f)
 
     def loadState(self, fileName):
         with open(fileName, 'r') as f:
             state = json.load(f)
-            self.domains = set(state["domains"])
             self._processedDomains = set(state["_processedDomains"])
+            pending = [d for d in state["domains"] if d not in self._processedDomains]
+            self.queue.restore(state["domains"], pending, state.get("schedule"))
 
     def _startTaskIfNeeded(self, shallStartTask, domain):
         """
-        Starts the task if we need to start it
+        Starts the task if we need to start it and it is not started before
         It returns updated shallStartTask flag
         """
+        if shallStartTask and domain in self._startedTasks:
+            return False
         if shallStartTask:
-            if self.startBacklinkTask(domain) in [CRAWL_ALREADY_DONE, CRAWL_STARTED, CRAWL_IN_PROGRESS]:
+            taskStartCount.inc()
+            started = self.startBacklinkTask(domain)
+            if started == True or started in [CRAWL_ALREADY_DONE, CRAWL_STARTED, CRAWL_IN_PROGRESS]:
+                self._startedTasks.add(domain)
                 shallStartTask = False
             else:
                 time.sleep(2)
@@ -175,17 +353,15 @@ class BacklinksQuery(threading.Thread):
     
     def _startTaskIfNeededSafe(self, shallStartTask, domain):
         """
-        Handles TokenError and InternalServerError
+        Handles TokenError by renewing the token once.
+        InternalServerError is raised only after the retries of the api client.
         """
         try:
             return self._startTaskIfNeeded(shallStartTask, domain)
         except TokenError:
             if not self._renewTokenSafely():
                 raise TokenError()
-        except InternalServerError:
-            print("_startTaskIfNeeded gave InternalServerError. Waiting 10 seconds and trying again.")
-            time.sleep(10)
-            return self._startTaskIfNeededSafe(shallStartTask, domain)
+            return self._startTaskIfNeeded(shallStartTask, domain)
 
     def getBacklinksSafe(self, domain, shallStartTask):
         """
@@ -194,49 +370,35 @@ class BacklinksQuery(threading.Thread):
         Safe, as in handles most exceptions that may occur.
         However, if token is exhausted and cannot be renewed, raises TokenError.
         
-        Returns None if domain related error is found.
+        Returns None if domain related error is found, XXX kept giving InternalServerError
+        or the task was not ready after BQ_MAX_NOT_YET_READY_POLLS tries.
         Otherwise, it queries backlinks and handles TokenError, InternalServerError, NotYetReady appropriately.
         """
-        domainBacklinks = None
-        try:
-            shallStartTask = self._startTaskIfNeededSafe(shallStartTask, domain)
-            domainBacklinks = BacklinksQuery.getBacklinks(domain, self.authToken)
-        except TokenError:
+        tokenRenewed = False
+        notReadyCount = 0
+        while True:
             try:
-                self.authToken = self.getAuthorizationToken()     # Token has exceeded its capacity. Renew it.
-                HEADERS_BACKLINKS["Authorization"] = self.authToken
                 shallStartTask = self._startTaskIfNeededSafe(shallStartTask, domain)
-                domainBacklinks = BacklinksQuery.getBacklinks(domain, self.authToken)
+                return self.getBacklinksCached(domain)
             except TokenError:
-                # We renewed the token yet it is still not useful. Abort. 
-                self.errorCallback("BacklinksQuery could not get a valid token. Abort.")
-                raise TokenError()
+                # Token has exceeded its capacity. Renew it, but only once.
+                if tokenRenewed or not self._renewTokenSafely():
+                    # We renewed the token yet it is still not useful. Abort.
+                    self.errorCallback("BacklinksQuery could not get a valid token. Abort.")
+                    raise TokenError()
+                tokenRenewed = True
             except InternalServerError:
-                print("XXX has given InternalServerError. Retrying in 10 seconds.")
-                time.sleep(10)
-                return self.getBacklinksSafe(domain, True)
+                print("XXX kept giving InternalServerError for domain '%s'. Skipping." % domain)
+                return None
             except NotYetReady:
+                notYetReadyCount.inc()
+                notReadyCount += 1
+                if notReadyCount == BQ_MAX_NOT_YET_READY_POLLS:
+                    print("ERROR: %s NotYetReady errors are received for domain '%s'. Skipping." % (notReadyCount, domain))
+                    return None
                 print("NotYetReady error received. Waiting for %s seconds and retrying without restarting task." % BQ_NOT_YET_READY_WAIT_SECS)
                 time.sleep(BQ_NOT_YET_READY_WAIT_SECS)
-                try:
-                    #shallStartTask = self._startTaskIfNeeded(True, domain)
-                    domainBacklinks = self.getBacklinksSafe(domain, False)
-                except NotYetReady:
-                    print("ERROR: A second NotYetReady error is received for domain '%s'. Skipping.", domain)
-        except InternalServerError:
-            print("XXX has given InternalServerError. Retrying in 10 seconds.")
-            time.sleep(10)
-            shallStartTask = self._startTaskIfNeededSafe(shallStartTask, domain)
-            return self.getBacklinksSafe(domain, True)
-        except NotYetReady:
-            print("NotYetReady error received. Waiting for %s seconds and retrying without restarting task." % BQ_NOT_YET_READY_WAIT_SECS)
-            time.sleep(BQ_NOT_YET_READY_WAIT_SECS)
-            try:
-                #shallStartTask = self._startTaskIfNeeded(True, domain)
-                domainBacklinks = self.getBacklinksSafe(domain, False)
-            except NotYetReady:
-                print("ERROR: A second NotYetReady error is received. Skipping.")
-        return domainBacklinks
+                shallStartTask = False
 
     def startBacklinkTask(self, domain):
         """
@@ -245,21 +407,23 @@ class BacklinksQuery(threading.Thread):
         
         Returns
         CRAWL_ALREADY_DONE, CRAWL_STARTED, CRAWL_IN_PROGRESS: Do not start the task for this domain again
-        True: Returned 200
+        True: Returned 200 with any other status. The task is started too.
+        Another status: XXX did not start the task, it shall be started again
         Otherwise raises relevant exception
         """
         BACKLINK_TASK_DATA["domain"] = domain
-        resp = requests.post(BACKLINKS_TASK_URL, headers=HEADERS_BACKLINKS, json=BACKLINK_TASK_DATA)
+        resp = self.apiClient.post(BACKLINKS_TASK_URL, headers=HEADERS_BACKLINKS, json=BACKLINK_TASK_DATA)
+        if resp.status_code == 500 or resp.status_code == 502:
+            raise InternalServerError()
         print("DEBUG Domain: '%s', Task Response: " % domain, resp.text)
         obj = json.loads(resp.text)
-        try:
-            # Returns one of
-            # CRAWL_ALREADY_DONE, CRAWL_STARTED, CRAWL_IN_PROGRESS
-            return obj["status"]
-        except KeyError:
-            pass
+        status = obj.get("status") if isinstance(obj, dict) else None
+        if status in [CRAWL_ALREADY_DONE, CRAWL_STARTED, CRAWL_IN_PROGRESS]:
+            return status
         if resp.status_code == 200:
             return True
+        if status != None:
+            return status
         elif resp.status_code == 429:
             print("DEBUG: Token expired at startBacklinkTask call")
             raise TokenError()
@@ -271,15 +435,21 @@ class BacklinksQuery(threading.Thread):
 
     def getBacklinkOverview(self, domain):
         """
-        Requires backlink task to have been started.
+        Requires backlink task to have been started, unless the overview is cached.
         
         Returns
         {"domainAuthority": 1, "backlinks": 2, "refDomains": 3, "refDomainsGovEdu": 4, "follow": 5, "noFollow": 6, "domainTraffic": 7}
+        or None if it is not cached in cache only mode
         """
+        overview = self.backlinkCache.get(domain, OVERVIEW)
+        cacheLookupCount.inc(kind=OVERVIEW, result="hit" if overview != None else "miss")
+        if overview != None or self.backlinkCache.cacheOnly:
+            return overview
         url = BACKLINKS_OVERVIEW_URL.replace("%DOMAIN%", domain)
-        resp = requests.get(url, headers=HEADERS_BACKLINKS)
+        resp = self.apiClient.get(url, headers=HEADERS_BACKLINKS)
         if resp.status_code == 200:
             obj = json.loads(resp.text)
+            self.backlinkCache.put(domain, OVERVIEW, obj)
             return obj
         elif resp.status_code == 500 or resp.status_code == 502:
             raise InternalServerError()
@@ -291,8 +461,11 @@ class BacklinksQuery(threading.Thread):
     def checkDomainValidity(self, domain):
         """
         Uses getBacklinkOverview. Thus it requires backlink task to have been started.
+        Domains without an overview in cache only mode are not valid.
         """
         overview = self.getBacklinkOverview(domain)
+        if overview == None:
+            return False
         if overview["domainAuthority"] < BACKLINK_DOMAIN_FILTER["domainAuthority"]:
             return True
         if overview["backlinks"] < BACKLINK_DOMAIN_FILTER["backlinks"]:
@@ -304,20 +477,14 @@ class BacklinksQuery(threading.Thread):
         return False
 
     def getAuthorizationToken(self):
-        # If we have tokens supplied, use them for debugging purposes.
-        if len(self.tokens) != 0:
-            print("DEBUG: Using user supplied token")
-            return self.tokens.pop()
-        print("Requesting recaptcha token")
-        recaptcha_token = BacklinksQuery.requestReCaptchaV2Token()
-        print("Requesting authorization token")
-        if len(self.proxies) != 0:
-            proxy = self.proxies.pop()
-            print("Using proxy for token request: ", proxy)
-            return BacklinksQuery.requestAuthorizationToken(recaptcha_token, proxy)
-        else:
-            print("Requesting token via our IP")
-            return BacklinksQuery.requestAuthorizationToken(recaptcha_token)
+        """
+        Takes a token from the token pool, waiting if none is ready yet.
+        Raises TokenError if no more tokens can be obtained.
+        """
+        try:
+            return self.tokenPool.get()
+        except TokenPoolExhausted:
+            raise TokenError()
     
     @staticmethod
     def requestAuthorizationToken(recaptcha_token, proxy=None):
@@ -327,9 +494,9 @@ class BacklinksQuery(threading.Thread):
         """
         url = GET_TOKEN_URL.replace("%RECAPTCHA_TOKEN%", recaptcha_token)
         if proxy != None:
-            resp = requests.get(url, headers=HEADERS, proxies=proxy)
+            resp = getSession().get(url, headers=HEADERS, proxies=proxy)
         else:
-            resp = requests.get(url, headers=HEADERS)
+            resp = getSession().get(url, headers=HEADERS)
         if resp.status_code == 403:
             # It is a web token
             obj = json.loads(resp.text)
@@ -346,10 +513,24 @@ class BacklinksQuery(threading.Thread):
         bearerToken = "Bearer " + obj["token"]
         return bearerToken
 
+    def getBacklinksCached(self, domain):
+        """
+        getBacklinks behind the backlink cache.
+        In cache only mode, returns None for the domains that are not cached.
+        """
+        backlinks = self.backlinkCache.get(domain, BACKLINKS)
+        cacheLookupCount.inc(kind=BACKLINKS, result="hit" if backlinks != None else "miss")
+        if backlinks != None or self.backlinkCache.cacheOnly:
+            return backlinks
+        backlinks = BacklinksQuery.getBacklinks(domain, self.authToken, self.apiClient)
+        if backlinks != None:
+            self.backlinkCache.put(domain, BACKLINKS, backlinks)
+        return backlinks
+
     @staticmethod
-    def getBacklinks(domain, authToken):
+    def getBacklinks(domain, authToken, apiClient=requests):
         """
-        Queries XXX for backlinks
+        Queries XXX for backlinks, sending the request with 'apiClient'.
         Throws TokenError if an error related to token is found.
         Returns None if an error related to requested domain was found.
         
@@ -357,7 +538,7 @@ class BacklinksQuery(threading.Thread):
         """
         url = BACKLINKS_REQ_URL.replace("%DOMAIN%", domain)
         HEADERS_BACKLINKS["Authorization"] = authToken
-        resp = requests.get(url, headers=HEADERS_BACKLINKS)
+        resp = apiClient.get(url, headers=HEADERS_BACKLINKS)
         if resp.status_code == 400:
             obj = json.loads(resp.text)
             if obj["description"] == "Task was not started":
@@ -413,5 +594,18 @@ class BacklinksQuery(threading.Thread):
             print("Timeout Exception: ", e)
             print("Sleeping for 5 seconds and trying again.")
             time.sleep(5)
-            return requestReCaptchaV2Token(attempt+1)
+            return BacklinksQuery.requestReCaptchaV2Token(attempt+1)
         return ""
+
+class DefaultTokenService:
+    """
+    Token service of the token pool that solves captchas with 2captcha and requests tokens from XXX.
+    """
+    def solveCaptcha(self):
+        captcha = BacklinksQuery.requestReCaptchaV2Token()
+        if captcha == "":
+            raise TokenError()
+        return captcha
+
+    def requestToken(self, captcha, proxy=None):
+        return BacklinksQuery.requestAuthorizationToken(captcha, proxy)
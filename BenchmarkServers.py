@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Local stand-in servers for benchmark.py: synthetic websites and a fake SEO API.
+Runs in its own process, so that serving does not compete with the scrapers for the GIL
+and does not run under gevent.
+
+python3 BenchmarkServers.py '{"sites": 20, ...}'
+prints one json line with the addresses of the servers, then serves till stdin is closed.
+"""
+import sys
+import json
+import random
+import threading
+import time
+import zlib
+import socket
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import parse
+
+DEFAULTS = {
+    "seed": 1,
+    "sites": 20,                    # How many synthetic websites to serve
+    "pages": 50,                    # Pages per website, including the index
+    "fanout": 8,                    # Internal links on a page
+    "externalsPerPage": 2,          # External links on a page
+    "pageBytes": 8192,              # Pages are padded to about this size
+    "sitemapRatio": 0.5,            # Ratio of the websites having a sitemap listed in robots.txt
+    "slowSites": 2,                 # How many websites answer slowly
+    "slowDelay": 0.05,              # Seconds a slow website waits before each answer
+    "errorSites": 1,                # How many websites answer some pages with 500
+    "errorRatio": 0.2,              # Ratio of the pages an erroring website answers with 500
+    "backlinksPerDomain": 20,       # Backlinks the fake API returns for a domain
+    "notReadyPolls": 1,             # Backlink queries of a domain answered "not yet ready" first
+    "api429Ratio": 0.05,            # Ratio of the API requests answered 429 with Retry-After
+    "api500Ratio": 0.05,            # Ratio of the API requests answered 500
+}
+
+class SyntheticSite:
+    """
+    Pages of a generated website. The same seed and index always give the same pages and links.
+    """
+    def __init__(self, settings, index, port, sitePorts):
+        self.settings = settings
+        self.index = index
+        self.host = "127.0.0.1:%s" % port
+        rng = random.Random("%s-site-%s" % (settings["seed"], index))
+        self.hasSitemap = rng.random() < settings["sitemapRatio"]
+        self.delay = settings["slowDelay"] if index < settings["slowSites"] else 0
+        self.errorRatio = settings["errorRatio"] if settings["slowSites"] <= index < settings["slowSites"] + settings["errorSites"] else 0
+        self.sitePorts = sitePorts
+
+    def pagePath(self, page):
+        return "/" if page == 0 else "/p/%s" % page
+
+    def pageLinks(self, page):
+        """
+        Returns (internal paths, external urls) linked from a page.
+        """
+        settings = self.settings
+        rng = random.Random("%s-page-%s-%s" % (settings["seed"], self.index, page))
+        internals = [self.pagePath(rng.randrange(settings["pages"])) for _ in range(settings["fanout"])]
+        externals = []
+        for _ in range(settings["externalsPerPage"]):
+            if rng.random() < 0.5 and len(self.sitePorts) > 1:
+                externals.append("http://127.0.0.1:%s/" % rng.choice(self.sitePorts))
+            else:
+                externals.append("http://ext%s.example/%s" % (rng.randrange(1000), rng.randrange(100)))
+        return internals, externals
+
+    def pageHtml(self, page):
+        internals, externals = self.pageLinks(page)
+        links = "".join('<li><a href="%s">Page</a></li>' % href for href in internals + externals)
+        html = "<!DOCTYPE html><html><head><title>Site %s page %s</title></head><body><ul>%s</ul>" % (self.index, page, links)
+        padding = max(0, self.settings["pageBytes"] - len(html))
+        paragraph = "<p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>"
+        return html + paragraph * (padding // len(paragraph)) + "</body></html>"
+
+    def answer(self, path):
+        """
+        Returns (status, content type, body) for a path.
+        """
+        if self.delay != 0:
+            time.sleep(self.delay)
+        if path == "/robots.txt":
+            if not self.hasSitemap:
+                return 404, "text/plain", "Not found"
+            return 200, "text/plain", "User-agent: *\nSitemap: http://%s/sitemap.xml\n" % self.host
+        if path == "/sitemap.xml":
+            if not self.hasSitemap:
+                return 404, "text/plain", "Not found"
+            locs = "".join("<url><loc>http://%s%s</loc></url>" % (self.host, self.pagePath(page)) for page in range(self.settings["pages"]))
+            return 200, "application/xml", '<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">%s</urlset>' % locs
+        if path == "/":
+            page = 0
+        elif path.startswith("/p/") and path[3:].isdigit() and 0 < int(path[3:]) < self.settings["pages"]:
+            page = int(path[3:])
+        else:
+            return 404, "text/html", "<html><body>Not found</body></html>"
+        if self.errorRatio != 0 and zlib.crc32(path.encode()) % 1000 < self.errorRatio * 1000:
+            return 500, "text/html", "<html><body>Internal server error</body></html>"
+        return 200, "text/html; charset=utf-8", self.pageHtml(page)
+
+class FakeSeoApi:
+    """
+    Stand-in for the backlinks, task, overview and token endpoints of the SEO website.
+    Faults are injected by a seeded random generator, in the order requests arrive.
+    """
+    def __init__(self, settings):
+        self.settings = settings
+        self._rng = random.Random("%s-api" % settings["seed"])
+        self._lock = threading.Lock()
+        self._polls = {}                # domain: backlink queries so far
+        self._started = set()
+        self._tokenCount = 0
+
+    def _fault(self):
+        with self._lock:
+            roll = self._rng.random()
+        if roll < self.settings["api429Ratio"]:
+            return 429, {"Retry-After": "0"}, {"description": "Too many requests"}
+        if roll < self.settings["api429Ratio"] + self.settings["api500Ratio"]:
+            return 500, {}, {"description": "Internal server error"}
+        return None
+
+    def answer(self, method, path, body):
+        """
+        Returns (status, headers, json object) for a request.
+        """
+        parts = [parse.unquote(part) for part in path.strip("/").split("/")]
+        if parts[0] == "token":
+            with self._lock:
+                self._tokenCount += 1
+                return 200, {}, {"token": "bench-%s" % self._tokenCount}
+        fault = self._fault()
+        if fault != None:
+            return fault
+        if parts[0] == "task" and method == "POST":
+            domain = json.loads(body or "{}").get("domain")
+            with self._lock:
+                if domain in self._started:
+                    return 200, {}, {"status": "Crawl in progress"}
+                self._started.add(domain)
+            return 200, {}, {"status": "Crawl started"}
+        if parts[0] == "overview" and len(parts) == 2:
+            return 200, {}, {"domainAuthority": 10, "backlinks": 100, "refDomains": 10, "refDomainsGovEdu": 0, "follow": 80, "noFollow": 20, "domainTraffic": 1000}
+        if parts[0] == "backlinks" and len(parts) == 2:
+            domain = parts[1]
+            with self._lock:
+                polls = self._polls[domain] = self._polls.get(domain, 0) + 1
+            if polls <= self.settings["notReadyPolls"]:
+                return 200, {}, {"backlinks": [], "done": False}
+            rng = random.Random("%s-backlinks-%s" % (self.settings["seed"], domain))
+            backlinks = [{
+                "url_from": "http://ref%s.example/%s" % (rng.randrange(10000), i),
+                "url_to": "http://%s/" % domain,
+                "title": "Referring page %s" % i, "anchor": "anchor %s" % i, "nofollow": rng.random() < 0.3,
+                "inlink_rank": rng.randrange(100), "domain_inlink_rank": rng.randrange(100),
+                "first_seen": "2020-01-01", "last_visited": "2020-02-01", "date_lost": None
+            } for i in range(self.settings["backlinksPerDomain"])]
+            return 200, {}, {"backlinks": backlinks, "done": True}
+        return 404, {}, {"description": "Not found"}
+
+def _makeHandler(answer):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"           # Keep-alive, so that connection reuse shows
+
+        def setup(self):
+            BaseHTTPRequestHandler.setup(self)
+            # Headers and body are sent separately, Nagle's algorithm would delay the body
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def _reply(self, method):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length).decode("utf-8") if length != 0 else ""
+            status, headers, contentType, content = answer(method, self.path, body)
+            data = content.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", contentType)
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._reply("GET")
+
+        def do_POST(self):
+            self._reply("POST")
+
+        def log_message(self, format, *args):
+            pass
+    return Handler
+
+def _serve(answer):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _makeHandler(answer))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def startServers(settings):
+    """
+    Starts the servers in daemon threads. Returns {"sites": [domain, ...], "api": base url}.
+    """
+    settings = dict(DEFAULTS, **settings)
+    siteServers = []
+    sites = []
+    for index in range(settings["sites"]):
+        site = [None]
+        def answer(method, path, body, site=site):
+            status, contentType, content = site[0].answer(parse.urlsplit(path).path)
+            return status, {}, contentType, content
+        siteServers.append(_serve(answer))
+        sites.append(site)
+    sitePorts = [server.server_address[1] for server in siteServers]
+    for index, site in enumerate(sites):
+        site[0] = SyntheticSite(settings, index, sitePorts[index], sitePorts)
+    api = FakeSeoApi(settings)
+    def apiAnswer(method, path, body):
+        status, headers, obj = api.answer(method, parse.urlsplit(path).path, body)
+        return status, headers, "application/json", json.dumps(obj)
+    apiServer = _serve(apiAnswer)
+    return {"sites": [site[0].host for site in sites], "api": "http://127.0.0.1:%s" % apiServer.server_address[1]}
+
+if __name__ == "__main__":
+    addresses = startServers(json.loads(sys.argv[1]) if len(sys.argv) > 1 else {})
+    print(json.dumps(addresses), flush=True)
+    # Serve till the benchmark closes our stdin
+    sys.stdin.read()
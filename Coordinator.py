@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import json
+import socket
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import requests
+from SharedFrontier import SharedFrontier, STAGES
+from Scheduler import PriorityScheduler
+from HttpSession import getSession
+from ApiClient import backoffDelay
+from Metrics import registry
+from config import *
+
+leaseCount = registry.counter("dc_leased_domains_total", "Domains leased to workers, by stage")
+completedCount = registry.counter("dc_completed_domains_total", "Domains workers completed, by stage")
+
+class Coordinator:
+    """
+    Serves the SharedFrontier of a distributed run to its workers at http://host:port, with json bodies:
+    POST /put {"stage", "domains", "depth", "priorities"}, /lease {"stage", "worker", "count"}, /renew {"stage", "worker", "domains"},
+    /complete {"stage", "domain"}, /release {"stage", "worker", "domains"}, GET /stats.
+    After 'close', leases are answered with "closed", so that the workers finish.
+    port: 0 picks a free port, see 'address'.
+    """
+    def __init__(self, frontier=None, host=DC_HOST, port=DC_PORT):
+        self.frontier = frontier if frontier != None else SharedFrontier()
+        self.host = host
+        self.port = port
+        self.closed = False
+        self._server = None
+
+    def answer(self, method, path, obj):
+        """
+        Returns (status, json object) for a request.
+        """
+        frontier = self.frontier
+        if method == "GET" and path == "/stats":
+            return 200, {"closed": self.closed, "stages": frontier.counts()}
+        if method != "POST" or obj.get("stage") not in STAGES:
+            return 404, {"error": "Not found"}
+        stage = obj["stage"]
+        if path == "/put":
+            return 200, {"new": frontier.put(stage, obj["domains"], obj.get("depth", 0), obj.get("priorities"))}
+        if path == "/lease":
+            if self.closed:
+                return 200, {"domains": [], "closed": True}
+            domains = frontier.lease(stage, obj["worker"], obj["count"])
+            leaseCount.inc(len(domains), stage=stage)
+            return 200, {"domains": domains, "closed": False, "leaseSecs": frontier.leaseSecs}
+        if path == "/renew":
+            return 200, {"domains": frontier.renew(stage, obj["worker"], obj["domains"])}
+        if path == "/complete":
+            frontier.complete(stage, obj["domain"])
+            completedCount.inc(stage=stage)
+            return 200, {}
+        if path == "/release":
+            frontier.release(stage, obj["worker"], obj["domains"])
+            return 200, {}
+        return 404, {"error": "Not found"}
+
+    def start(self):
+        answer = self.answer
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    obj = json.loads(self.rfile.read(length).decode("utf-8")) if length != 0 else {}
+                    status, reply = answer(method, self.path, obj)
+                except (ValueError, KeyError, TypeError) as ex:
+                    status, reply = 400, {"error": str(ex)}
+                data = json.dumps(reply).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._reply("GET")
+
+            def do_POST(self):
+                self._reply("POST")
+
+            def log_message(self, format, *args):
+                pass
+        # Requests are answered one by one in the serving thread: sockets are patched by gevent and
+        # belong to the thread they are accepted in. Each is quick, the frontier is behind a lock anyway.
+        self._server = HTTPServer((self.host, self.port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        print("Coordinator is serving at http://%s:%s" % self.address)
+
+    @property
+    def address(self):
+        return self._server.server_address[:2] if self._server != None else (self.host, self.port)
+
+    def close(self):
+        """
+        Lets the workers finish. Keeps serving, so that they can complete and release their domains.
+        """
+        self.closed = True
+
+    def stop(self):
+        self.closed = True
+        if self._server != None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        self.frontier.close()
+
+class CoordinatorClient:
+    """
+    Requests of a worker to the coordinator. Failed requests are retried 'maxRetries' times with backoff.
+    worker: Name of the worker the leases are held by. By default host name and process id.
+    """
+    def __init__(self, url=None, worker=None, maxRetries=DC_MAX_ATTEMPTS):
+        self.url = url if url != None else "http://%s:%s" % (DC_HOST, DC_PORT)
+        self.worker = worker if worker != None else "%s-%s" % (socket.gethostname(), os.getpid())
+        self.maxRetries = maxRetries
+
+    def _request(self, method, path, obj=None):
+        attempt = 0
+        while True:
+            try:
+                resp = getSession().request(method, self.url + path, json=obj, timeout=WEBREQUEST_TIMEOUT)
+                resp.raise_for_status()
+                return resp.json()
+            except requests.exceptions.RequestException:
+                if attempt >= self.maxRetries:
+                    raise
+                time.sleep(backoffDelay(attempt, API_BACKOFF_BASE_SECS, API_BACKOFF_MAX_SECS))
+                attempt += 1
+
+    def put(self, stage, domains, depth=0, priorities=None):
+        return self._request("POST", "/put", {"stage": stage, "domains": list(domains), "depth": depth, "priorities": priorities or {}})["new"]
+
+    def lease(self, stage, count):
+        """
+        Returns the answer of the coordinator: {"domains": [[domain, depth, priority], ...], "closed": ..., "leaseSecs": ...}
+        """
+        return self._request("POST", "/lease", {"stage": stage, "worker": self.worker, "count": count})
+
+    def renew(self, stage, domains):
+        return self._request("POST", "/renew", {"stage": stage, "worker": self.worker, "domains": list(domains)})["domains"]
+
+    def complete(self, stage, domain):
+        self._request("POST", "/complete", {"stage": stage, "domain": domain})
+
+    def release(self, stage, domains):
+        self._request("POST", "/release", {"stage": stage, "worker": self.worker, "domains": list(domains)})
+
+    def stats(self):
+        return self._request("GET", "/stats")
+
+class RemoteQueue:
+    """
+    Stands in for the WorkQueue of a scraper stage in a worker of a distributed run.
+    A background thread leases domains of the stage from the coordinator, keeps up to 'batch' of them
+    ready for 'get' and renews the leases of the domains taken until they are completed.
+    Domains put go to the coordinator, which queues each of them once for the whole run. Their priorities are
+    given by 'scheduler' here, so that the coordinator need not know the overviews of the worker.
+    Leasing starts with the first 'get', a queue only put to leases nothing.
+    When the coordinator closes, the queue closes too and 'get' returns None.
+    """
+    def __init__(self, client, stage, batch=DC_LEASE_BATCH, pollSecs=DC_POLL_SECS, scheduler=None):
+        self.client = client
+        self.stage = stage
+        self.batch = batch
+        self.pollSecs = pollSecs
+        self.scheduler = scheduler if scheduler != None else PriorityScheduler()
+        self.journal = None                 # The coordinator keeps the state of the run
+        self._condition = threading.Condition()
+        self._queue = deque()
+        self._held = {}                     # Leased domains that are not completed yet: (depth, priority)
+        self._leased = {}                   # Every domain leased: (depth, priority), kept after its lease is lost or completed
+        self._closed = False
+        self._renewInterval = pollSecs
+        self._thread = None
+
+    def _leaseDomains(self):
+        lastRenewTime = time.monotonic()
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._closed or len(self._queue) < self.batch, self._renewInterval)
+                if self._closed:
+                    return
+                count = self.batch - len(self._queue)
+            try:
+                if time.monotonic() - lastRenewTime >= self._renewInterval:
+                    self._renew()
+                    lastRenewTime = time.monotonic()
+                if count <= 0:
+                    continue
+                answer = self.client.lease(self.stage, count)
+            except requests.exceptions.RequestException as ex:
+                print("ERROR: Coordinator cannot be reached. Details:")
+                print(ex)
+                self._wait(self.pollSecs)
+                continue
+            if answer["closed"]:
+                print("Coordinator is closed, %s worker is finishing" % self.stage)
+                self.close()
+                return
+            # Leases are renewed well before they expire
+            self._renewInterval = answer["leaseSecs"] / 3
+            with self._condition:
+                for domain, depth, priority in answer["domains"]:
+                    self._held[domain] = self._leased[domain] = (depth, priority)
+                    self._queue.append(domain)
+                if len(answer["domains"]) != 0:
+                    self._condition.notify(len(answer["domains"]))
+            if len(answer["domains"]) == 0:
+                self._wait(self.pollSecs)
+
+    def _wait(self, timeout):
+        with self._condition:
+            self._condition.wait_for(lambda: self._closed, timeout)
+
+    def _renew(self):
+        with self._condition:
+            held = set(self._held)
+        if len(held) == 0:
+            return
+        lost = held - set(self.client.renew(self.stage, held))
+        if len(lost) != 0:
+            # Their leases expired and they may be leased to another worker
+            with self._condition:
+                for domain in lost:
+                    self._held.pop(domain, None)
+                self._queue = deque(domain for domain in self._queue if domain not in lost)
+
+    def put(self, domains, depth=0, signals=None):
+        """
+        Queues the domains at the coordinator. Returns how many were new.
+        depth, signals: As of WorkQueue.put
+        """
+        if not self.scheduler.admits(depth):
+            return 0
+        signals = signals if signals != None else {}
+        domains = list(domains)
+        priorities = {domain: self.scheduler.priority(domain, depth, signals.get(domain)) for domain in domains}
+        return self.client.put(self.stage, domains, depth, priorities)
+
+    def get(self, timeout=None):
+        """
+        Returns the next leased domain.
+        Returns None if the queue is closed or nothing arrives in 'timeout' seconds.
+        """
+        with self._condition:
+            if self._thread == None and not self._closed:
+                self._thread = threading.Thread(target=self._leaseDomains, daemon=True)
+                self._thread.start()
+            if not self._condition.wait_for(lambda: self._closed or len(self._queue) != 0, timeout):
+                return None
+            if self._closed:
+                return None
+            domain = self._queue.popleft()
+            # Let the lease thread fill up the queue
+            self._condition.notify_all()
+            return domain
+
+    def completed(self, domain):
+        self.client.complete(self.stage, domain)
+        with self._condition:
+            self._held.pop(domain, None)
+
+    def close(self):
+        """
+        Wakes up all consumers and gives the domains not taken back to the coordinator.
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            unstarted = list(self._queue)
+            self._queue.clear()
+            for domain in unstarted:
+                self._held.pop(domain, None)
+            self._condition.notify_all()
+        if len(unstarted) != 0:
+            try:
+                self.client.release(self.stage, unstarted)
+            except requests.exceptions.RequestException:
+                # Their leases expire
+                pass
+
+    def restore(self, known, pending, schedule=None):
+        """
+        Queues the pending domains of a saved state at the coordinator, with their saved priorities.
+        """
+        schedule = schedule if schedule != None else {}
+        for domain in pending:
+            depth, priority = schedule.get(domain) or (0, 0)
+            self.client.put(self.stage, [domain], depth, {domain: priority})
+
+    def depth(self, domain):
+        """
+        Returns the hops of a domain leased by this queue from the initial domains, as given by the coordinator.
+        Known even after its lease is lost, so that the domains found on it are not put too shallow.
+        """
+        with self._condition:
+            return self._leased.get(domain, (0, 0))[0]
+
+    def priority(self, domain):
+        with self._condition:
+            return self._leased.get(domain, (0, 0))[1]
+
+    def known(self):
+        with self._condition:
+            return set(self._held)
+
+    def schedule(self):
+        with self._condition:
+            return dict(self._held)
+
+    def pending(self):
+        with self._condition:
+            return list(self._queue)
+
+    def __len__(self):
+        with self._condition:
+            return len(self._queue)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from collections import deque
+from urllib import parse
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def canonicalizeUrl(link, baseUrl=None):
+    """
+    Returns the canonical absolute form of a link, so that the same page always has the same url.
+    Relative links are resolved against baseUrl, fragments are dropped, scheme and host are lowercased,
+    default ports and trailing slashes are removed.
+    Returns None if it is not an http(s) link.
+    """
+    # Make sure there are no spaces in the link
+    link = link.strip().replace(" ", "")
+    if baseUrl != None:
+        link = parse.urljoin(baseUrl, link)
+    try:
+        parsed = parse.urlsplit(link)
+        port = parsed.port
+    except ValueError:
+        # Malformed netloc or port
+        return None
+    scheme = parsed.scheme.lower()
+    if scheme not in DEFAULT_PORTS or parsed.hostname == None:
+        return None
+    netloc = parsed.hostname
+    if ":" in netloc:
+        # IPv6 literal, which hostname gives without its brackets
+        netloc = "[%s]" % netloc
+    if port != None and port != DEFAULT_PORTS[scheme]:
+        netloc += ":%s" % port
+    path = parsed.path
+    if path == "":
+        path = "/"
+    elif len(path) > 1 and path[-1] == "/":
+        path = path.rstrip("/") or "/"
+    return parse.urlunsplit((scheme, netloc, path, parsed.query, ""))
+
+class CrawlFrontier:
+    """
+    Queue of pages to be crawled on a domain.
+    Urls are canonicalized and remembered, so that no page is queued twice.
+    """
+    def __init__(self, urls=[]):
+        self._queue = deque()
+        self._seen = set()
+        for url in urls:
+            self.add(url)
+
+    def add(self, link, baseUrl=None):
+        """
+        Queues the link if it was not seen before.
+        Returns the canonical url if queued, None otherwise.
+        """
+        url = canonicalizeUrl(link, baseUrl)
+        if url == None or url in self._seen:
+            return None
+        self._seen.add(url)
+        self._queue.append(url)
+        return url
+
+    def pop(self):
+        return self._queue.popleft()
+
+    def __len__(self):
+        return len(self._queue)
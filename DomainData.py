@@ -1,24 +1,26 @@
-from functools import *
-
 class DomainData:
-    domain = ""
-    backlinks = []
-    externals = []
+    """
+    Backlinks and external links of a domain, as read from a LinkGraph.
+    Equal and hashed by the domain, so that a set has one of each domain.
+    """
+    __slots__ = ("domain", "backlinks", "externals")
+
     def __init__(self, domain, backlinks, externals):
         self.domain = domain
         self.backlinks = backlinks
         self.externals = externals
 
     def __hash__(self):
-        """
-        Sum of ord values of chars of domain string
-        """
-        return reduce(lambda x, y: x+ord(y), self.domain, 0)
-    
+        return hash(self.domain)
+
+    def __eq__(self, other):
+        if not isinstance(other, DomainData):
+            return NotImplemented
+        return self.domain == other.domain
+
     def __str__(self):
         return """DomainData("%s", %s, %s)""" %(self.domain, self.backlinks, self.externals)
 
     def __repr__(self):
         return self.__str__()
 
-
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+from PublicSuffix import normalizeDomain, REGISTRABLE
+from config import *
+
+class DomainFilter:
+    """
+    Local checks deciding that a domain is not worth querying, before any request is sent for it.
+    A domain is blocked if it or one of its parent domains is listed, ie. listing "google.com"
+    blocks "mail.google.com" too. Ports are ignored.
+    blocked: Listed domains, by default BQ_BLOCKLIST
+    fileName: Optional file of more listed domains, one per line. Lines starting with # are comments.
+    giants: Registrable domains blocked with their subdomains, by default BQ_KNOWN_GIANTS. Only the registrable domain
+    of a domain is matched, so that the sites users have under a hosting platform, ie. "myblog.blogspot.com", are not blocked.
+    """
+    def __init__(self, blocked=BQ_BLOCKLIST, fileName=BQ_BLOCKLIST_FILE_NAME, giants=BQ_KNOWN_GIANTS):
+        self._giants = set(DomainFilter._host(domain) for domain in giants)
+        self._blocked = set(DomainFilter._host(domain) for domain in blocked)
+        if fileName != "" and os.path.isfile(fileName):
+            with open(fileName, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line != "" and not line.startswith("#"):
+                        self._blocked.add(DomainFilter._host(line))
+
+    @staticmethod
+    def _host(domain):
+        return domain.strip().lower().rstrip(".").split(":")[0]
+
+    def isBlocked(self, domain):
+        host = DomainFilter._host(domain)
+        if normalizeDomain(host, REGISTRABLE) in self._giants:
+            return True
+        labels = host.split(".")
+        return any(".".join(labels[i:]) in self._blocked for i in range(len(labels)))
+
+    def __len__(self):
+        return len(self._blocked) + len(self._giants)
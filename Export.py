@@ -1,33 +1,203 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import csv
+import os
+from collections import deque
+import threading
+import time
+from SQLiteExport import SQLiteExport
+from Metrics import registry
+
+rowCount = registry.counter("ex_rows_total", "Rows written to the output files, by file")
+flushSeconds = registry.histogram("ex_flush_seconds", "Time to write and flush a batch of rows, by file")
+
+SQLITE_EXTENSIONS = (".sqlite", ".db")
+
+def openExporter(fileName, headers, table, buffered=False, batchSize=1000, flushInterval=2, append=False):
+    """
+    Returns the exporter for the file: a SQLiteExport for .sqlite and .db files, an Export for csv files.
+    table: Table of the SQLite database the rows go to
+    """
+    if fileName.endswith(SQLITE_EXTENSIONS):
+        # Databases are always appended to
+        return SQLiteExport(fileName, table, batchSize)
+    return Export(fileName, headers, buffered, batchSize, flushInterval, append)
 
 class Export:
-    def __init__(self, fileName, headers):
-        self.csvfile = open(fileName, 'w', newline='', encoding='utf-8')
+    """
+    Writes rows to a csv file.
+    buffered: If True, rows are queued and written by a dedicated writer thread. It flushes after every
+    'batchSize' rows, or 'flushInterval' seconds after the first unflushed row, whichever comes first.
+    Otherwise every row is written and flushed right away.
+    In buffered mode, 'close' or 'flush' must be called to be sure queued rows are on the disk.
+    append: If True and the file exists, rows are appended to it. A row left partially written
+    by a crash is dropped first.
+    """
+    def __init__(self, fileName, headers, buffered=False, batchSize=1000, flushInterval=2, append=False):
+        append = append and os.path.isfile(fileName) and Export.dropPartialRow(fileName) != 0
+        self.csvfile = open(fileName, 'a' if append else 'w', newline='', encoding='utf-8')
+        self.name = os.path.basename(fileName)
         #self.writer = csv.writer(self.csvfile, delimiter=' ', quotechar='|', quoting=csv.QUOTE_MINIMAL)
         if type(headers) == list:
         	self.dictwriter = csv.DictWriter(self.csvfile, headers)
-        	self.dictwriter.writeheader()
+        	if not append:
+        		self.dictwriter.writeheader()
         else:
         	# Headers are an object
         	self.dictwriter = csv.DictWriter(self.csvfile, headers.keys())
-        	self.writerow(headers)
+        	if not append:
+        		self.dictwriter.writerow(headers)
+        self.csvfile.flush()
+        self.buffered = buffered
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self._rows = deque()
+        self._condition = threading.Condition()
+        self._firstRowTime = None
+        self._queuedCount = 0                   # Rows queued since the beginning
+        self._flushedCount = 0                  # Rows flushed since the beginning
+        self._flushRequested = False
+        self._callbacks = deque()               # (rows queued when it was given, callback) of afterWritten
+        self._closing = False
+        self._error = None                      # Exception the writer thread stopped with
+        self._writer = None
+        if buffered:
+            self._writer = threading.Thread(target=self._write, daemon=True)
+            self._writer.start()
+
+    @staticmethod
+    def dropPartialRow(fileName):
+        """
+        Truncates the file after its last complete csv record. Returns the new size.
+        Records are found with the csv module, so a row cut inside a quoted field that holds a newline is dropped too.
+        """
+        end = 0
+        with open(fileName, 'r+b') as f:
+            consumed = [0, False]               # Bytes of the lines read, and whether the last one is complete
+
+            def lines():
+                for line in f:
+                    consumed[0] += len(line)
+                    consumed[1] = line.endswith(b"\n")
+                    yield line.decode("utf-8")
+            try:
+                for _ in csv.reader(lines(), strict=True):
+                    if consumed[1]:
+                        end = consumed[0]
+            except (csv.Error, UnicodeDecodeError):
+                # Partially written before a crash
+                pass
+            if end != f.seek(0, os.SEEK_END):
+                f.truncate(end)
+        return end
 
     def writerow(self, obj):
-        self.dictwriter.writerow(obj)
-        self.csvfile.flush()
-    
+        rowCount.inc(file=self.name)
+        if self.buffered:
+            with self._condition:
+                if self._error != None:
+                    raise self._error
+                if len(self._rows) == 0:
+                    self._firstRowTime = time.time()
+                self._rows.append(obj)
+                self._queuedCount += 1
+                if len(self._rows) == 1 or len(self._rows) >= self.batchSize:
+                    self._condition.notify_all()
+        else:
+            with flushSeconds.time(file=self.name):
+                self.dictwriter.writerow(obj)
+                self.csvfile.flush()
+
+    def flush(self):
+        """
+        Returns after all the rows written so far are flushed.
+        """
+        if self.csvfile == None:
+            return
+        if self.buffered:
+            with self._condition:
+                target = self._queuedCount
+                self._flushRequested = True
+                self._condition.notify_all()
+                self._condition.wait_for(lambda: self._flushedCount >= target or self._error != None)
+                if self._error != None:
+                    raise self._error
+        else:
+            self.csvfile.flush()
+
+    def afterWritten(self, callback):
+        """
+        Calls 'callback' once the rows written so far are flushed to the file, right away if they are.
+        In buffered mode it is called by the writer thread.
+        """
+        if self.buffered:
+            with self._condition:
+                if self._flushedCount < self._queuedCount:
+                    self._callbacks.append((self._queuedCount, callback))
+                    return
+        callback()
+
+    def _isBatchReady(self):
+        if self._closing or self._flushRequested or len(self._rows) >= self.batchSize:
+            return True
+        return len(self._rows) != 0 and time.time() - self._firstRowTime >= self.flushInterval
+
+    def _write(self):
+        """
+        Writer thread. Writes and flushes queued rows in batches.
+        If it fails, the exception is kept and raised by 'writerow', 'flush' and 'close' from then on.
+        """
+        try:
+            while True:
+                with self._condition:
+                    while not self._isBatchReady():
+                        if len(self._rows) == 0:
+                            self._condition.wait()
+                        else:
+                            self._condition.wait(self.flushInterval - (time.time() - self._firstRowTime))
+                    rows = self._rows
+                    self._rows = deque()
+                    self._flushRequested = False
+                    closing = self._closing
+                with flushSeconds.time(file=self.name):
+                    for row in rows:
+                        self.dictwriter.writerow(row)
+                    self.csvfile.flush()
+                with self._condition:
+                    self._flushedCount += len(rows)
+                    callbacks = []
+                    while len(self._callbacks) != 0 and self._callbacks[0][0] <= self._flushedCount:
+                        callbacks.append(self._callbacks.popleft()[1])
+                    self._condition.notify_all()
+                for callback in callbacks:
+                    callback()
+                if closing:
+                    return
+        except Exception as ex:
+            print("ERROR: Writing to '%s' has failed. Details:" % self.name)
+            print(ex)
+            with self._condition:
+                self._error = ex
+                self._condition.notify_all()
+
     def close(self):
         if self.csvfile != None:
+            if self.buffered:
+                # Writer flushes the queued rows before it quits
+                with self._condition:
+                    self._closing = True
+                    self._condition.notify_all()
+                self._writer.join()
             self.csvfile.close()
             self.csvfile = None
-    
+            if self._error != None:
+                raise self._error
+
     def __del__(self):
         self.close()
-    
+
     def __enter__(self):
         return self
-    
+
     def __exit__(self, exc_type, exc_value, traceback):
         self.close()
@@ -2,18 +2,45 @@
 # -*- coding: utf-8 -*-
 import threading
 import time
+import collections
 from config import *
 import twocaptcha
 import os, re
-from bs4 import BeautifulSoup
 import json
-from DomainData import DomainData
+from LinkGraph import LinkGraph
 from functools import *
 from urllib import parse
-import urllib
-from Export import Export
-import lxml
+from Export import openExporter
+from WorkQueue import WorkQueue
+from PublicSuffix import normalizeDomain
+from HttpCache import HttpCache
+from HttpSession import getSession
+from Metrics import registry, DOMAIN_BUCKETS
+from CrawlFrontier import CrawlFrontier, canonicalizeUrl
+from SitemapReader import iterSitemapPages
+from lxml import etree
+import LinkExtractor
+from LinkExtractor import extractLinks, extractClassifiedLinks
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import itertools
 from Utils import *
+import gevent
+import gevent.queue
+from gevent.pool import Pool, Group
+from gevent.lock import BoundedSemaphore
+
+requestCount = registry.counter("em_requests_total", "Pages requested by externals mapper, by result")
+requestsInFlight = registry.gauge("em_requests_in_flight", "Pages being fetched by externals mapper")
+requestSeconds = registry.histogram("em_request_seconds", "Time to fetch a page, including its body")
+parseSeconds = registry.histogram("em_parse_seconds", "Time to go through the links of a page, including parsing unless a parse process did it")
+parseProcessSeconds = registry.histogram("em_parse_process_seconds", "Time a page waited for and was parsed by a parse process")
+domainCount = registry.counter("em_domains_total", "Domains processed by externals mapper, by result")
+domainSeconds = registry.histogram("em_domain_seconds", "Time to search external links of a domain", DOMAIN_BUCKETS)
+externalLinkCount = registry.counter("em_external_links_total", "External links found by externals mapper")
+queueDepth = registry.gauge("em_queue_depth", "Domains waiting for externals mapper")
+domainsInProgress = registry.gauge("em_domains_in_progress", "Domains being crawled by externals mapper")
+domainDeadlineCount = registry.counter("em_domain_deadlines_total", "Domains whose external link search was cut short by EM_MAX_TIME_FOR_DOMAIN")
 
 class TooManyExceptionsError(Exception):
     def __init__(self):
@@ -22,253 +49,387 @@ class TooManyExceptionsError(Exception):
 class ExternalsMapper(threading.Thread):
     """
     Searches external links for given domains and saves found data.
-    data: is a set of DomainData having external link information
+    graph: LinkGraph the external links found are added to. If not given, a new one is made.
     domains: is a set of domains to search external links on
-    onBacklinkSearchDomainFound: is a callback that is called when new external links are found.
+    queue: WorkQueue the domains are taken from. If not given, one is made of 'domains'.
+    onBacklinkSearchDomainFound: is a callback that is called when new external links are found, with the
+    domains, their depth and {domain: signals} for their priorities, see PriorityScheduler.
     If not set, domains are printed instead.
     exLinkLimit: When -1, there is no limit. Otherwise when 'exLinkLimit' many external link found or
     when our resources are exhausted, external link search for that domain finishes.
-    exportFileName: Name of the csv file which has external links info
+    exportFileName: Name of the csv file, or the SQLite database if it ends with .sqlite or .db, which has external links info
+    httpCache: HttpCache of crawled pages. By default the one configured in config.py is used.
+    append: If True, the export file is appended to instead of being overwritten, ie. when resuming.
     
     errorCallback: Currently called only when an unexpected error occurred and the state has to be saved.
+
+    Up to EM_CONCURRENT_DOMAINS domains are crawled at the same time, each in its own greenlet.
+    All of them share at most EM_MAX_CONNECTIONS open connections, sitemaps and robots.txt included.
+    A domain is given EM_MAX_TIME_FOR_DOMAIN seconds in all. Then its requests in flight are cancelled
+    and the external links found so far are kept.
+    If EM_PARSE_PROCESSES is not 0, pages are parsed by that many processes while this thread keeps fetching.
+    At most EM_PARSE_QUEUE_SIZE pages wait for them, fetching pauses till they catch up.
     """
     
     FIELDNAMES = ["of_domain", "url_to"]
     MAX_EXCEPTION_COUNT = EM_MAX_EXCEPTION_COUNT
+    MAX_TIME_FOR_DOMAIN = EM_MAX_TIME_FOR_DOMAIN
     
-    def __init__(self, domains, exLinkLimit, exportFileName):
+    def __init__(self, domains, exLinkLimit, exportFileName, queue=None, httpCache=None, append=False, graph=None):
         threading.Thread.__init__(self)
-        self.domains = set(domains)
-        self.data = set()
-        self._processedDomains = set()
-        self.onBacklinkSearchDomainFound = print
+        self.queue = queue if queue != None else WorkQueue(domains)
+        self.graph = graph if graph != None else LinkGraph()
+        # Domains the journal of the queue has seen completed are not processed again
+        self._processedDomains = set(self.queue.journal.processed) if self.queue.journal != None else set()
+        self.onBacklinkSearchDomainFound = lambda domains, depth, signals: print(domains)
         self.errorCallback = print
         self.exLinkLimit = exLinkLimit
-        self.exporter = Export(exportFileName, ExternalsMapper.FIELDNAMES)
-        self.exceptionCount = 0
+        self.exporter = openExporter(exportFileName, ExternalsMapper.FIELDNAMES, "externallinks", EX_BUFFERED, EX_BATCH_SIZE, EX_FLUSH_INTERVAL_SECS, append)
         self._stopSignalReceived = False
+        self._connectionSlots = None
+        self._session = None
+        self._parsePool = None
+        self._parseSlots = None
+        self.httpCache = httpCache if httpCache != None else HttpCache()
+        self._nonHtmlUrls = {}                          # Domain being crawled: {url: content type} of the pages that need not be fetched again
+        queueDepth.setFunction(lambda: len(self.queue))
     
     def stop(self):
         self._stopSignalReceived = True
+        self.queue.close()
 
     def setOnBacklinkSearchDomainFoundCallback(self, callback):
         self.onBacklinkSearchDomainFound = callback
     
-    def onExternalSearchDomainFound(self, domains):
-        self.feed(domains)
+    def onExternalSearchDomainFound(self, domains, depth=0, signals=None):
+        self.feed(domains, depth, signals)
 
     def setErrorCallback(self, callback):
         self.errorCallback = callback
 
     def run(self):
         try:
+            # gevent primitives belong to the hub of the thread they are created in
+            # Each domain may hold one for its sitemap while it waits for another one for its pages
+            self._connectionSlots = BoundedSemaphore(max(EM_MAX_CONNECTIONS, EM_CONCURRENT_DOMAINS + 1))
+            # Connections are kept alive and reused by all the domains being crawled
+            self._session = getSession()
+            domainPool = Pool(EM_CONCURRENT_DOMAINS)
+            domainsInProgress.setFunction(lambda: len(domainPool))
+            if EM_PARSE_PROCESSES > 0:
+                self._parseSlots = BoundedSemaphore(EM_PARSE_QUEUE_SIZE)
+                # Forking a thread running gevent is not safe, parse processes start afresh
+                self._parsePool = ProcessPoolExecutor(EM_PARSE_PROCESSES, multiprocessing.get_context("spawn"))
+                # Each page waiting for a parse process holds a thread of the hub
+                hub = gevent.get_hub()
+                hub.threadpool.maxsize = max(hub.threadpool.maxsize, EM_PARSE_QUEUE_SIZE)
             while not self._stopSignalReceived:
-                toBeProcessed = self.domains.difference(self._processedDomains)
-                if len(toBeProcessed) == 0:
+                if len(domainPool) == 0:
                     print("ExternalsMapper is waiting for input")
-                    time.sleep(5)
-                    continue
-                #newBacklinkSearchDomains = []
-                for domain in toBeProcessed:
-                    domainExternals = self.getExternalLinks(domain)
-                    #self.data.add(DomainData(domain, [], domainExternals))
-                    for exlink in domainExternals:
-                        self.exporter.writerow({"of_domain": domain, "url_to": exlink})
-                    if len(domainExternals) != 0:
-                        searchDomains = list(map(lambda x: parse.urlparse(x).netloc, domainExternals))
-                        self.onBacklinkSearchDomainFound(searchDomains)
-                    self._processedDomains.add(domain)                          # They are now processed
-                #self.onBacklinkSearchDomainFound(newBacklinkSearchDomains)
+                    # Nothing is being crawled, so block till a domain arrives
+                    domain = self.queue.get()
+                else:
+                    # Blocking this thread would block the crawls too
+                    domain = self.queue.get(timeout=0)
+                    if domain == None:
+                        gevent.wait(list(domainPool), timeout=EM_QUEUE_POLL_SECS, count=1)
+                        continue
+                if domain == None:
+                    # Queue is closed
+                    break
+                # Blocks while EM_CONCURRENT_DOMAINS domains are being crawled
+                domainPool.spawn(self._processDomain, domain)
+            # Let the domains in progress finish
+            domainPool.join()
+        except Exception as ex:
+            self.errorCallback(ex)
+        finally:
+            if self._parsePool != None:
+                self._parsePool.shutdown()
+
+    def _processDomain(self, domain):
+        """
+        Searches external links of a domain and reports them as soon as the domain is finished.
+        """
+        try:
+            with domainSeconds.time():
+                domainExternals = self.getExternalLinks(domain)
+            externalLinkCount.inc(len(domainExternals))
+            self.graph.addExternals(domain, domainExternals)
+            for exlink in domainExternals:
+                self.exporter.writerow({"of_domain": domain, "url_to": exlink})
+            if len(domainExternals) != 0:
+                # Domains linked more often and from domains of higher priority are queried first
+                links = collections.Counter(map(normalizeDomain, domainExternals))
+                parentPriority = self.queue.priority(domain)
+                signals = {found: {"links": count, "parentPriority": parentPriority} for found, count in links.items()}
+                self.onBacklinkSearchDomainFound(list(links), self.queue.depth(domain) + 1, signals)
+            self._markProcessed(domain)                          # It is now processed
+            self.httpCache.flush()
+            domainCount.inc(result="done")
         except Exception as ex:
+            domainCount.inc(result="failed")
+            self.stop()
             self.errorCallback(ex)
 
+    def _markProcessed(self, domain):
+        self._processedDomains.add(domain)
+        # Journaled as completed only once its rows are on the disk, so that a crash cannot lose them
+        self.exporter.afterWritten(lambda: self.queue.completed(domain))
+
     def saveState(self, fileName):
-        ext = {"domains": list(self.domains), "_processedDomains": list(self._processedDomains)}
+        ext = {"domains": list(self.queue.known()), "_processedDomains": list(self._processedDomains), "schedule": self.queue.schedule()}
         with open(fileName, 'w') as f:
             json.dump(ext, f)
 
     def loadState(self, fileName):
         with open(fileName, 'r') as f:
             state = json.load(f)
-            self.domains = set(state["domains"])
             self._processedDomains = set(state["_processedDomains"])
+            pending = [d for d in state["domains"] if d not in self._processedDomains]
+            self.queue.restore(state["domains"], pending, state.get("schedule"))
 
-    def feed(self, domains):
+    def feed(self, domains, depth=0, signals=None):
         """
         Adds domains to be queried
         """
         print("ExternalsMapper is fed")
-        self.domains = self.domains.union(domains)
+        self.queue.put(domains, depth, signals)
 
-    def getExternalLinksWithSitemap(self, domain):
+    def getExternalLinksWithSitemap(self, domain, exlinks=None, deadline=None):
         """
         Returns a set of external links
         or None if no sitemap
+        exlinks, deadline: As of '_crawl'
         """
-        url = SITEMAP_REQ_URL.replace("%DOMAIN%", domain)
-        try:
-            resp = requests.get(url, headers=HEADERS, timeout=WEBREQUEST_TIMEOUT)
-        except requests.exceptions.ConnectionError as ex:
-            print("DEBUG: Url '%s' caused connection error" % url)
-            return None
-        except requests.exceptions.ReadTimeout as ex:
-            print("Url '%s' caused read time out" % url)
-            return None
-        if resp.status_code != 200:
-            # Not found
-            return None
-        internalLinks = set()
-        try:
-            soup = BeautifulSoup(resp.text.encode("utf8"), "lxml")
-        except:
-            print("ERROR WITH BeautifulSoup -------------- ABORT DOMAIN: ", domain)
+        pages = iterSitemapPages(domain, deadline, self._connectionSlots)
+        firstPage = next(pages, None)
+        if firstPage == None:
+            # No sitemap or an empty one
             return None
-        for loc in soup.find_all("loc"):
-            internalLinks.add(loc.text)
-        externalLinks = set()
         # Process each internal link for external links
-        internalLinks = list(filter(lambda l: "text/html" in self.getContentType(self.convertToAbsoluteLink(url, l)), internalLinks))
-        rs = (grequests.get(il, headers=HEADERS, timeout=WEBREQUEST_TIMEOUT) for il in internalLinks)
-        try:
-            self.exceptionCount = 0
-            startTime = time.time()
-            for resp in grequests.imap(rs, exception_handler=self.exception_handler):
-                elapsed = time.time() - startTime
-                if elapsed > EM_MAX_TIME_FOR_DOMAIN:
-                    # This domain has exceeded its time span
-                    print("Domain '%s' has exceeded its time span of %s with its total time %s"%(domain, EM_MAX_TIME_FOR_DOMAIN, elapsed))
-                    print("Skipping domain")
-                    return externalLinks
-                try:
-                    html = BeautifulSoup(resp.text.encode("utf8"), "html.parser")
-                except:
-                    print("ERROR WITH BeautifulSoup -------------- SKIP")
-                    continue
-                # Iterate over all inlinks
-                for link in html.findAll('a'):
-                    target = link.get("href")
-                    if target == None:
-                        continue
-                    if ExternalsMapper.classifyLink(target, domain) == True:
-                        externalLinks.add(target)
-                        if len(externalLinks) == self.exLinkLimit:
-                            return externalLinks
-        except TooManyExceptionsError:
-                print("Domain %s caused too many errors while searching for its external links. Skipping." % domain)
-        return externalLinks
+        return self._crawl(domain, CrawlFrontier([firstPage]), False, pages, exlinks, deadline)
     
-    def getContentType(self, url):
-        try:
-            r = urllib.request.urlopen(url, timeout=WEBREQUEST_TIMEOUT)
-        except Exception as ex:
-            # Assume it is html
-            print("DEBUG: Urllib content type check failed. Assuming it is html. Url: ", url)
-            print("Details:")
-            print(ex)
-            return "text/html"
-        try:
-            return r.info()["content-type"]
-        except KeyError:
-            return ""
+    @staticmethod
+    def isHtml(resp):
+        """
+        Decides from the response headers. Pages without a content type are assumed to be html.
+        """
+        return "text/html" in resp.headers.get("content-type", "text/html")
 
-    def convertToAbsoluteLink(self, domainUrl, link):
-        """If the link is relative, converts it to absolute link"""
-        # Make sure there are no spaces in the link
-        link = link.replace(" ", "")
-        parsed = parse.urlparse(link)
-        if parsed.netloc == "":
-            if domainUrl[-1] == "/" and link[0] == "/":
-                return domainUrl + link[1:]
-            return domainUrl+link
-        else:
-            return link
-            
-    def getExternalLinksWithIndex(self, domain):
+    def getExternalLinksWithIndex(self, domain, exlinks=None, deadline=None):
         """
         Start from index page and scan internal links and repeat
         On internal pages, scan external links and return them as a set
+        exlinks, deadline: As of '_crawl'
         """
         url = INDEX_REQ_URL.replace("%DOMAIN%", domain)
-        exlinks = set()
-        inlinks = set([url])
-        traversed = []
-        startTime = time.time()
-        while True:
-            toBeTraversed = inlinks.difference(traversed)   
-            if len(toBeTraversed) == 0:
-                break
-            #print("toBeTraversed: ", toBeTraversed)
-            toBeTraversed = list(filter(lambda l: "text/html" in self.getContentType(self.convertToAbsoluteLink(url, l)), toBeTraversed))
-            rs = (grequests.get(il, headers=HEADERS, timeout=WEBREQUEST_TIMEOUT) for il in toBeTraversed)
-            try:
-                self.exceptionCount = 0
-                for resp in grequests.imap(rs, exception_handler=self.exception_handler):
-                    elapsed = time.time() - startTime
-                    if elapsed > EM_MAX_TIME_FOR_DOMAIN:
-                        # This domain has exceeded its time span
-                        print("Domain '%s' has exceeded its time span of %s with its total time %s"%(domain, EM_MAX_TIME_FOR_DOMAIN, elapsed))
-                        print("Skipping domain")
-                        return exlinks
-                    try:
-                        html = BeautifulSoup(resp.text.encode("utf8"), "html.parser")
-                    except Exception as ex:
-                        print("ERROR WITH BeautifulSoup -------------- Skipping url '%s'"%resp.url)
-                        print("Details:")
-                        printException(ex)
+        return self._crawl(domain, CrawlFrontier([url]), True, None, exlinks, deadline)
+
+    def _crawl(self, domain, frontier, followInlinks, seeds=None, exlinks=None, deadline=None):
+        """
+        Fetches the pages in the frontier and returns the set of external links found on them.
+        followInlinks: If true, internal links found are added to the frontier too.
+        seeds: An iterator of more pages, consumed only when the frontier runs out.
+        exlinks: Set the external links are added to as they are found, so that they are kept if the crawl is cut short.
+        deadline: Deadline of the domain. Request timeouts are capped by the time left.
+        
+        Up to EM_MAX_CONNECTIONS_PER_DOMAIN pages are fetched at a time. As soon as a page is parsed,
+        its new internal links are scheduled, without waiting for the other pages in flight.
+        """
+        exlinks = exlinks if exlinks != None else set()
+        deadline = deadline if deadline != None else Deadline()
+        exceptionHandler = self._makeExceptionHandler()
+        fetched = gevent.queue.Queue()
+        inFlight = Group()
+        pending = 0                                     # Requests sent whose responses are not processed yet
+        try:
+            while True:
+                while pending < EM_MAX_CONNECTIONS_PER_DOMAIN:
+                    if len(frontier) == 0:
+                        seed = next(seeds, None) if seeds != None else None
+                        if seed == None:
+                            break
+                        frontier.add(seed)
+                        continue
+                    il = frontier.pop()
+                    if il in self._nonHtmlUrls.get(domain, ()):
                         continue
-                    # Iterate over all inlinks
-                    for link in html.findAll('a'):
-                        target = link.get("href")
-                        if target == None:
-                            continue
-                        linkClass = ExternalsMapper.classifyLink(target, domain)
-                        if linkClass == False:
-                            inlinks.add(target)
-                        elif linkClass == True:
-                            exlinks.add(target)
-                            #print(str(len(exlinks)), str(self.exLinkLimit))
-                            if len(exlinks) == self.exLinkLimit:
-                                return exlinks
-                traversed.extend(toBeTraversed)
-            except TooManyExceptionsError:
-                print("Domain %s caused too many errors while searching its external links. Skipping." % domain)
-                return exlinks
+                    request = grequests.get(il, headers=HEADERS, timeout=deadline.timeout(WEBREQUEST_TIMEOUT), session=self._session)
+                    request.cachedPage = self.httpCache.get(il)
+                    request.parsedLinks = None
+                    request.parseException = None
+                    if request.cachedPage != None:
+                        # Revalidate, so that an unchanged page is neither downloaded nor parsed
+                        request.kwargs["headers"] = dict(HEADERS, **HttpCache.conditionalHeaders(request.cachedPage))
+                    inFlight.spawn(self._send, request, fetched, domain)
+                    pending += 1
+                if pending == 0:
+                    break
+                request = fetched.get()
+                pending -= 1
+                if request.response is None:
+                    exceptionHandler(request, request.exception)
+                    continue
+                resp = request.response
+                if resp.status_code != 304 and not ExternalsMapper.isHtml(resp):
+                    continue
+                try:
+                    with parseSeconds.time():
+                        # Iterate over all inlinks
+                        for target, linkClass in self._classifiedLinks(request, domain):
+                            if linkClass == False:
+                                if followInlinks:
+                                    frontier.add(target)
+                            elif linkClass == True:
+                                exlinks.add(target)
+                                if len(exlinks) == self.exLinkLimit:
+                                    return exlinks
+                except (etree.LxmlError, LookupError) as ex:
+                    print("ERROR WITH lxml -------------- Skipping url '%s'"%request.url)
+                    print("Details:")
+                    printException(ex)
+        except TooManyExceptionsError:
+            print("Domain %s caused too many errors while searching its external links. Skipping." % domain)
+        finally:
+            # Do not wait for the pages we no longer need
+            inFlight.kill(block=False)
         return exlinks
 
+    def _classifiedLinks(self, request, domain):
+        """
+        Returns (link, classifyLink(link, domain, page url)) pairs of the canonical links found on a fetched page.
+        Links are resolved against and classified by the final url of the page, after redirects.
+        Pages answered with 304 Not Modified are not parsed, their links come from the http cache.
+        Pages parsed by a parse process come with their links classified already.
+        Pages having an ETag or Last-Modified header are parsed completely and cached.
+        Others are parsed lazily, so that the crawl can stop in the middle of a page.
+        """
+        resp = request.response
+        if resp.status_code == 304 and request.cachedPage != None:
+            return ((link, ExternalsMapper.classifyLink(link, domain, resp.url)) for link in request.cachedPage["links"])
+        if request.parseException != None:
+            raise request.parseException
+        etag = resp.headers.get("etag")
+        lastModified = resp.headers.get("last-modified")
+        if request.parsedLinks != None:
+            inlinks, exlinks = request.parsedLinks
+            if etag != None or lastModified != None:
+                self.httpCache.put(request.url, etag, lastModified, inlinks + exlinks)
+            return itertools.chain(((link, False) for link in inlinks), ((link, True) for link in exlinks))
+        links = (canonicalizeUrl(target, resp.url) for target in extractLinks(resp.content, resp.url, resp.encoding))
+        links = (link for link in links if link != None)
+        if etag != None or lastModified != None:
+            links = list(links)
+            self.httpCache.put(request.url, etag, lastModified, links)
+        return ((link, ExternalsMapper.classifyLink(link, domain, resp.url)) for link in links)
+
+    def _send(self, request, fetched, domain):
+        """
+        Sends the request holding one of the connection slots shared by all domains,
+        then puts it to 'fetched' queue.
+        The body is downloaded only if the headers say it is an html page.
+        If there are parse processes, the page is parsed by one of them before it is put to the queue.
+        The request is put to the queue whatever happens, so that the crawl does not wait for it. Unexpected
+        errors, ie. of a broken parse pool, leave it without a response and with the error in 'request.exception'.
+        """
+        try:
+            with self._connectionSlots:
+                requestsInFlight.inc()
+                try:
+                    self._fetch(request, domain)
+                finally:
+                    # Also when the crawl of the domain is cut short and this greenlet is killed
+                    requestsInFlight.dec()
+            resp = request.response
+            if self._parsePool != None and resp is not None and resp.status_code != 304 and ExternalsMapper.isHtml(resp):
+                # The connection is free for another page while this one is parsed
+                try:
+                    request.parsedLinks = self._parse(resp, domain)
+                except (etree.LxmlError, LookupError) as ex:
+                    request.parseException = ex
+        except Exception as ex:
+            request.response = None
+            request.exception = ex
+        finally:
+            fetched.put(request)
+
+    def _fetch(self, request, domain):
+        """
+        Sends the request. Downloads the body only if it is an html page.
+        """
+        startTime = time.monotonic()
+        request.send(stream=True)
+        resp = request.response
+        result = "error"
+        if resp is not None:
+            if resp.status_code == 304:
+                # Not modified, there is no body. Reading it returns the connection to the pool.
+                resp.content
+                result = "not_modified"
+            elif ExternalsMapper.isHtml(resp):
+                try:
+                    resp.content
+                    result = "ok"
+                except Exception as ex:
+                    request.response = None
+                    request.exception = ex
+            else:
+                self._nonHtmlUrls.setdefault(domain, {})[request.url] = resp.headers["content-type"]
+                resp.close()
+                result = "not_html"
+        requestSeconds.observe(time.monotonic() - startTime)
+        requestCount.inc(result=result)
+
+    def _parse(self, resp, domain):
+        """
+        Returns (inlinks, exlinks) of the page, parsed by a parse process.
+        Waits for a free place when EM_PARSE_QUEUE_SIZE pages are already waiting.
+        """
+        with self._parseSlots, parseProcessSeconds.time():
+            future = self._parsePool.submit(extractClassifiedLinks, resp.content, resp.url, resp.encoding, domain)
+            # Waiting in a thread of the hub lets the other greenlets run meanwhile
+            return gevent.get_hub().threadpool.spawn(future.result).get()
+
     def getExternalLinks(self, domain):
         """
         Returns a set of external links of a domain
+        Sitemaps and pages share the MAX_TIME_FOR_DOMAIN seconds of the domain. When they are over,
+        the search is interrupted wherever it waits and the external links found so far are returned.
         """
         print("External links of domain %s is being looked up"%domain)
-        results = self.getExternalLinksWithSitemap(domain)
-        if results != None:
-            return results
-        return self.getExternalLinksWithIndex(domain)
-    
-    def exception_handler(self, req="", ex="No detail is given."):
-        self.exceptionCount += 1
-        print("Exception in request with grequests. Skipping this request. Details:")
-        print(ex)
-        if self.exceptionCount == ExternalsMapper.MAX_EXCEPTION_COUNT:
-            # Let 'getExternalLinksWithIndex' handle this.
-            raise TooManyExceptionsError()
+        exlinks = set()
+        deadline = Deadline(self.MAX_TIME_FOR_DOMAIN)
+        # Raised in this greenlet, ie. while it waits for a response or a sitemap
+        timer = gevent.Timeout(self.MAX_TIME_FOR_DOMAIN)
+        timer.start()
+        try:
+            if self.getExternalLinksWithSitemap(domain, exlinks, deadline) == None:
+                self.getExternalLinksWithIndex(domain, exlinks, deadline)
+        except gevent.Timeout as ex:
+            if ex is not timer:
+                raise
+            domainDeadlineCount.inc()
+            print("Domain '%s' has exceeded its time span of %s seconds, keeping the %s external links found" % (domain, self.MAX_TIME_FOR_DOMAIN, len(exlinks)))
+        finally:
+            timer.cancel()
+            # Kept only while the domain is crawled, not to grow through the whole run
+            self._nonHtmlUrls.pop(domain, None)
+        return exlinks
     
-    @staticmethod
-    def classifyLink(link, domain):
+    def _makeExceptionHandler(self):
         """
-        Returns
-        True: Exlink
-        False: Inlink
-        None: Not a proper link
+        Returns a grequests exception handler with its own exception count,
+        so that domains crawled at the same time do not skip each other.
         """
-        obj = parse.urlparse(link)
-        linkDomain = obj.netloc
-        path = obj.path
-        if path == "" and linkDomain == "":
-            return None
-        elif path != "" and (linkDomain == "" or linkDomain == domain):
-            #print("inlink: ", link)
-            return False
-        else:
-            #print("exlink: ", link)
-            return True
+        exceptionCount = [0]
+        def exception_handler(req="", ex="No detail is given."):
+            exceptionCount[0] += 1
+            print("Exception in request with grequests. Skipping this request. Details:")
+            print(ex)
+            if exceptionCount[0] == ExternalsMapper.MAX_EXCEPTION_COUNT:
+                # Let '_crawl' handle this.
+                raise TooManyExceptionsError()
+        return exception_handler
+    
+    classifyLink = staticmethod(LinkExtractor.classifyLink)
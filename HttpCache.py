@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sqlite3
+import threading
+import time
+import json
+from config import *
+
+class HttpCache:
+    """
+    On disk cache of crawled pages, kept in a single SQLite file.
+    Instead of the body, the validators of a page (ETag, Last-Modified) and the links found on it are kept.
+    A page is revalidated with If-None-Match/If-Modified-Since and on 304 its cached links are used.
+    fileName: SQLite file of the cache. ":memory:" keeps it only for this run.
+    commitEvery: Stored pages are committed in batches of this size, or on flush.
+    """
+    def __init__(self, fileName=HC_FILE_NAME, commitEvery=HC_COMMIT_EVERY):
+        self.commitEvery = commitEvery
+        self._uncommitted = 0
+        self._lock = threading.Lock()
+        # Used by the scraper thread, created in the main thread
+        self._db = sqlite3.connect(fileName, check_same_thread=False)
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, links TEXT NOT NULL, stored_at REAL NOT NULL)""")
+
+    def get(self, url):
+        """
+        Returns {"etag": ..., "lastModified": ..., "links": [...]} of the page, or None if it is not cached.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT etag, last_modified, links FROM pages WHERE url = ?", (url,)).fetchone()
+        if row == None:
+            return None
+        return {"etag": row[0], "lastModified": row[1], "links": json.loads(row[2])}
+
+    def put(self, url, etag, lastModified, links):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)", (url, etag, lastModified, json.dumps(links), time.time()))
+            self._uncommitted += 1
+            if self._uncommitted >= self.commitEvery:
+                self._commit()
+
+    def flush(self):
+        with self._lock:
+            self._commit()
+
+    def _commit(self):
+        self._db.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        with self._lock:
+            self._commit()
+            self._db.close()
+
+    @staticmethod
+    def conditionalHeaders(page):
+        """
+        Returns the request headers that revalidate a cached page.
+        """
+        headers = {}
+        if page["etag"] != None:
+            headers["If-None-Match"] = page["etag"]
+        if page["lastModified"] != None:
+            headers["If-Modified-Since"] = page["lastModified"]
+        return headers
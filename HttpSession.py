@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+import time
+import socket
+from requests.adapters import HTTPAdapter
+from config import *
+
+class DnsCache:
+    """
+    In process cache of socket.getaddrinfo answers, so that a host is resolved once per 'ttl' seconds
+    instead of once per connection. Failed lookups are not cached.
+    At most 'maxSize' answers are kept, the oldest ones are dropped first.
+    """
+    def __init__(self, ttl=HS_DNS_CACHE_TTL_SECS, maxSize=HS_DNS_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxSize = maxSize
+        self._answers = {}                  # key: (expiry time, answer), oldest first
+        self._lock = threading.Lock()
+        self._getaddrinfo = None
+
+    def install(self):
+        """
+        Puts the cache in front of socket.getaddrinfo, which every connection of requests resolves with.
+        """
+        with self._lock:
+            if self._getaddrinfo != None:
+                return
+            self._getaddrinfo = socket.getaddrinfo
+            socket.getaddrinfo = self.getaddrinfo
+
+    def getaddrinfo(self, *args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._answers.get(key)
+            if entry != None and entry[0] > now:
+                return entry[1]
+        # Not resolved while holding the lock, greenlets of the same thread would wait for it forever
+        answer = self._getaddrinfo(*args, **kwargs)
+        with self._lock:
+            self._answers.pop(key, None)
+            self._answers[key] = (now + self.ttl, answer)
+            while len(self._answers) > self.maxSize:
+                del self._answers[next(iter(self._answers))]
+        return answer
+
+    def clear(self):
+        with self._lock:
+            self._answers.clear()
+
+dnsCache = DnsCache()
+_sessions = threading.local()
+
+def makeSession(poolHosts=HS_POOL_HOSTS, poolSizePerHost=HS_POOL_SIZE_PER_HOST):
+    """
+    Returns a requests session keeping alive up to 'poolSizePerHost' connections to each of
+    'poolHosts' hosts, so that TLS handshakes are not repeated for every request.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=poolHosts, pool_maxsize=poolSizePerHost)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def getSession():
+    """
+    Returns the session of the calling thread, making it on the first call.
+    Sessions are not shared between threads: gevent patches the queues of the connection pools,
+    which then belong to the hub of a single thread. Greenlets of a thread share its session.
+    The DNS cache is shared by all of them.
+    """
+    session = getattr(_sessions, "session", None)
+    if session == None:
+        if HS_DNS_CACHE_TTL_SECS > 0:
+            dnsCache.install()
+        session = makeSession()
+        _sessions.session = session
+    return session
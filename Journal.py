@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+import time
+import json
+import os
+from config import *
+
+ENQUEUED = "E"
+COMPLETED = "C"
+
+class Journal:
+    """
+    Append-only journal of the domains a scraper stage queued and completed, for resuming a run.
+    Records are appended as they happen and fsync'd in batches, every 'fsyncEvery' records or
+    'fsyncInterval' seconds. After 'compactEvery' records, the state is written to a snapshot file
+    (in the format of saveState) and the journal starts over, so a restart only replays the tail.
+    fileName: Journal file. The snapshot is kept next to it with the .snapshot suffix.
+    resume: If True, the state of the previous run is loaded. Otherwise the old journal is discarded.
+    """
+    def __init__(self, fileName, resume=False, fsyncEvery=JN_FSYNC_EVERY, fsyncInterval=JN_FSYNC_INTERVAL_SECS, compactEvery=JN_COMPACT_EVERY):
+        self.fileName = fileName
+        self.snapshotFileName = fileName + ".snapshot"
+        self.fsyncEvery = fsyncEvery
+        self.fsyncInterval = fsyncInterval
+        self.compactEvery = compactEvery
+        self.known = {}                     # Domains in the order they were queued. A dict keeps the order.
+        self.schedule = {}                  # Domain: (depth, priority) it was queued with
+        self.processed = set()
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._lastSyncTime = time.time()
+        self._recordCount = 0               # Records since the last compaction
+        if resume:
+            self._load()
+        else:
+            for name in [self.fileName, self.snapshotFileName]:
+                if os.path.isfile(name):
+                    os.remove(name)
+        self._file = open(self.fileName, 'a', encoding='utf-8')
+
+    def pending(self):
+        """
+        Returns queued domains that are not completed yet, in the order they were queued.
+        """
+        with self._lock:
+            return [domain for domain in self.known if domain not in self.processed]
+
+    def enqueued(self, domains):
+        """
+        domains: Domains, or {domain: (depth, priority)} to be recorded with their schedule
+        """
+        schedule = domains if isinstance(domains, dict) else {}
+        with self._lock:
+            for domain in domains:
+                self.known[domain] = None
+                if domain in schedule:
+                    self.schedule[domain] = tuple(schedule[domain])
+                    self._append(ENQUEUED, [domain, *schedule[domain]])
+                else:
+                    self._append(ENQUEUED, domain)
+
+    def completed(self, domain):
+        with self._lock:
+            self.processed.add(domain)
+            self._append(COMPLETED, domain)
+
+    def _append(self, kind, record):
+        if self._file == None:
+            # Closed, scrapers are finishing up
+            return
+        self._file.write(kind + json.dumps(record) + "\n")
+        self._unsynced += 1
+        self._recordCount += 1
+        if self._recordCount >= self.compactEvery:
+            self._compact()
+        elif self._unsynced >= self.fsyncEvery or time.time() - self._lastSyncTime >= self.fsyncInterval:
+            self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._lastSyncTime = time.time()
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def _compact(self):
+        """
+        Writes the state to the snapshot file, then empties the journal.
+        The snapshot is replaced atomically, so a crash in between loses nothing.
+        """
+        self._sync()
+        tempFileName = self.snapshotFileName + ".tmp"
+        with open(tempFileName, 'w', encoding='utf-8') as f:
+            json.dump({"domains": list(self.known), "_processedDomains": list(self.processed), "schedule": self.schedule}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tempFileName, self.snapshotFileName)
+        self._file.close()
+        self._file = open(self.fileName, 'w', encoding='utf-8')
+        self._recordCount = 0
+
+    def _load(self):
+        if os.path.isfile(self.snapshotFileName):
+            with open(self.snapshotFileName, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+                self.known = dict.fromkeys(state["domains"])
+                self.processed = set(state["_processedDomains"])
+                self.schedule = {domain: tuple(entry) for domain, entry in state.get("schedule", {}).items()}
+        if not os.path.isfile(self.fileName):
+            return
+        validLength = 0
+        with open(self.fileName, 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Partially written before a crash
+                    break
+                try:
+                    kind, record = line[:1].decode(), json.loads(line[1:])
+                except ValueError:
+                    break
+                if kind == ENQUEUED and isinstance(record, list):
+                    domain, *entry = record
+                    self.known[domain] = None
+                    self.schedule[domain] = tuple(entry)
+                elif kind == ENQUEUED:
+                    # Recorded before domains had a schedule
+                    self.known[record] = None
+                elif kind == COMPLETED:
+                    self.processed.add(record)
+                validLength += len(line)
+                self._recordCount += 1
+        # Drop what could not be replayed, so that new records are not appended to a broken line
+        with open(self.fileName, 'r+b') as f:
+            f.truncate(validLength)
+
+    def close(self):
+        with self._lock:
+            if self._file != None:
+                self._sync()
+                self._file.close()
+                self._file = None
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from lxml import etree
+from urllib import parse
+from CrawlFrontier import canonicalizeUrl
+from PublicSuffix import normalizeDomain
+
+def extractLinks(content, pageUrl=None, encoding=None):
+    """
+    Yields href values of <a> tags while the page is being parsed, without building a soup of it.
+    content: Raw bytes of the page, or an iterable of byte chunks of it.
+    pageUrl: Url of the page. If the page has a <base href>, relative links following it
+    are resolved against it. Otherwise links are yielded as they are written.
+    encoding: Encoding of the page, ie. from its http headers. If None, lxml guesses it.
+    """
+    if isinstance(content, (bytes, bytearray)):
+        content = [content]
+    parser = etree.HTMLPullParser(events=("start",), tag=("a", "base"), encoding=encoding)
+    base = None
+    def links():
+        nonlocal base
+        for _, element in parser.read_events():
+            href = element.get("href")
+            if href == None:
+                continue
+            if element.tag == "base":
+                if base == None:
+                    # Only the first base element counts
+                    base = parse.urljoin(pageUrl or "", href.strip())
+            elif base != None:
+                yield parse.urljoin(base, href.strip())
+            else:
+                yield href
+    for chunk in content:
+        parser.feed(chunk)
+        yield from links()
+    try:
+        parser.close()
+    except etree.LxmlError:
+        # Empty or broken page, what could be parsed is already yielded
+        return
+    yield from links()
+
+def classifyLink(link, domain, pageUrl=None):
+    """
+    Returns
+    True: Exlink
+    False: Inlink
+    None: Not a proper link
+    Links to the same normalized domain are inlinks, ie. to "www.example.com" from "example.com".
+    pageUrl: Final url of the page the link is on. Links to its host are inlinks too, as the domain
+    may have redirected there, ie. from "example.com" to "www.example.com" or to another domain.
+    """
+    obj = parse.urlparse(link)
+    linkDomain = obj.netloc
+    path = obj.path
+    pageDomain = None
+    if pageUrl != None:
+        pageUrl = canonicalizeUrl(pageUrl)
+        pageDomain = parse.urlparse(pageUrl).netloc if pageUrl != None else None
+    if path == "" and linkDomain == "":
+        return None
+    elif path != "" and (linkDomain == "" or linkDomain == domain or linkDomain == pageDomain or normalizeDomain(linkDomain) == normalizeDomain(domain)):
+        #print("inlink: ", link)
+        return False
+    else:
+        #print("exlink: ", link)
+        return True
+
+def extractClassifiedLinks(content, pageUrl, encoding, domain):
+    """
+    Parses a whole page and returns (inlinks, exlinks) of it, as lists of canonical links.
+    Runs in the parse processes, so it takes and returns only picklable values.
+    """
+    inlinks = []
+    exlinks = []
+    for target in extractLinks(content, pageUrl, encoding):
+        link = canonicalizeUrl(target, pageUrl)
+        if link == None:
+            continue
+        linkClass = classifyLink(link, domain, pageUrl)
+        if linkClass == False:
+            inlinks.append(link)
+        elif linkClass == True:
+            exlinks.append(link)
+    return inlinks, exlinks
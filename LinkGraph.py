@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import struct
+import threading
+from array import array
+from DomainData import DomainData
+from PublicSuffix import normalizeDomain
+from config import *
+
+MAGIC = b"SEOLINKGRAPH"
+VERSION = 2                             # 2 added the generation. Files of version 1 are of generation 0.
+NOFOLLOW = 1                            # Flag of an edge
+ID_TYPE = "I"                           # 4 bytes on the platforms we run on, up to 4 billion domains or urls
+JOURNAL_SUFFIX = ".journal"
+EXTERNALS = "E"                         # Kinds of the journal records
+BACKLINKS = "B"
+GENERATION = "G"                        # First record of a journal: generation of the saved graph its links are on top of
+
+class Interner:
+    """
+    Gives each distinct string an integer id, in the order they are first seen, so that
+    each string is kept once and edges refer to it with a 4 byte id.
+    """
+    __slots__ = ("_ids", "_values")
+
+    def __init__(self, values=()):
+        self._ids = {}
+        self._values = []
+        for value in values:
+            self.id(value)
+
+    def id(self, value):
+        """
+        Returns the id of the value, giving it a new one if it is not seen before.
+        """
+        id = self._ids.get(value)
+        if id == None:
+            id = self._ids[value] = len(self._values)
+            self._values.append(value)
+        return id
+
+    def get(self, value):
+        """
+        Returns the id of the value, or None if it is not seen before.
+        """
+        return self._ids.get(value)
+
+    def value(self, id):
+        return self._values[id]
+
+    def __len__(self):
+        return len(self._values)
+
+    def __iter__(self):
+        return iter(self._values)
+
+class EdgeList:
+    """
+    Edges between domains and urls in parallel arrays. The i'th edge is
+    (domainIds[i], urlIds[i]) with the NOFOLLOW etc. bits of flags[i].
+    """
+    __slots__ = ("domainIds", "urlIds", "flags")
+
+    def __init__(self):
+        self.domainIds = array(ID_TYPE)
+        self.urlIds = array(ID_TYPE)
+        self.flags = array("B")
+
+    def append(self, domainId, urlId, flags=0):
+        self.domainIds.append(domainId)
+        self.urlIds.append(urlId)
+        self.flags.append(flags)
+
+    def urlIdsOf(self, domainId):
+        """
+        Returns the url ids of the edges of a domain. Scans all the edges.
+        """
+        urlIds = self.urlIds
+        return [urlIds[i] for i, id in enumerate(self.domainIds) if id == domainId]
+
+    def __len__(self):
+        return len(self.domainIds)
+
+class LinkGraph:
+    """
+    Thread safe in memory graph of the links found by both scrapers.
+    Domains and urls are interned, and each url knows the normalized domain it is on, so that
+    the domain graph can be built from the edges without parsing urls again.
+    externals: Edges from a domain to the external urls found on its pages
+    backlinks: Edges from a domain to the urls linking to it
+    With a journal open, see openJournal, the links added are recorded to it as well.
+    generation: How many times the graph was saved to the file of its journal
+    """
+    __slots__ = ("domains", "urls", "urlDomainIds", "externals", "backlinks", "generation", "_lock", "_journal", "_journalFileName")
+
+    def __init__(self):
+        self.domains = Interner()
+        self.urls = Interner()
+        self.urlDomainIds = array(ID_TYPE)          # Domain id of each url id
+        self.externals = EdgeList()
+        self.backlinks = EdgeList()
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._journal = None
+        self._journalFileName = None
+
+    def _urlId(self, url):
+        id = self.urls.get(url)
+        if id == None:
+            id = self.urls.id(url)
+            self.urlDomainIds.append(self.domains.id(normalizeDomain(url)))
+        return id
+
+    def addExternals(self, domain, urls):
+        """
+        Adds the external urls found on the pages of a domain.
+        """
+        with self._lock:
+            domainId = self.domains.id(domain)
+            urls = list(urls)
+            for url in urls:
+                self.externals.append(domainId, self._urlId(url))
+            self._record(EXTERNALS, [domain, urls])
+
+    def addBacklinks(self, domain, backlinks):
+        """
+        Adds the urls linking to a domain.
+        backlinks: (url, nofollow) pairs
+        """
+        with self._lock:
+            domainId = self.domains.id(domain)
+            backlinks = [(url, bool(nofollow)) for url, nofollow in backlinks]
+            for url, nofollow in backlinks:
+                self.backlinks.append(domainId, self._urlId(url), NOFOLLOW if nofollow else 0)
+            self._record(BACKLINKS, [domain, backlinks])
+
+    def _record(self, kind, record):
+        if self._journal != None:
+            # Flushed right away, so that the links are on the disk before the domain is journaled completed
+            self._journal.write(kind + json.dumps(record) + "\n")
+            self._journal.flush()
+
+    def openJournal(self, fileName, resume=False):
+        """
+        Records the links added from now on to an append-only journal next to the graph file, so that
+        a run that stops before the graph is saved loses none of them. Saving the graph to the file empties the journal.
+        fileName: Graph file. The journal is kept next to it with the .journal suffix.
+        resume: If True, the links of the journal are added to the graph first. Otherwise the old journal is discarded.
+        The links are added only if the journal is of the generation of the graph. Otherwise the graph was saved
+        with them, but the journal was not emptied before a crash.
+        """
+        journalFileName = fileName + JOURNAL_SUFFIX
+        validLength = 0
+        if resume and os.path.isfile(journalFileName):
+            with open(journalFileName, 'rb') as f:
+                generation = 0                  # Of journals written before the graph was saved
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # Partially written before a crash
+                        break
+                    try:
+                        kind, record = line[:1].decode(), json.loads(line[1:])
+                        if kind == GENERATION:
+                            generation = int(record)
+                        elif generation == self.generation:
+                            domain, links = record
+                            if kind == EXTERNALS:
+                                self.addExternals(domain, links)
+                            elif kind == BACKLINKS:
+                                self.addBacklinks(domain, links)
+                    except (ValueError, TypeError):
+                        break
+                    validLength += len(line)
+            if generation != self.generation:
+                validLength = 0
+        with self._lock:
+            self._journal = open(journalFileName, 'a' if resume else 'w', encoding='utf-8')
+            # Drop what could not be replayed, so that new records are not appended to a broken line
+            self._journal.truncate(validLength)
+            self._journalFileName = journalFileName
+            if validLength == 0:
+                self._record(GENERATION, self.generation)
+
+    def syncJournal(self):
+        with self._lock:
+            if self._journal != None:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+
+    def closeJournal(self):
+        with self._lock:
+            if self._journal != None:
+                self._journal.close()
+                self._journal = None
+
+    def _urlsOf(self, edges, domain):
+        with self._lock:
+            domainId = self.domains.get(domain)
+            if domainId == None:
+                return []
+            return [self.urls.value(id) for id in edges.urlIdsOf(domainId)]
+
+    def externalsOf(self, domain):
+        return self._urlsOf(self.externals, domain)
+
+    def backlinksOf(self, domain):
+        return self._urlsOf(self.backlinks, domain)
+
+    def domainData(self, domain):
+        return DomainData(domain, self.backlinksOf(domain), self.externalsOf(domain))
+
+    def urlDomain(self, url):
+        """
+        Returns the normalized domain of a url in the graph, or None if it is not in the graph.
+        """
+        with self._lock:
+            id = self.urls.get(url)
+            return self.domains.value(self.urlDomainIds[id]) if id != None else None
+
+    def edgeCount(self):
+        with self._lock:
+            return len(self.externals) + len(self.backlinks)
+
+    def save(self, fileName):
+        """
+        Writes the graph in a binary format. The file is replaced atomically.
+        If the journal of the file is open, the file is of the next generation and the journal starts over with it,
+        as the file has all its links now.
+        """
+        tempFileName = fileName + ".tmp"
+        with self._lock:
+            ownJournal = self._journal != None and self._journalFileName == fileName + JOURNAL_SUFFIX
+            generation = self.generation + 1 if ownJournal else self.generation
+            with open(tempFileName, 'wb') as f:
+                f.write(MAGIC)
+                f.write(struct.pack("<IQ", VERSION, generation))
+                for interner in (self.domains, self.urls):
+                    _writeStrings(f, interner)
+                _writeArray(f, self.urlDomainIds)
+                for edges in (self.externals, self.backlinks):
+                    for values in (edges.domainIds, edges.urlIds, edges.flags):
+                        _writeArray(f, values)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tempFileName, fileName)
+            self.generation = generation
+            if ownJournal:
+                self._journal.seek(0)
+                self._journal.truncate()
+                self._record(GENERATION, generation)
+
+    @staticmethod
+    def load(fileName, urls=True):
+        """
+        Returns the graph saved to a file.
+        urls: If False, url strings are skipped and only their ids are loaded, ie. when only the domain graph is needed.
+        Raises ValueError if the file is not a saved graph.
+        """
+        graph = LinkGraph()
+        with open(fileName, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("'%s' is not a link graph file" % fileName)
+            version, = struct.unpack("<I", f.read(4))
+            if version not in (1, VERSION):
+                raise ValueError("Link graph file '%s' has the unknown version %s" % (fileName, version))
+            if version != 1:
+                graph.generation, = struct.unpack("<Q", f.read(8))
+            graph.domains = _readStrings(f)
+            graph.urls = _readStrings(f, urls)
+            graph.urlDomainIds = _readArray(f, ID_TYPE)
+            for edges in (graph.externals, graph.backlinks):
+                edges.domainIds = _readArray(f, ID_TYPE)
+                edges.urlIds = _readArray(f, ID_TYPE)
+                edges.flags = _readArray(f, "B")
+        return graph
+
+def _writeArray(f, values):
+    """
+    Writes the length and the little endian items of an array.
+    """
+    f.write(struct.pack("<BQ", values.itemsize, len(values)))
+    if sys.byteorder == "big" and values.itemsize > 1:
+        values = array(values.typecode, values)
+        values.byteswap()
+    values.tofile(f)
+
+def _readArray(f, typecode):
+    itemsize, length = struct.unpack("<BQ", f.read(9))
+    values = array(typecode)
+    if itemsize != values.itemsize:
+        raise ValueError("Link graph file has %s byte items instead of %s" % (itemsize, values.itemsize))
+    values.fromfile(f, length)
+    if sys.byteorder == "big" and values.itemsize > 1:
+        values.byteswap()
+    return values
+
+def _writeStrings(f, interner):
+    """
+    Writes the strings of an interner as an array of their utf-8 lengths and the joined bytes, in id order.
+    """
+    encoded = [value.encode("utf-8") for value in interner]
+    _writeArray(f, array(ID_TYPE, map(len, encoded)))
+    blob = b"".join(encoded)
+    f.write(struct.pack("<Q", len(blob)))
+    f.write(blob)
+
+def _readStrings(f, decode=True):
+    lengths = _readArray(f, ID_TYPE)
+    size, = struct.unpack("<Q", f.read(8))
+    if not decode:
+        f.seek(size, os.SEEK_CUR)
+        return Interner()
+    blob = f.read(size)
+    interner = Interner()
+    offset = 0
+    for length in lengths:
+        interner.id(blob[offset:offset + length].decode("utf-8"))
+        offset += length
+    return interner
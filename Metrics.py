@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+import time
+import json
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import *
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DOMAIN_BUCKETS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600)
+
+def _labelKey(labels):
+    return tuple(sorted(labels.items()))
+
+def _formatLabels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if len(pairs) == 0:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join("%s=\"%s\"" % (name, value) for (name, _), value in zip(pairs, escaped)) + "}"
+
+def _formatValue(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """
+    Values of a metric, one for each combination of labels it is updated with.
+    """
+    kind = "untyped"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def value(self, **labels):
+        """
+        Returns the value for the labels. Without labels, returns the sum of the values of all labels.
+        """
+        with self._lock:
+            if len(labels) == 0:
+                return sum(self._values.values())
+            return self._values.get(_labelKey(labels), 0)
+
+    def samples(self):
+        """
+        Returns (name suffix, labels key, extra labels, value) tuples for the text format.
+        """
+        with self._lock:
+            return [("", key, (), value) for key, value in self._values.items()]
+
+    def snapshot(self):
+        with self._lock:
+            return [{"labels": dict(key), "value": value} for key, value in self._values.items()]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _labelKey(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. With 'setFunction', it is read from the function when collected.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help):
+        Metric.__init__(self, name, help)
+        self._function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_labelKey(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _labelKey(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def setFunction(self, function):
+        self._function = function
+
+    def _collect(self):
+        if self._function != None:
+            self.set(self._function())
+
+    def samples(self):
+        self._collect()
+        return Metric.samples(self)
+
+    def snapshot(self):
+        self._collect()
+        return Metric.snapshot(self)
+
+class Histogram(Metric):
+    """
+    Counts observed values, ie. latencies in seconds, in cumulative buckets, with their sum and count.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        Metric.__init__(self, name, help)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = _labelKey(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry == None:
+                entry = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["buckets"][i] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def value(self, **labels):
+        """
+        Returns how many values are observed for the labels, or for all labels if none given.
+        """
+        with self._lock:
+            if len(labels) == 0:
+                return sum(entry["count"] for entry in self._values.values())
+            entry = self._values.get(_labelKey(labels))
+            return entry["count"] if entry != None else 0
+
+    def time(self, **labels):
+        """
+        Returns a context manager observing how long its block takes.
+        """
+        return _Timer(self, labels)
+
+    def samples(self):
+        with self._lock:
+            samples = []
+            for key, entry in self._values.items():
+                for bound, count in zip(self.buckets, entry["buckets"]):
+                    samples.append(("_bucket", key, (("le", _formatValue(bound)),), count))
+                samples.append(("_sum", key, (), entry["sum"]))
+                samples.append(("_count", key, (), entry["count"]))
+            return samples
+
+    def snapshot(self):
+        with self._lock:
+            return [{"labels": dict(key), "count": entry["count"], "sum": entry["sum"],
+                     "buckets": {_formatValue(bound): count for bound, count in zip(self.buckets, entry["buckets"])}}
+                    for key, entry in self._values.items()]
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.startTime = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.monotonic() - self.startTime, **self.labels)
+
+class Registry:
+    """
+    Metrics of the running scrapers by name. Asking for a metric that exists returns it.
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric == None:
+                metric = self._metrics[name] = cls(name, help, *args)
+            return metric
+
+    def counter(self, name, help):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help):
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, buckets)
+
+    def metrics(self):
+        with self._lock:
+            return sorted(self._metrics.values(), key=lambda metric: metric.name)
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text format.
+        """
+        lines = []
+        for metric in self.metrics():
+            lines.append("# HELP %s %s" % (metric.name, metric.help))
+            lines.append("# TYPE %s %s" % (metric.name, metric.kind))
+            for suffix, key, extra, value in metric.samples():
+                lines.append("%s%s%s %s" % (metric.name, suffix, _formatLabels(key, extra), _formatValue(value)))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        return {"time": time.time(), "metrics": {metric.name: {"type": metric.kind, "help": metric.help, "values": metric.snapshot()} for metric in self.metrics()}}
+
+    def writeSnapshot(self, fileName):
+        """
+        Writes the snapshot as json. The file is replaced atomically, so readers never see half of it.
+        """
+        tempFileName = fileName + ".tmp"
+        with open(tempFileName, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tempFileName, fileName)
+
+registry = Registry()
+
+class MetricsServer:
+    """
+    Serves the metrics of 'registry' in the Prometheus text format at http://host:port/metrics,
+    and writes them to 'snapshotFileName' every 'snapshotInterval' seconds. Both run in daemon threads.
+    port: 0 disables the http endpoint.
+    snapshotFileName: "" disables the snapshot file.
+    """
+    def __init__(self, registry=registry, host=MX_HTTP_HOST, port=MX_HTTP_PORT, snapshotFileName=MX_SNAPSHOT_FILE_NAME, snapshotInterval=MX_SNAPSHOT_INTERVAL_SECS):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.snapshotFileName = snapshotFileName
+        self.snapshotInterval = snapshotInterval
+        self._server = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        if self.port != 0:
+            registry = self.registry
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] not in ("/", "/metrics"):
+                        self.send_error(404)
+                        return
+                    body = registry.render().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                def log_message(self, format, *args):
+                    pass
+            try:
+                self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+            except OSError as ex:
+                print("ERROR: Metrics cannot be served at %s:%s. Details:" % (self.host, self.port))
+                print(ex)
+            else:
+                self._server.daemon_threads = True
+                threading.Thread(target=self._server.serve_forever, daemon=True).start()
+                print("Metrics are served at http://%s:%s/metrics" % (self.host, self._server.server_address[1]))
+        if self.snapshotFileName != "":
+            threading.Thread(target=self._writeSnapshots, daemon=True).start()
+
+    def _writeSnapshots(self):
+        while not self._stopped.wait(self.snapshotInterval):
+            self._writeSnapshot()
+
+    def _writeSnapshot(self):
+        try:
+            self.registry.writeSnapshot(self.snapshotFileName)
+        except OSError as ex:
+            print("ERROR: Metrics snapshot could not be written. Details:")
+            print(ex)
+
+    def stop(self):
+        """
+        Stops serving and writes the last snapshot.
+        """
+        self._stopped.set()
+        if self._server != None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self.snapshotFileName != "":
+            self._writeSnapshot()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import threading
+import ipaddress
+from functools import lru_cache
+from urllib import parse
+from config import *
+
+HOST = "host"
+REGISTRABLE = "registrable"
+DEFAULT_PORTS = ("80", "443")
+RULE_END = "$"                      # Node keys that cannot be labels
+EXCEPTION = "!"
+
+class PublicSuffixTrie:
+    """
+    Rules of the public suffix list, compiled into a trie of labels from right to left,
+    ie. "co.uk" is root["uk"]["co"]. Wildcard rules have a "*" label, exception rules are marked.
+    fileName: The list in the format of https://publicsuffix.org/list/public_suffix_list.dat
+    privateSuffixes: If False, rules of the private domains section, ie. "blogspot.com", are left out.
+    """
+    def __init__(self, fileName, privateSuffixes=True):
+        self._root = {}
+        with open(fileName, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("// ===BEGIN PRIVATE DOMAINS===") and not privateSuffixes:
+                    break
+                if line == "" or line.startswith("//"):
+                    continue
+                rule = line.split()[0].lower()
+                self._add(rule)
+                try:
+                    # Hosts of links are usually punycode
+                    asciiRule = ".".join(label if label == "*" or label.startswith(EXCEPTION) else label.encode("idna").decode("ascii") for label in rule.split("."))
+                except UnicodeError:
+                    continue
+                if asciiRule != rule:
+                    self._add(asciiRule)
+
+    def _add(self, rule):
+        isException = rule.startswith(EXCEPTION)
+        node = self._root
+        for label in reversed(rule.lstrip(EXCEPTION).split(".")):
+            node = node.setdefault(label, {})
+        node[EXCEPTION if isException else RULE_END] = True
+
+    def publicSuffixLength(self, labels):
+        """
+        Returns how many of the labels, counted from the right, are the public suffix.
+        Hosts under no rule have a one label suffix, as the list says.
+        """
+        longest = 1
+        nodes = [self._root]
+        for depth, label in enumerate(reversed(labels), 1):
+            nextNodes = []
+            for node in nodes:
+                for key in (label, "*"):
+                    child = node.get(key)
+                    if child == None:
+                        continue
+                    if key == label and child.get(EXCEPTION):
+                        # Exception rules win, their leftmost label is not part of the suffix
+                        return depth - 1
+                    if child.get(RULE_END):
+                        longest = max(longest, depth)
+                    nextNodes.append(child)
+            nodes = nextNodes
+            if len(nodes) == 0:
+                break
+        return longest
+
+    def registrableDomain(self, host):
+        """
+        Returns the public suffix of the host with one more label, ie. "example.co.uk" for "www.example.co.uk".
+        Returns None if the host is a public suffix itself.
+        """
+        labels = host.split(".")
+        suffixLength = self.publicSuffixLength(labels)
+        if len(labels) <= suffixLength:
+            return None
+        return ".".join(labels[-suffixLength - 1:])
+
+_trie = None
+_trieLock = threading.Lock()
+
+def publicSuffixTrie():
+    """
+    Returns the trie of the bundled public suffix list, compiling it on the first call.
+    """
+    global _trie
+    with _trieLock:
+        if _trie == None:
+            fileName = DN_PUBLIC_SUFFIX_FILE_NAME
+            if not os.path.isabs(fileName):
+                fileName = os.path.join(os.path.dirname(os.path.abspath(__file__)), fileName)
+            _trie = PublicSuffixTrie(fileName, DN_PRIVATE_SUFFIXES)
+        return _trie
+
+def _splitNetloc(netloc):
+    """
+    Returns (host, port) of a netloc, without user info.
+    """
+    netloc = netloc.rpartition("@")[2]
+    if netloc.startswith("["):
+        # IPv6 address
+        host, _, rest = netloc[1:].partition("]")
+        return "[%s]" % host, rest[1:] if rest.startswith(":") else ""
+    if netloc.count(":") == 1:
+        host, _, port = netloc.partition(":")
+        return host, port
+    return netloc, ""
+
+def _isIpAddress(host):
+    try:
+        ipaddress.ip_address(host.strip("[]"))
+        return True
+    except ValueError:
+        return False
+
+def normalizeDomain(domain, granularity=DN_GRANULARITY):
+    """
+    Returns the work item a domain, netloc or url stands for, so that the same site is queued once.
+    User info, default ports and the trailing dot are dropped and the host is lowercased.
+    granularity: REGISTRABLE also drops subdomains, ie. "www.example.co.uk" and "blog.example.co.uk"
+    are "example.co.uk". HOST keeps them apart.
+    Other ports are kept, they are other servers.
+    """
+    if "//" in domain:
+        domain = parse.urlsplit(domain).netloc
+    host, port = _splitNetloc(domain.strip())
+    host = _normalizeHost(host, granularity)
+    if port == "" or port in DEFAULT_PORTS:
+        return host
+    return "%s:%s" % (host, port)
+
+@lru_cache(maxsize=DN_CACHE_SIZE)
+def _normalizeHost(host, granularity):
+    """
+    normalizeDomain of a host. Cached by host rather than by url, as many urls are on a host.
+    """
+    host = host.lower().rstrip(".")
+    if granularity == REGISTRABLE and not _isIpAddress(host):
+        host = publicSuffixTrie().registrableDomain(host) or host
+    return host
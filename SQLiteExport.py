@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sqlite3
+import threading
+from urllib import parse
+import os
+from Metrics import registry
+
+rowCount = registry.counter("ex_rows_total", "Rows written to the output files, by file")
+flushSeconds = registry.histogram("ex_flush_seconds", "Time to write and flush a batch of rows, by file")
+
+# Columns of each table, besides the normalized domain and url ids
+BACKLINK_COLUMNS = ["title", "anchor", "nofollow", "inlink_rank", "domain_inlink_rank", "first_seen", "last_visited", "date_lost"]
+TABLES = {
+    "backlinks": ["of_domain", "url_from", "url_to"] + BACKLINK_COLUMNS,
+    "externallinks": ["of_domain", "url_to"]
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS domains (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS urls (id INTEGER PRIMARY KEY, url TEXT NOT NULL UNIQUE, domain_id INTEGER NOT NULL REFERENCES domains(id));
+CREATE INDEX IF NOT EXISTS urls_domain ON urls (domain_id);
+CREATE TABLE IF NOT EXISTS backlinks (
+    of_domain_id INTEGER NOT NULL REFERENCES domains(id),
+    url_from_id INTEGER NOT NULL REFERENCES urls(id),
+    url_to_id INTEGER NOT NULL REFERENCES urls(id),
+    title TEXT, anchor TEXT, nofollow, inlink_rank, domain_inlink_rank, first_seen, last_visited, date_lost);
+CREATE INDEX IF NOT EXISTS backlinks_of_domain ON backlinks (of_domain_id);
+CREATE INDEX IF NOT EXISTS backlinks_url_from ON backlinks (url_from_id);
+CREATE TABLE IF NOT EXISTS externallinks (
+    of_domain_id INTEGER NOT NULL REFERENCES domains(id),
+    url_to_id INTEGER NOT NULL REFERENCES urls(id));
+CREATE INDEX IF NOT EXISTS externallinks_of_domain ON externallinks (of_domain_id);
+CREATE INDEX IF NOT EXISTS externallinks_url_to ON externallinks (url_to_id);
+"""
+
+class SQLiteExport:
+    """
+    Writes rows into an indexed SQLite database instead of a csv file. Has the same interface as Export.
+    Domains and urls are kept in their own tables and rows refer to them by id.
+    Rows are inserted in batches of 'batchSize', each in a single transaction.
+    Both scrapers can write to the same database file. Existing rows are kept.
+    table: "backlinks" or "externallinks"
+    """
+    def __init__(self, fileName, table, batchSize=1000):
+        self.table = table
+        self.batchSize = batchSize
+        self.name = "%s:%s" % (os.path.basename(fileName), table)
+        self._rows = []
+        self._callbacks = []                # Of afterWritten, called once the rows are inserted
+        self._lock = threading.Lock()
+        # Used by the scraper thread, created in the main thread
+        self._db = sqlite3.connect(fileName, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._db:
+            self._db.executescript(SCHEMA)
+
+    def writerow(self, obj):
+        rowCount.inc(file=self.name)
+        with self._lock:
+            self._rows.append(obj)
+            if len(self._rows) >= self.batchSize:
+                self._insertRows()
+
+    def afterWritten(self, callback):
+        """
+        Calls 'callback' once the rows written so far are committed, right away if they are.
+        """
+        with self._lock:
+            if len(self._rows) != 0:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def flush(self):
+        with self._lock:
+            if self._db != None:
+                self._insertRows()
+
+    def _insertRows(self):
+        if len(self._rows) == 0:
+            return
+        with flushSeconds.time(file=self.name), self._db:
+            for row in self._rows:
+                values = [self._domainId(str(row["of_domain"]))]
+                if self.table == "backlinks":
+                    values.append(self._urlId(str(row["url_from"])))
+                values.append(self._urlId(str(row["url_to"])))
+                if self.table == "backlinks":
+                    values.extend(row.get(column) for column in BACKLINK_COLUMNS)
+                self._db.execute("INSERT INTO %s VALUES (%s)" % (self.table, ", ".join("?" * len(values))), values)
+        self._rows = []
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def _domainId(self, domain):
+        self._db.execute("INSERT OR IGNORE INTO domains (name) VALUES (?)", (domain,))
+        return self._db.execute("SELECT id FROM domains WHERE name = ?", (domain,)).fetchone()[0]
+
+    def _urlId(self, url):
+        row = self._db.execute("SELECT id FROM urls WHERE url = ?", (url,)).fetchone()
+        if row != None:
+            return row[0]
+        domainId = self._domainId(parse.urlparse(url).netloc)
+        return self._db.execute("INSERT INTO urls (url, domain_id) VALUES (?, ?)", (url, domainId)).lastrowid
+
+    def close(self):
+        with self._lock:
+            if self._db != None:
+                self._insertRows()
+                self._db.close()
+                self._db = None
+
+    def __del__(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def exportCSV(dbFileName, table, exporter):
+    """
+    Writes rows of a table of the database to 'exporter' with the column names of the csv files.
+    """
+    columns = TABLES[table]
+    select = ["d.name"]
+    joins = ["JOIN domains d ON d.id = t.of_domain_id"]
+    if table == "backlinks":
+        select.append("uf.url")
+        joins.append("JOIN urls uf ON uf.id = t.url_from_id")
+    select.append("ut.url")
+    joins.append("JOIN urls ut ON ut.id = t.url_to_id")
+    if table == "backlinks":
+        select.extend("t." + column for column in BACKLINK_COLUMNS)
+    db = sqlite3.connect(dbFileName)
+    try:
+        for values in db.execute("SELECT %s FROM %s t %s ORDER BY t.rowid" % (", ".join(select), table, " ".join(joins))):
+            row = dict(zip(columns, values))
+            if isinstance(row.get("nofollow"), int):
+                # SQLite keeps booleans as 0 and 1, csv files have them as written by the api
+                row["nofollow"] = bool(row["nofollow"])
+            exporter.writerow(row)
+    finally:
+        db.close()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import math
+from config import *
+
+class PriorityScheduler:
+    """
+    Decides in which order the domains of a work queue are processed and which are not queued at all.
+    The priority of a domain is the sum of weight * signal over 'weights', higher first.
+    Signals of 'logSignals' are counts and weighted by their log10(1 + count).
+    weights: Signal name: weight, see SC_WEIGHTS
+    maxDepth: Domains deeper than this are not queued. -1 for no limit.
+    overviews: If given, called with a domain and returns its XXX overview or None.
+    Overview values are signals too, ie. "domainAuthority".
+    """
+    def __init__(self, weights=SC_WEIGHTS, maxDepth=SC_MAX_DEPTH, logSignals=SC_LOG_SIGNALS, overviews=None):
+        self.weights = weights
+        self.maxDepth = maxDepth
+        self.logSignals = set(logSignals)
+        self.overviews = overviews
+
+    def admits(self, depth):
+        return self.maxDepth < 0 or depth <= self.maxDepth
+
+    def priority(self, domain, depth, signals=None):
+        signals = dict(signals) if signals != None else {}
+        signals["depth"] = depth
+        if self.overviews != None:
+            overview = self.overviews(domain)
+            if isinstance(overview, dict):
+                signals.update((name, value) for name, value in overview.items() if name not in signals)
+        priority = 0
+        for name, weight in self.weights.items():
+            value = signals.get(name)
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            if name in self.logSignals:
+                value = math.log10(1 + max(0, value))
+            priority += weight * value
+        return priority
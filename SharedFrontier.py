@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sqlite3
+import threading
+import time
+from PublicSuffix import normalizeDomain
+from config import *
+
+BACKLINKS = "backlinks"
+EXTERNALS = "externals"
+STAGES = (BACKLINKS, EXTERNALS)
+
+PENDING = 0
+LEASED = 1
+DONE = 2
+FAILED = 3
+STATE_NAMES = {PENDING: "pending", LEASED: "leased", DONE: "done", FAILED: "failed"}
+
+class SharedFrontier:
+    """
+    Domains of both scraper stages of a distributed run, kept by the coordinator in a single SQLite file.
+    Each domain is queued once for a stage. Workers lease domains for 'leaseSecs' seconds and renew
+    the leases while they work on them. A lease that is neither renewed nor completed in time expires
+    and the domain is leased again, at most 'maxAttempts' times in all.
+    Domains are leased in the order of their priority, then in the order they were queued.
+    fileName: SQLite file of the frontier. ":memory:" keeps it only for this run.
+    """
+    def __init__(self, fileName=DC_FILE_NAME, leaseSecs=DC_LEASE_SECS, maxAttempts=DC_MAX_ATTEMPTS):
+        self.leaseSecs = leaseSecs
+        self.maxAttempts = maxAttempts
+        self._lock = threading.Lock()
+        # Used by the request threads of the coordinator
+        self._db = sqlite3.connect(fileName, check_same_thread=False)
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS frontier (
+                seq INTEGER PRIMARY KEY, stage TEXT NOT NULL, domain TEXT NOT NULL, state INTEGER NOT NULL,
+                worker TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0,
+                depth INTEGER NOT NULL DEFAULT 0, priority REAL NOT NULL DEFAULT 0, UNIQUE (stage, domain))""")
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(frontier)")}
+            for column in ["depth INTEGER NOT NULL DEFAULT 0", "priority REAL NOT NULL DEFAULT 0"]:
+                if column.split()[0] not in columns:
+                    # Frontier of a run before domains had priorities
+                    self._db.execute("ALTER TABLE frontier ADD COLUMN " + column)
+            self._db.execute("DROP INDEX IF EXISTS frontier_state")
+            self._db.execute("CREATE INDEX IF NOT EXISTS frontier_priority ON frontier (stage, state, priority DESC, seq)")
+
+    def put(self, stage, domains, depth=0, priorities=None):
+        """
+        Queues the domains that were never queued for the stage before. Returns how many were new.
+        Pending domains put again with a higher priority move up.
+        priorities: Normalized domain: priority. Domains not in it have 0.
+        """
+        priorities = priorities if priorities != None else {}
+        rows = []
+        for domain in domains:
+            domain = normalizeDomain(domain)
+            rows.append((stage, domain, PENDING, depth, priorities.get(domain, 0)))
+        with self._lock, self._db:
+            before = self._db.total_changes
+            self._db.executemany("INSERT OR IGNORE INTO frontier (stage, domain, state, depth, priority) VALUES (?, ?, ?, ?, ?)", rows)
+            newCount = self._db.total_changes - before
+            self._db.executemany("UPDATE frontier SET priority = ?, depth = MIN(depth, ?) WHERE stage = ? AND domain = ? AND state = ? AND priority < ?",
+                [(priority, depth, stage, domain, PENDING, priority) for _, domain, _, _, priority in rows])
+            return newCount
+
+    def lease(self, stage, worker, count):
+        """
+        Returns up to 'count' domains of the stage leased to the worker, pending ones and ones whose lease expired,
+        as (domain, depth, priority) in the order of their priority.
+        """
+        now = time.time()
+        with self._lock, self._db:
+            # Domains whose every lease expired are given up
+            self._db.execute("UPDATE frontier SET state = ?, worker = NULL WHERE stage = ? AND state = ? AND lease_expires <= ? AND attempts >= ?",
+                (FAILED, stage, LEASED, now, self.maxAttempts))
+            rows = self._db.execute("""SELECT seq, domain, depth, priority FROM frontier WHERE stage = ? AND (state = ? OR (state = ? AND lease_expires <= ?))
+                ORDER BY priority DESC, seq LIMIT ?""", (stage, PENDING, LEASED, now, count)).fetchall()
+            self._db.executemany("UPDATE frontier SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE seq = ?",
+                [(LEASED, worker, now + self.leaseSecs, row[0]) for row in rows])
+        return [tuple(row[1:]) for row in rows]
+
+    def renew(self, stage, worker, domains):
+        """
+        Extends the leases of the worker on the domains. Returns the domains still leased to it.
+        """
+        expires = time.time() + self.leaseSecs
+        renewed = []
+        with self._lock, self._db:
+            for domain in domains:
+                cursor = self._db.execute("UPDATE frontier SET lease_expires = ? WHERE stage = ? AND domain = ? AND state = ? AND worker = ?",
+                    (expires, stage, domain, LEASED, worker))
+                if cursor.rowcount != 0:
+                    renewed.append(domain)
+        return renewed
+
+    def complete(self, stage, domain):
+        """
+        Marks a domain of the stage processed, whoever holds its lease now.
+        """
+        with self._lock, self._db:
+            self._db.execute("UPDATE frontier SET state = ?, worker = NULL WHERE stage = ? AND domain = ?", (DONE, stage, domain))
+
+    def release(self, stage, worker, domains):
+        """
+        Gives back leased domains the worker did not start, so that they are leased again right away.
+        """
+        with self._lock, self._db:
+            self._db.executemany("UPDATE frontier SET state = ?, worker = NULL, attempts = attempts - 1 WHERE stage = ? AND domain = ? AND state = ? AND worker = ?",
+                [(PENDING, stage, domain, LEASED, worker) for domain in domains])
+
+    def counts(self):
+        """
+        Returns {stage: {state name: count}}.
+        """
+        counts = {stage: {name: 0 for name in STATE_NAMES.values()} for stage in STAGES}
+        with self._lock:
+            for stage, state, count in self._db.execute("SELECT stage, state, COUNT(*) FROM frontier GROUP BY stage, state"):
+                counts.setdefault(stage, {})[STATE_NAMES[state]] = count
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from collections import deque
+from contextlib import nullcontext
+from config import *
+from HttpSession import getSession
+from Utils import Deadline
+from lxml import etree
+import zlib
+
+GZIP_MAGIC = b"\x1f\x8b"
+CHUNK_SIZE = 64 * 1024
+
+def discoverSitemaps(domain, timeout=WEBREQUEST_TIMEOUT, connectionSlots=None):
+    """
+    Returns sitemap urls listed in robots.txt of the domain.
+    If there is none, returns the default sitemap url.
+    connectionSlots: Semaphore of the open connections, held while robots.txt is requested
+    """
+    url = ROBOTS_REQ_URL.replace("%DOMAIN%", domain)
+    sitemaps = []
+    try:
+        with connectionSlots if connectionSlots != None else nullcontext():
+            resp = getSession().get(url, headers=HEADERS, timeout=timeout)
+        if resp.status_code == 200:
+            for line in resp.text.splitlines():
+                key, _, value = line.partition(":")
+                if key.strip().lower() == "sitemap" and value.strip() != "":
+                    sitemaps.append(value.strip())
+    except requests.exceptions.RequestException as ex:
+        print("DEBUG: Url '%s' caused request error" % url)
+    if len(sitemaps) == 0:
+        sitemaps.append(SITEMAP_REQ_URL.replace("%DOMAIN%", domain))
+    return sitemaps
+
+def iterSitemapPages(domain, deadline=None, connectionSlots=None):
+    """
+    Yields page urls found in the sitemaps of the domain.
+    Sitemap indexes are followed lazily, ie. a nested sitemap is only downloaded when the pages
+    before it have been consumed. Stop iterating to stop downloading.
+    At most EM_MAX_SITEMAPS_PER_DOMAIN sitemap files are read.
+    deadline: Deadline of the domain. Request timeouts are capped by the time left.
+    connectionSlots: Semaphore of the open connections, ie. shared with the crawl. One of them is held while
+    robots.txt is requested and while a sitemap is being read.
+    """
+    deadline = deadline if deadline != None else Deadline()
+    toBeRead = deque(discoverSitemaps(domain, deadline.timeout(WEBREQUEST_TIMEOUT), connectionSlots))
+    seen = set(toBeRead)
+    readCount = 0
+    while len(toBeRead) != 0 and readCount < EM_MAX_SITEMAPS_PER_DOMAIN:
+        sitemapUrl = toBeRead.popleft()
+        readCount += 1
+        for kind, loc in iterSitemap(sitemapUrl, deadline.timeout(WEBREQUEST_TIMEOUT), connectionSlots):
+            if kind == "sitemap":
+                if loc not in seen:
+                    seen.add(loc)
+                    toBeRead.append(loc)
+            else:
+                yield loc
+
+def iterSitemap(url, timeout=WEBREQUEST_TIMEOUT, connectionSlots=None):
+    """
+    Yields ("url", loc) for pages and ("sitemap", loc) for nested sitemaps of a sitemap or sitemap index.
+    The body is streamed, gunzipped if needed and parsed incrementally, so memory use does not
+    depend on the size of the sitemap.
+    connectionSlots: Semaphore of the open connections, held till the sitemap is read or the iteration is stopped
+    """
+    with connectionSlots if connectionSlots != None else nullcontext():
+        yield from _iterSitemap(url, timeout)
+
+def _iterSitemap(url, timeout):
+    try:
+        resp = getSession().get(url, headers=HEADERS, timeout=timeout, stream=True)
+    except requests.exceptions.RequestException as ex:
+        print("DEBUG: Url '%s' caused request error" % url)
+        return
+    with resp:
+        if resp.status_code != 200:
+            # Not found
+            return
+        parser = etree.XMLPullParser(events=("end",), resolve_entities=False, no_network=True, huge_tree=True)
+        decompressor = None
+        try:
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                if decompressor == None:
+                    # .xml.gz files are served gzipped without a content encoding
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if chunk.startswith(GZIP_MAGIC) else False
+                if decompressor:
+                    chunk = decompressor.decompress(chunk)
+                parser.feed(chunk)
+                yield from _readLocs(parser)
+            parser.close()
+            yield from _readLocs(parser)
+        except (etree.LxmlError, zlib.error, requests.exceptions.RequestException) as ex:
+            print("ERROR: Sitemap '%s' could not be read further. Details:" % url)
+            print(ex)
+
+def _readLocs(parser):
+    for _, element in parser.read_events():
+        tag = etree.QName(element).localname
+        if tag == "loc":
+            parent = element.getparent()
+            if parent != None and element.text != None:
+                kind = "sitemap" if etree.QName(parent).localname == "sitemap" else "url"
+                yield kind, element.text.strip()
+        elif tag in ("url", "sitemap"):
+            # Forget the entries already read
+            element.clear()
+            while element.getprevious() != None:
+                del element.getparent()[0]
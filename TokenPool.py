@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+import time
+from collections import deque
+from config import *
+from Utils import *
+
+class TokenPoolExhausted(Exception):
+    """
+    Raised when there is no ready token and no more can be requested.
+    """
+    def __init__(self):
+        Exception.__init__(self)
+
+class TokenPool:
+    """
+    Solves captchas and requests authorization tokens in background threads,
+    so that a ready token is waiting when the one in use is exhausted.
+    service: Has solveCaptcha() returning a captcha solution and requestToken(captcha, proxy=None)
+    returning a bearer token. Both raise an exception on failure.
+    tokens: Prerequested tokens. They are handed out before requested ones.
+    proxies: Each used once for a token request, in turns by the workers. After them, our IP is used.
+    lowWaterMark: Workers request new tokens while fewer than this many are ready.
+    workerCount: How many tokens can be requested at the same time.
+    maxFailures: After this many failed requests in a row, no more tokens are requested.
+    """
+    def __init__(self, service, tokens=[], proxies=[], lowWaterMark=TP_LOW_WATER_MARK, workerCount=TP_WORKERS, maxFailures=TP_MAX_FAILURES):
+        self.service = service
+        self.proxies = list(proxies)
+        self.lowWaterMark = lowWaterMark
+        self.maxFailures = maxFailures
+        self._ready = deque(tokens)
+        self._requesting = 0                # Tokens being requested by the workers right now
+        self._failures = 0
+        self._stopSignalReceived = False
+        self._condition = threading.Condition()
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(workerCount)]
+
+    def start(self):
+        for worker in self._workers:
+            worker.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopSignalReceived = True
+            self._condition.notify_all()
+
+    def isExhausted(self):
+        return self._failures >= self.maxFailures
+
+    def get(self, timeout=None):
+        """
+        Returns a ready token, waiting for one if needed.
+        Raises TokenPoolExhausted if there is none and workers gave up, or none arrives in 'timeout' seconds.
+        """
+        with self._condition:
+            hasToken = self._condition.wait_for(lambda: len(self._ready) != 0 or self.isExhausted() or self._stopSignalReceived, timeout)
+            if not hasToken or len(self._ready) == 0:
+                raise TokenPoolExhausted()
+            token = self._ready.popleft()
+            self._condition.notify_all()
+            return token
+
+    def readyCount(self):
+        with self._condition:
+            return len(self._ready)
+
+    def _needsToken(self):
+        return len(self._ready) + self._requesting < self.lowWaterMark
+
+    def _work(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._stopSignalReceived or self.isExhausted() or self._needsToken())
+                if self._stopSignalReceived or self.isExhausted():
+                    return
+                self._requesting += 1
+                proxy = self.proxies.pop() if len(self.proxies) != 0 else None
+            token = None
+            try:
+                token = self._requestToken(proxy)
+            except Exception as ex:
+                print("Token Request has failed. Details:")
+                printException(ex)
+            with self._condition:
+                self._requesting -= 1
+                if token != None:
+                    self._failures = 0
+                    self._ready.append(token)
+                else:
+                    self._failures += 1
+                self._condition.notify_all()
+
+    def _requestToken(self, proxy):
+        print("Requesting recaptcha token")
+        captcha = self.service.solveCaptcha()
+        print("Requesting authorization token")
+        if proxy != None:
+            print("Using proxy for token request: ", proxy)
+        else:
+            print("Requesting token via our IP")
+        return self.service.requestToken(captcha, proxy)
+
+class StandInTokenService:
+    """
+    Token service that needs no network, for tests and benchmarks.
+    Hands out tokens "Bearer stand-in-<n>" after waiting 'delay' seconds for each captcha.
+    failAfter: If set, requests after that many tokens fail.
+    """
+    def __init__(self, delay=0, failAfter=None):
+        self.delay = delay
+        self.failAfter = failAfter
+        self.issuedCount = 0
+        self.proxiesUsed = []
+        self._lock = threading.Lock()
+
+    def solveCaptcha(self):
+        time.sleep(self.delay)
+        return "captcha"
+
+    def requestToken(self, captcha, proxy=None):
+        with self._lock:
+            if self.failAfter != None and self.issuedCount >= self.failAfter:
+                raise Exception("Stand-in token service is exhausted")
+            self.issuedCount += 1
+            self.proxiesUsed.append(proxy)
+            return "Bearer stand-in-%s" % self.issuedCount
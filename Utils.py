@@ -1,8 +1,40 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import traceback
+import time
 
 def printException(ex):
     traceback.print_exception(type(ex), ex, ex.__traceback__)
 
 
+
+class Deadline:
+    """
+    Time budget of a piece of work, ie. of the external link search of a domain.
+    seconds: The budget. None for no deadline.
+    """
+    # Requests do not accept 0 for a timeout
+    MIN_TIMEOUT = 0.001
+
+    def __init__(self, seconds=None):
+        self.expires = time.monotonic() + seconds if seconds != None else None
+
+    def remaining(self):
+        """
+        Returns the seconds left, or None if there is no deadline.
+        """
+        if self.expires == None:
+            return None
+        return max(0, self.expires - time.monotonic())
+
+    def expired(self):
+        return self.expires != None and time.monotonic() >= self.expires
+
+    def timeout(self, limit):
+        """
+        Returns the timeout of a request: 'limit' capped by the time left.
+        """
+        remaining = self.remaining()
+        if remaining == None:
+            return limit
+        return max(Deadline.MIN_TIMEOUT, min(limit, remaining))
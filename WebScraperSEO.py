@@ -2,6 +2,14 @@
 # -*- coding: utf-8 -*-
 from ExternalsMapper import ExternalsMapper
 from BacklinksQuery import BacklinksQuery
+from WorkQueue import WorkQueue
+from Scheduler import PriorityScheduler
+from BacklinkCache import BacklinkCache, OVERVIEW
+from Export import SQLITE_EXTENSIONS
+from Journal import Journal
+from LinkGraph import LinkGraph
+from Metrics import MetricsServer
+from config import *
 import os.path
 from traceback import print_stack
 from Utils import *
@@ -13,20 +21,44 @@ class WebScraperSEO():
     reportNoFollowLinks: If true, no follow links will be looked up with externals mapper too
     externalsCSVFileName: Name of the CSV file which has ExternalMapper results.
     backlinksCSVFileName: Name of the CSV file which has BacklinksQuery results.
+    Either file name can end with .sqlite or .db to save results into an indexed SQLite database instead.
+    Both can name the same database. Rows already in a database are kept.
+    resume: If True, the run continues from the journals of the previous run and results are appended
+    to the existing files. Otherwise the journals start over and the files are overwritten.
+
+    Domains are processed in the order of their priority, see PriorityScheduler, and not deeper than SC_MAX_DEPTH
+    hops from the initial domains.
+    Links found by both scrapers are kept in one LinkGraph, saved to GR_FILE_NAME on close and loaded from it on resume.
+    Links found since it was saved are journaled next to it, so that a run that crashes resumes with them too.
+    While running, metrics of both scrapers are served and written to a snapshot file as configured in config.py.
     """
     DEFAULT_BACKLINKS_CSV_FILENAME = "backlinks.csv"
     DEFAULT_EXTERNALS_CSV_FILENAME = "externallinks.csv"
-    def __init__(self, domains, maxExternalLinkPerDomain, reportNoFollowLinks, externalsCSVFileName=DEFAULT_EXTERNALS_CSV_FILENAME, backlinksCSVFileName=DEFAULT_BACKLINKS_CSV_FILENAME, proxies=[], tokens=[]):
-        if os.path.isfile(externalsCSVFileName):
+    def __init__(self, domains, maxExternalLinkPerDomain, reportNoFollowLinks, externalsCSVFileName=DEFAULT_EXTERNALS_CSV_FILENAME, backlinksCSVFileName=DEFAULT_BACKLINKS_CSV_FILENAME, proxies=[], tokens=[], resume=False):
+        if resume:
+            print("Resuming from journals '%s' and '%s'" % (JN_EXTERNALS_FILE_NAME, JN_BACKLINKS_FILE_NAME))
+        elif os.path.isfile(externalsCSVFileName) and not externalsCSVFileName.endswith(SQLITE_EXTENSIONS):
             input("WARNING: File '%s' already exists. It will be overwritten when you continue. Move it if you do not want to lose it."%externalsCSVFileName)
-        if os.path.isfile(backlinksCSVFileName):
+        if not resume and os.path.isfile(backlinksCSVFileName) and not backlinksCSVFileName.endswith(SQLITE_EXTENSIONS):
             input("WARNING: File '%s' already exists. It will be overwritten when you continue. Move it if you do not want to lose it."%backlinksCSVFileName)
-        self.externalsMapper = ExternalsMapper([], maxExternalLinkPerDomain, externalsCSVFileName)
-        self.backlinksQuery = BacklinksQuery(domains, reportNoFollowLinks, backlinksCSVFileName, proxies, tokens)
-        self.backlinksQuery.setOnExternalSearchDomainFoundCallback(self.externalsMapper.onExternalSearchDomainFound)
-        self.externalsMapper.setOnBacklinkSearchDomainFoundCallback(self.backlinksQuery.onBacklinkSearchDomainFound)
+        # Each stage puts the domains it finds straight to the queue of the other stage
+        # and records them to its journal
+        self.externalsJournal = Journal(JN_EXTERNALS_FILE_NAME, resume)
+        self.backlinksJournal = Journal(JN_BACKLINKS_FILE_NAME, resume)
+        self.externalsQueue = WorkQueue([], self.externalsJournal)
+        # Domains whose overview is cached already are prioritized by it too
+        self.backlinkCache = BacklinkCache()
+        self.backlinksQueue = WorkQueue(domains, self.backlinksJournal, scheduler=PriorityScheduler(overviews=lambda domain: self.backlinkCache.get(domain, OVERVIEW)))
+        self.graph = LinkGraph.load(GR_FILE_NAME) if resume and GR_FILE_NAME != "" and os.path.isfile(GR_FILE_NAME) else LinkGraph()
+        if GR_FILE_NAME != "":
+            self.graph.openJournal(GR_FILE_NAME, resume)
+        self.externalsMapper = ExternalsMapper([], maxExternalLinkPerDomain, externalsCSVFileName, self.externalsQueue, append=resume, graph=self.graph)
+        self.backlinksQuery = BacklinksQuery([], reportNoFollowLinks, backlinksCSVFileName, proxies, tokens, self.backlinksQueue, backlinkCache=self.backlinkCache, append=resume, graph=self.graph)
+        self.backlinksQuery.setOnExternalSearchDomainFoundCallback(self.externalsQueue.put)
+        self.externalsMapper.setOnBacklinkSearchDomainFoundCallback(self.backlinksQueue.put)
         self.externalsMapper.setErrorCallback(self.externalsMapperErrorCallback)
         self.backlinksQuery.setErrorCallback(self.backlinksQueryErrorCallback)
+        self.metricsServer = MetricsServer()
 
     def loadState(self, externalsFile, backlinksFile):
         """
@@ -43,6 +75,7 @@ class WebScraperSEO():
         self.backlinksQuery.saveState(backlinksFile)
 
     def start(self):
+        self.metricsServer.start()
         self.backlinksQuery.start()
         self.externalsMapper.start()
 
@@ -55,9 +88,41 @@ class WebScraperSEO():
             self.backlinksQuery.join()
             self.externalsMapper.join()
         except KeyboardInterrupt:
-            print("KeyboardInterrupt, saving state")
+            self.stop()
+            print("KeyboardInterrupt, waiting for the domains in progress and saving state")
+            # Nothing may write to the files or the graph any more when they are saved and closed
+            self.backlinksQuery.join()
+            self.externalsMapper.join()
             print("WARNING: Do not loadState with existing csv file names. In that case they will be overwritten.")
             self.saveState("recovery_keyboardinterrupt.ext", "recovery_keyboardinterrupt.bac")
+        finally:
+            self.close()
+
+    def flush(self):
+        """
+        Makes sure found data so far is written to the csv files and journals.
+        """
+        self.externalsMapper.exporter.flush()
+        self.backlinksQuery.exporter.flush()
+        self.graph.syncJournal()
+        self.externalsJournal.sync()
+        self.backlinksJournal.sync()
+
+    def close(self):
+        """
+        Flushes and closes the csv files and journals, saves the link graph and stops serving metrics.
+        """
+        try:
+            self.externalsMapper.exporter.close()
+            self.backlinksQuery.exporter.close()
+        finally:
+            # Also when writing the rows has failed
+            self.externalsJournal.close()
+            self.backlinksJournal.close()
+            if GR_FILE_NAME != "":
+                self.graph.save(GR_FILE_NAME)
+            self.graph.closeJournal()
+            self.metricsServer.stop()
 
     def backlinksQueryErrorCallback(self, exception=""):
         self.stop()
@@ -68,6 +133,7 @@ class WebScraperSEO():
         print("Externals Mapper will run till its current unprocessed domains are processed then application will quit.")
         print("WARNING: Do not loadState with existing csv file names. In that case they will be overwritten.")
         self.saveState("recovery.ext", "recovery.bac")
+        self.flush()
         print("Details: ")
         print(exception)
         printException(exception)
@@ -81,6 +147,7 @@ class WebScraperSEO():
         print("BacklinksQuery status is being saved to 'recovery.bac'")
         print("WARNING: Do not loadState with existing csv file names. In that case they will be overwritten.")
         self.saveState("recovery.ext", "recovery.bac")
+        self.flush()
         print("Details: ")
         print(exception)
         printException(exception)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import threading
+import heapq
+import itertools
+from PublicSuffix import normalizeDomain
+from Scheduler import PriorityScheduler
+from Metrics import registry
+
+tooDeepCount = registry.counter("wq_too_deep_domains_total", "Domains not queued for being deeper than SC_MAX_DEPTH")
+
+class WorkQueue:
+    """
+    Thread safe priority queue of domains for a scraper stage.
+    Each domain is queued only once in a run, no matter how many times it is put. Put again with a higher
+    priority while it is waiting, it moves up. Domains of the same priority are taken in the order they were put.
+    Consumers blocked in 'get' use no CPU and wake up as soon as a domain is put or the queue is closed.
+    journal: If given, the queue starts with the pending domains of the journal and new domains are recorded to it.
+    normalize: Applied to each domain put, so that ie. "www.example.com" and "example.com:443" are one work item
+    scheduler: PriorityScheduler of the priorities and the depth budget. By default the one configured in config.py.
+    """
+    def __init__(self, domains=[], journal=None, normalize=normalizeDomain, scheduler=None):
+        self.normalize = normalize
+        self.scheduler = scheduler if scheduler != None else PriorityScheduler()
+        self._condition = threading.Condition()
+        self._heap = []                     # (-priority, sequence, domain), and outdated entries of domains that moved up
+        self._pending = {}                  # Domain: priority of its heap entry that counts
+        self._schedule = {}                 # Domain: (depth, priority) of each domain ever queued
+        self._sequence = itertools.count()
+        self._closed = False
+        self.journal = journal
+        if journal != None:
+            self.restore(journal.known, journal.pending(), journal.schedule)
+        self.put(domains)
+
+    def _push(self, domain, priority):
+        self._pending[domain] = priority
+        heapq.heappush(self._heap, (-priority, next(self._sequence), domain))
+
+    def put(self, domains, depth=0, signals=None):
+        """
+        Queues the domains that were never queued before. Returns how many were new.
+        depth: Hops from the initial domains. Domains deeper than the budget of the scheduler are dropped.
+        signals: Normalized domain: {signal name: value} for their priorities, see PriorityScheduler
+        Domains can still be put after the queue is closed, so that they are saved with the state.
+        """
+        if not self.scheduler.admits(depth):
+            tooDeepCount.inc(len(domains))
+            return 0
+        signals = signals if signals != None else {}
+        prioritized = []
+        for domain in domains:
+            domain = self.normalize(domain)
+            prioritized.append((domain, self.scheduler.priority(domain, depth, signals.get(domain))))
+        with self._condition:
+            newDomains = {}
+            for domain, priority in prioritized:
+                known = self._schedule.get(domain)
+                if known != None:
+                    if priority > self._pending.get(domain, priority):
+                        self._schedule[domain] = (min(known[0], depth), priority)
+                        self._push(domain, priority)
+                    continue
+                self._schedule[domain] = newDomains[domain] = (depth, priority)
+                self._push(domain, priority)
+            newCount = len(newDomains)
+            if self.journal != None and newCount != 0:
+                self.journal.enqueued(newDomains)
+            if newCount != 0:
+                self._condition.notify(newCount)
+            return newCount
+
+    def get(self, timeout=None):
+        """
+        Returns the domain of the highest priority.
+        Returns None if the queue is closed or nothing arrives in 'timeout' seconds.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._closed or len(self._pending) != 0, timeout):
+                return None
+            if self._closed:
+                return None
+            while True:
+                negativePriority, _, domain = heapq.heappop(self._heap)
+                if self._pending.get(domain) == -negativePriority:
+                    del self._pending[domain]
+                    return domain
+
+    def depth(self, domain):
+        """
+        Returns the hops of a queued domain from the initial domains.
+        """
+        with self._condition:
+            return self._schedule.get(domain, (0, 0))[0]
+
+    def priority(self, domain):
+        with self._condition:
+            return self._schedule.get(domain, (0, 0))[1]
+
+    def completed(self, domain):
+        """
+        Records that a domain taken from the queue is processed.
+        """
+        if self.journal != None:
+            self.journal.completed(domain)
+
+    def close(self):
+        """
+        Wakes up all consumers. 'get' returns None from now on.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def restore(self, known, pending, schedule=None):
+        """
+        Replaces the contents with a saved state.
+        known: All domains ever queued
+        pending: Domains still to be processed
+        schedule: Domain: (depth, priority). Domains not in it have 0 for both.
+        """
+        schedule = schedule if schedule != None else {}
+        with self._condition:
+            self._schedule = {domain: tuple(schedule.get(domain) or (0, 0)) for domain in itertools.chain(known, pending)}
+            self._heap = []
+            self._pending = {}
+            for domain in pending:
+                self._push(domain, self._schedule[domain][1])
+            self._condition.notify_all()
+
+    def known(self):
+        with self._condition:
+            return set(self._schedule)
+
+    def schedule(self):
+        """
+        Returns {domain: (depth, priority)} of the domains ever queued.
+        """
+        with self._condition:
+            return dict(self._schedule)
+
+    def pending(self):
+        """
+        Returns the domains still to be processed, in the order they will be taken.
+        """
+        with self._condition:
+            return [domain for negativePriority, _, domain in sorted(self._heap) if self._pending.get(domain) == -negativePriority]
+
+    def __len__(self):
+        with self._condition:
+            return len(self._pending)
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Ranks the domains of a run by the links between them, with sparse matrices of numpy and scipy.
+
+python3 analytics.py linkgraph.bin --output ranks.csv
+python3 analytics.py results.sqlite --output results.sqlite --competitors a.com,b.com --site mine.com
+python3 analytics.py backlinks.csv externallinks.csv --output ranks.csv
+
+Links are turned into edges between normalized domains: a backlink is an edge from the domain of
+url_from to of_domain, an external link is an edge from of_domain to the domain of url_to.
+The link graph file and SQLite databases are read with array operations. Csv files are read
+row by row, which is the slowest input for large runs.
+"""
+import sys
+import csv
+import time
+import sqlite3
+import argparse
+import itertools
+try:
+    import numpy as np
+    from scipy import sparse
+    from scipy.sparse import csgraph
+except ImportError:
+    np = None
+from LinkGraph import LinkGraph, Interner, NOFOLLOW
+from PublicSuffix import normalizeDomain
+from Export import SQLITE_EXTENSIONS
+
+RANKS_TABLE = "domain_ranks"
+COLUMNS = ["rank", "domain", "pagerank", "in_degree", "out_degree", "in_links", "out_links",
+           "component", "component_size", "competitors_linked", "intersect_candidate"]
+
+class DomainEdges:
+    """
+    Edges between domains, gathered from any number of sources.
+    Domains are interned to the row and column indexes of the adjacency matrix.
+    """
+    def __init__(self):
+        self.domains = Interner()
+        self._sources = []
+        self._targets = []
+
+    def add(self, sources, targets):
+        """
+        Adds edges given as numpy arrays of domain ids of this object.
+        """
+        self._sources.append(np.asarray(sources, dtype=np.int32))
+        self._targets.append(np.asarray(targets, dtype=np.int32))
+
+    def edgeCount(self):
+        return sum(len(sources) for sources in self._sources)
+
+    def remap(self, names, normalize=True):
+        """
+        Returns an array mapping the ids of an outside list of domain names to the ids of this object.
+        normalize: False if the names are normalized already
+        """
+        if normalize:
+            names = [normalizeDomain(name) for name in names]
+        return np.fromiter(map(self.domains.id, names), dtype=np.int32, count=len(names))
+
+    def adjacency(self):
+        """
+        Returns the adjacency matrix in csr format. An entry is the count of links between two domains.
+        Links of a domain to itself are left out.
+        """
+        sources = np.concatenate(self._sources) if len(self._sources) != 0 else np.zeros(0, dtype=np.int32)
+        targets = np.concatenate(self._targets) if len(self._targets) != 0 else np.zeros(0, dtype=np.int32)
+        external = sources != targets
+        size = len(self.domains)
+        matrix = sparse.coo_matrix((np.ones(np.count_nonzero(external), dtype=np.float64), (sources[external], targets[external])), shape=(size, size))
+        # Duplicate entries are summed
+        return matrix.tocsr()
+
+def readGraph(fileName, edges, followOnly=False):
+    """
+    Adds the edges of a link graph file saved by WebScraperSEO.
+    """
+    graph = LinkGraph.load(fileName, urls=False)
+    # Domains of the graph are normalized when they are added
+    lookup = edges.remap(list(graph.domains), normalize=False)
+    urlDomainIds = np.frombuffer(graph.urlDomainIds, dtype=np.uint32)
+    externals = graph.externals
+    if len(externals) != 0:
+        edges.add(lookup[np.frombuffer(externals.domainIds, dtype=np.uint32)], lookup[urlDomainIds[np.frombuffer(externals.urlIds, dtype=np.uint32)]])
+    backlinks = graph.backlinks
+    if len(backlinks) != 0:
+        followed = np.ones(len(backlinks), dtype=bool)
+        if followOnly:
+            followed = (np.frombuffer(backlinks.flags, dtype=np.uint8) & NOFOLLOW) == 0
+        edges.add(lookup[urlDomainIds[np.frombuffer(backlinks.urlIds, dtype=np.uint32)[followed]]], lookup[np.frombuffer(backlinks.domainIds, dtype=np.uint32)[followed]])
+
+def _fetchPairs(db, query):
+    cursor = db.execute(query)
+    pairs = np.fromiter(itertools.chain.from_iterable(cursor), dtype=np.int64)
+    return pairs[0::2], pairs[1::2]
+
+def readDatabase(fileName, edges, followOnly=False):
+    """
+    Adds the edges of the backlinks and externallinks tables of a SQLite database written by the scrapers.
+    """
+    db = sqlite3.connect(fileName)
+    try:
+        rows = db.execute("SELECT id, name FROM domains").fetchall()
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        lookup = np.full(ids.max() + 1 if len(ids) != 0 else 0, -1, dtype=np.int32)
+        lookup[ids] = edges.remap([row[1] for row in rows])
+        sources, targets = _fetchPairs(db, "SELECT e.of_domain_id, u.domain_id FROM externallinks e JOIN urls u ON u.id = e.url_to_id")
+        edges.add(lookup[sources], lookup[targets])
+        where = " WHERE NOT b.nofollow OR b.nofollow IS NULL" if followOnly else ""
+        sources, targets = _fetchPairs(db, "SELECT u.domain_id, b.of_domain_id FROM backlinks b JOIN urls u ON u.id = b.url_from_id" + where)
+        edges.add(lookup[sources], lookup[targets])
+    finally:
+        db.close()
+
+def readCsv(fileName, edges, followOnly=False):
+    """
+    Adds the edges of a csv file of either scraper, told apart by its header.
+    """
+    with open(fileName, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        isBacklinks = "url_from" in reader.fieldnames
+        sources = []
+        targets = []
+        domains = edges.domains
+        for row in reader:
+            if isBacklinks:
+                if followOnly and row.get("nofollow") == "True":
+                    continue
+                sources.append(domains.id(normalizeDomain(row["url_from"])))
+                targets.append(domains.id(normalizeDomain(row["of_domain"])))
+            else:
+                sources.append(domains.id(normalizeDomain(row["of_domain"])))
+                targets.append(domains.id(normalizeDomain(row["url_to"])))
+    edges.add(sources, targets)
+
+def readInput(fileName, edges, followOnly=False):
+    if fileName.endswith(SQLITE_EXTENSIONS):
+        readDatabase(fileName, edges, followOnly)
+    elif fileName.endswith(".csv"):
+        readCsv(fileName, edges, followOnly)
+    else:
+        readGraph(fileName, edges, followOnly)
+
+def pageRank(adjacency, damping=0.85, tolerance=1e-10, maxIterations=100):
+    """
+    Returns the PageRank of each domain, summing to 1, by power iteration.
+    Edges are weighted by the entries of the matrix, a binary matrix counts each linking domain once.
+    Rank of the domains without outgoing edges is spread evenly.
+    """
+    size = adjacency.shape[0]
+    if size == 0:
+        return np.zeros(0)
+    outDegree = np.asarray(adjacency.sum(axis=1)).ravel()
+    dangling = outDegree == 0
+    inverseOutDegree = np.divide(1.0, outDegree, out=np.zeros(size), where=~dangling)
+    transposed = adjacency.T.tocsr()
+    ranks = np.full(size, 1.0 / size)
+    for _ in range(maxIterations):
+        newRanks = damping * (transposed @ (ranks * inverseOutDegree)) + (damping * ranks[dangling].sum() + 1 - damping) / size
+        change = np.abs(newRanks - ranks).sum()
+        ranks = newRanks
+        if change < tolerance:
+            break
+    return ranks
+
+def components(adjacency):
+    """
+    Returns (component, component size) of each domain, of the weakly connected components.
+    Components are numbered from the largest one, 0.
+    """
+    _, labels = csgraph.connected_components(adjacency, directed=True, connection="weak")
+    sizes = np.bincount(labels)
+    order = np.argsort(-sizes, kind="stable")
+    numbers = np.empty_like(order)
+    numbers[order] = np.arange(len(order))
+    return numbers[labels], sizes[labels]
+
+def linkIntersection(adjacency, competitorIds, siteId=None, minCompetitors=2):
+    """
+    Returns (competitors linked, candidate) of each domain.
+    A candidate links to at least 'minCompetitors' of the competitors, but not to the site,
+    and is neither a competitor nor the site.
+    """
+    size = adjacency.shape[0]
+    if len(competitorIds) == 0:
+        return np.zeros(size, dtype=np.int64), np.zeros(size, dtype=bool)
+    linked = np.asarray((adjacency[:, competitorIds] > 0).sum(axis=1)).ravel()
+    candidates = linked >= minCompetitors
+    candidates[competitorIds] = False
+    if siteId != None:
+        candidates &= adjacency[:, [siteId]].toarray().ravel() == 0
+        candidates[siteId] = False
+    return linked, candidates
+
+def analyze(edges, competitors=(), site=None, minCompetitors=2, damping=0.85):
+    """
+    Returns the columns of the ranked table as a dict of arrays, sorted by PageRank.
+    competitors: Domains whose shared linking domains are looked for
+    site: Domain whose linking domains are not candidates
+    """
+    adjacency = edges.adjacency()
+    competitorIds = [id for id in (edges.domains.get(normalizeDomain(domain)) for domain in competitors) if id != None]
+    siteId = edges.domains.get(normalizeDomain(site)) if site != None else None
+    binary = adjacency.copy()
+    binary.data[:] = 1
+    ranks = pageRank(binary, damping)
+    component, componentSize = components(binary)
+    linked, candidates = linkIntersection(binary, competitorIds, siteId, minCompetitors)
+    columns = {
+        "domain": np.array(list(edges.domains), dtype=object),
+        "pagerank": ranks,
+        "in_degree": np.asarray(binary.sum(axis=0)).ravel().astype(np.int64),
+        "out_degree": np.asarray(binary.sum(axis=1)).ravel().astype(np.int64),
+        "in_links": np.asarray(adjacency.sum(axis=0)).ravel().astype(np.int64),
+        "out_links": np.asarray(adjacency.sum(axis=1)).ravel().astype(np.int64),
+        "component": component,
+        "component_size": componentSize,
+        "competitors_linked": linked,
+        "intersect_candidate": candidates,
+    }
+    order = np.argsort(-ranks, kind="stable")
+    columns = {name: values[order] for name, values in columns.items()}
+    columns["rank"] = np.arange(1, len(order) + 1)
+    return columns
+
+def tableRows(columns, top=None):
+    """
+    Yields rows of the table in the order of COLUMNS, as plain Python values.
+    """
+    count = len(columns["rank"]) if top == None else min(top, len(columns["rank"]))
+    values = [columns[name][:count].tolist() for name in COLUMNS]
+    return zip(*values)
+
+def writeTable(fileName, columns, top=None):
+    """
+    Writes the ranked table to a csv file, or to the domain_ranks table of a SQLite database, replacing it.
+    """
+    rows = tableRows(columns, top)
+    if fileName.endswith(SQLITE_EXTENSIONS):
+        db = sqlite3.connect(fileName)
+        try:
+            with db:
+                db.execute("DROP TABLE IF EXISTS %s" % RANKS_TABLE)
+                db.execute("""CREATE TABLE %s (rank INTEGER PRIMARY KEY, domain TEXT NOT NULL, pagerank REAL, in_degree INTEGER, out_degree INTEGER,
+                    in_links INTEGER, out_links INTEGER, component INTEGER, component_size INTEGER, competitors_linked INTEGER, intersect_candidate INTEGER)""" % RANKS_TABLE)
+                db.executemany("INSERT INTO %s VALUES (%s)" % (RANKS_TABLE, ", ".join("?" * len(COLUMNS))), rows)
+        finally:
+            db.close()
+        return
+    with open(fileName, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(rows)
+
+def main():
+    """
+    Ranks the domains found by a run by PageRank, with their degrees, connected components
+    and link intersection candidates, and writes them as a table.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("inputs", nargs="+", help="Link graph file, SQLite database or csv files of the scrapers")
+    parser.add_argument("--output", default="ranks.csv", help="csv file, or SQLite database to write the domain_ranks table to")
+    parser.add_argument("--competitors", default="", help="Comma separated domains, for link intersection candidates")
+    parser.add_argument("--site", help="Domain whose linking domains are not candidates")
+    parser.add_argument("--min-competitors", type=int, default=2, help="How many competitors a candidate links to at least")
+    parser.add_argument("--damping", type=float, default=0.85)
+    parser.add_argument("--follow-only", action="store_true", help="Leaves out no follow backlinks")
+    parser.add_argument("--top", type=int, help="Writes only this many of the highest ranked domains")
+    args = parser.parse_args()
+    if np == None:
+        print("analytics.py needs numpy and scipy: pip install -r requirements.txt")
+        sys.exit(1)
+    startTime = time.monotonic()
+    edges = DomainEdges()
+    for fileName in args.inputs:
+        readInput(fileName, edges, args.follow_only)
+    loadedTime = time.monotonic()
+    competitors = [domain for domain in args.competitors.split(",") if domain.strip() != ""]
+    columns = analyze(edges, competitors, args.site, args.min_competitors, args.damping)
+    analyzedTime = time.monotonic()
+    writeTable(args.output, columns, args.top)
+    print("%s domains and %s links. Loaded in %.2fs, analyzed in %.2fs, written in %.2fs to '%s'." % (
+        len(edges.domains), edges.edgeCount(), loadedTime - startTime, analyzedTime - loadedTime, time.monotonic() - analyzedTime, args.output))
+    print("%s link intersection candidates" % int(columns["intersect_candidate"].sum()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+from BenchmarkServers import DEFAULTS as SERVER_DEFAULTS
+
+SCENARIOS = ["crawl", "backlinks"]
+SCENARIO_DEFAULTS = {
+    "domains": 50,                  # Domains queried from the fake API by the backlinks scenario
+    "apiRate": 100,                 # Requests per second the API client is limited to
+    "notReadyWaitSecs": 0.1,        # Replaces BQ_NOT_YET_READY_WAIT_SECS
+    "parseProcesses": 0,            # Replaces EM_PARSE_PROCESSES
+    "timeout": 300,                 # Seconds a scenario may take before it is reported as timed out
+}
+# Results compared with the baseline. True: higher is better.
+COMPARED_RESULTS = {"pagesPerSec": True, "domainsPerSec": True, "peakRssMB": False}
+
+class Samples:
+    """
+    Stands in for a histogram of Metrics and keeps every observed value, for exact percentiles.
+    """
+    def __init__(self):
+        self.values = []
+
+    def observe(self, value, **labels):
+        self.values.append(value)
+
+    def time(self, **labels):
+        from Metrics import _Timer
+        return _Timer(self, labels)
+
+    def percentile(self, p):
+        """
+        Nearest-rank percentile in milliseconds, or None if nothing is observed.
+        """
+        if len(self.values) == 0:
+            return None
+        values = sorted(self.values)
+        return round(values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))] * 1000, 2)
+
+    def summary(self, name):
+        return {name + "P50Ms": self.percentile(50), name + "P90Ms": self.percentile(90), name + "P99Ms": self.percentile(99)}
+
+def peakRssMB():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def waitFor(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+def runCrawl(addresses, settings):
+    """
+    Crawls all the synthetic websites with ExternalsMapper.
+    """
+    import ExternalsMapper as externalsMapperModule
+    import SitemapReader
+    from ExternalsMapper import ExternalsMapper
+    # Stand-in servers do not speak https
+    SitemapReader.ROBOTS_REQ_URL = "http://%DOMAIN%/robots.txt"
+    SitemapReader.SITEMAP_REQ_URL = "http://%DOMAIN%/sitemap.xml"
+    externalsMapperModule.EM_PARSE_PROCESSES = settings["parseProcesses"]
+    requestSamples = Samples()
+    domainSamples = Samples()
+    externalsMapperModule.requestSeconds = requestSamples
+    externalsMapperModule.domainSeconds = domainSamples
+    domains = addresses["sites"]
+    mapper = ExternalsMapper(domains, -1, "externallinks.csv")
+    mapper.setOnBacklinkSearchDomainFoundCallback(lambda found, depth, signals: None)
+    startTime = time.monotonic()
+    mapper.start()
+    finished = waitFor(lambda: len(mapper._processedDomains) >= len(domains) or not mapper.is_alive(), settings["timeout"])
+    elapsed = time.monotonic() - startTime
+    mapper.stop()
+    mapper.join()
+    mapper.exporter.close()
+    requests = externalsMapperModule.requestCount
+    result = {
+        "finished": finished and len(mapper._processedDomains) >= len(domains),
+        "seconds": round(elapsed, 3),
+        "domains": len(mapper._processedDomains),
+        "pages": requests.value(result="ok"),
+        "requests": requests.value(),
+        "failedRequests": requests.value(result="error"),
+        "externalLinks": externalsMapperModule.externalLinkCount.value(),
+        "pagesPerSec": round(requests.value(result="ok") / elapsed, 2),
+        "domainsPerSec": round(len(mapper._processedDomains) / elapsed, 3),
+    }
+    result.update(requestSamples.summary("request"))
+    result.update(domainSamples.summary("domain"))
+    return result
+
+def runBacklinks(addresses, settings):
+    """
+    Queries backlinks of 'domains' domains from the fake API with BacklinksQuery.
+    """
+    import BacklinksQuery as backlinksQueryModule
+    import ApiClient as apiClientModule
+    from BacklinksQuery import BacklinksQuery
+    from ApiClient import ApiClient, TokenBucket
+    api = addresses["api"]
+    backlinksQueryModule.BACKLINKS_REQ_URL = api + "/backlinks/%DOMAIN%"
+    backlinksQueryModule.BACKLINKS_TASK_URL = api + "/task"
+    backlinksQueryModule.BACKLINKS_OVERVIEW_URL = api + "/overview/%DOMAIN%"
+    backlinksQueryModule.GET_TOKEN_URL = api + "/token/%RECAPTCHA_TOKEN%"
+    backlinksQueryModule.BQ_NOT_YET_READY_WAIT_SECS = settings["notReadyWaitSecs"]
+    requestSamples = Samples()
+    apiClientModule.requestSeconds = requestSamples
+    class TokenService:
+        def solveCaptcha(self):
+            return "captcha"
+        def requestToken(self, captcha, proxy=None):
+            return BacklinksQuery.requestAuthorizationToken(captcha, proxy)
+    domains = ["bench%s.example" % i for i in range(settings["domains"])]
+    apiClient = ApiClient(TokenBucket(rate=settings["apiRate"], burst=settings["apiRate"]), backoffBase=0.05)
+    query = BacklinksQuery(domains, False, "backlinks.csv", [], [], tokenService=TokenService(), apiClient=apiClient)
+    query.setOnExternalSearchDomainFoundCallback(lambda found, depth, signals: None)
+    startTime = time.monotonic()
+    query.start()
+    finished = waitFor(lambda: len(query._processedDomains) >= len(domains) or not query.is_alive(), settings["timeout"])
+    elapsed = time.monotonic() - startTime
+    query.stop()
+    query.join()
+    query.exporter.close()
+    result = {
+        "finished": finished and len(query._processedDomains) >= len(domains),
+        "seconds": round(elapsed, 3),
+        "domains": len(query._processedDomains),
+        "backlinks": backlinksQueryModule.backlinkCount.value(),
+        "apiRequests": apiClientModule.requestCount.value(),
+        "apiRetries": apiClientModule.retryCount.value(),
+        "tokenRenewals": backlinksQueryModule.tokenRenewalCount.value(),
+        "domainsPerSec": round(len(query._processedDomains) / elapsed, 3),
+    }
+    result.update(requestSamples.summary("apiRequest"))
+    return result
+
+def runScenario(scenario, addresses, settings, resultFileName):
+    """
+    Runs in a process of its own, so that peak RSS is of the scenario alone.
+    """
+    result = {"crawl": runCrawl, "backlinks": runBacklinks}[scenario](addresses, settings)
+    result["peakRssMB"] = peakRssMB()
+    with open(resultFileName, 'w') as f:
+        json.dump(result, f)
+    # Do not wait for the daemon threads of the scrapers
+    os._exit(0)
+
+def runScenarioProcess(scenario, addresses, settings, verbose):
+    """
+    Runs a scenario in a new process, in an empty directory so that no cache of a previous run is used.
+    """
+    workDir = tempfile.mkdtemp(prefix="seobench-")
+    resultFileName = os.path.join(workDir, "result.json")
+    try:
+        output = None if verbose else subprocess.DEVNULL
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--run-scenario", scenario,
+                        "--addresses", json.dumps(addresses), "--settings", json.dumps(settings), "--result", resultFileName],
+                       cwd=workDir, stdout=output, stderr=output, timeout=settings["timeout"] + 60)
+        if not os.path.isfile(resultFileName):
+            return {"finished": False, "error": "Scenario process failed, run with --verbose for details"}
+        with open(resultFileName) as f:
+            return json.load(f)
+    except subprocess.TimeoutExpired:
+        return {"finished": False, "error": "Scenario process did not quit"}
+    finally:
+        shutil.rmtree(workDir, ignore_errors=True)
+
+def startServers(settings):
+    servers = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "BenchmarkServers.py"), json.dumps(settings)],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    return servers, json.loads(servers.stdout.readline())
+
+def stopServers(servers):
+    servers.stdin.close()
+    try:
+        servers.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        servers.kill()
+
+def median(runs):
+    """
+    Returns the result of several runs of a scenario, with the median of each numeric value.
+    """
+    result = dict(runs[0])
+    for key, value in runs[0].items():
+        values = [run.get(key) for run in runs]
+        if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+            result[key] = statistics.median(values)
+        elif key == "finished":
+            result[key] = all(values)
+    return result
+
+def findRegressions(results, baseline, tolerance):
+    """
+    Returns descriptions of the compared results that are worse than the baseline by more than 'tolerance'.
+    """
+    regressions = []
+    for scenario, result in results.items():
+        for key, higherIsBetter in COMPARED_RESULTS.items():
+            old = baseline.get("results", {}).get(scenario, {}).get(key)
+            new = result.get(key)
+            if old in (None, 0) or new == None:
+                continue
+            change = (new - old) / old
+            if (higherIsBetter and change < -tolerance) or (not higherIsBetter and change > tolerance):
+                regressions.append("%s %s: %s -> %s (%+.0f%%)" % (scenario, key, old, new, change * 100))
+    return regressions
+
+def printReport(results):
+    for scenario, result in results.items():
+        print()
+        print("== %s ==" % scenario)
+        for key, value in result.items():
+            print("  %-22s %s" % (key, value))
+
+def main():
+    """
+    Runs the scrapers against local stand-in servers and reports throughput, latency percentiles and peak RSS.
+    Needs no network. With the same settings, the same websites and API answers are served.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--scenario", choices=SCENARIOS + ["all"], default="all")
+    parser.add_argument("--settings", default="{}", help="json object overriding the defaults: %s" % json.dumps(dict(SERVER_DEFAULTS, **SCENARIO_DEFAULTS)))
+    parser.add_argument("--repeat", type=int, default=1, help="Runs each scenario this many times and reports the medians")
+    parser.add_argument("--output", help="Writes the settings and results to this json file")
+    parser.add_argument("--baseline", help="json file written with --output. Exits with 1 if results got worse than it.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed change against the baseline, 0.25 is 25%%")
+    parser.add_argument("--verbose", action="store_true", help="Shows the output of the scrapers")
+    parser.add_argument("--run-scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--addresses", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    settings = dict(SERVER_DEFAULTS, **SCENARIO_DEFAULTS)
+    settings.update(json.loads(args.settings))
+    if args.run_scenario != None:
+        runScenario(args.run_scenario, json.loads(args.addresses), settings, args.result)
+        return
+    scenarios = SCENARIOS if args.scenario == "all" else [args.scenario]
+    results = {}
+    for scenario in scenarios:
+        runs = []
+        for _ in range(args.repeat):
+            # Fresh servers, so that the fake API answers the same way in every run
+            servers, addresses = startServers(settings)
+            try:
+                runs.append(runScenarioProcess(scenario, addresses, settings, args.verbose))
+            finally:
+                stopServers(servers)
+        results[scenario] = median(runs)
+    printReport(results)
+    if args.output != None:
+        with open(args.output, 'w') as f:
+            json.dump({"settings": settings, "results": results}, f, indent=2)
+    if args.baseline != None:
+        with open(args.baseline) as f:
+            regressions = findRegressions(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION: " + regression)
+        if len(regressions) != 0:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
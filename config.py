@@ -9,6 +9,7 @@ BACKLINKS_REQ_URL = ""
 BACKLINKS_TASK_URL = ""
 BACKLINKS_OVERVIEW_URL = "%DOMAIN%"
 SITEMAP_REQ_URL = "https://%DOMAIN%/sitemap.xml"
+ROBOTS_REQ_URL = "https://%DOMAIN%/robots.txt"
 INDEX_REQ_URL = "http://%DOMAIN%/"
 TWOCAPTCHA_REQ_URL = "http://2captcha.com/in.php?key=%TWOCAPTCHA_KEY%&method=userrecaptcha&googlekey=%SITEKEY%&pageurl=%SITEURL%&json=1"
 TWOCAPTCHA_RES_URL = "http://2captcha.com/res.php?key=%TWOCAPTCHA_KEY%&action=get&id=%ID%"
@@ -20,8 +21,79 @@ TWOCAPTCHA_RES_URL = TWOCAPTCHA_RES_URL.replace("%TWOCAPTCHA_KEY%", TWOCAPTCHA_K
 SITEKEY = ""
 WEBREQUEST_TIMEOUT = 5              # Timeout for Externals Mapper
 EM_MAX_EXCEPTION_COUNT = 2          # After how many exceptions shall external mapper skip a domain?
-EM_MAX_TIME_FOR_DOMAIN = 30         # After how many seconds shall a domain be skipped for external link search?
+EM_MAX_TIME_FOR_DOMAIN = 30         # After how many seconds shall the external link search of a domain be cut short? Links found till then are kept.
+EM_CONCURRENT_DOMAINS = 4           # How many domains shall externals mapper crawl at the same time? 1 processes them one by one.
+EM_MAX_CONNECTIONS = 20             # Upper limit of open connections shared by all domains being crawled. At least EM_CONCURRENT_DOMAINS + 1.
+EM_MAX_CONNECTIONS_PER_DOMAIN = 2   # Upper limit of open connections of a single domain
+EM_MAX_SITEMAPS_PER_DOMAIN = 50     # Upper limit of sitemap files, including nested ones, read for a domain
+EX_BUFFERED = True                  # If True, scrapers write their csv files from a background writer thread
+EX_BATCH_SIZE = 1000                # Buffered csv files are flushed after this many rows
+EX_FLUSH_INTERVAL_SECS = 2          # or this many seconds after the first unflushed row
+JN_EXTERNALS_FILE_NAME = "externals.journal"   # Journal of the externals mapper queue, for resuming
+JN_BACKLINKS_FILE_NAME = "backlinks.journal"   # Journal of the backlinks query queue, for resuming
+JN_FSYNC_EVERY = 100                # Journal records are fsync'd after this many records
+JN_FSYNC_INTERVAL_SECS = 1          # or when this many seconds passed since the last fsync
+JN_COMPACT_EVERY = 100000           # After how many records shall a journal be compacted into its snapshot?
+HC_FILE_NAME = "httpcache.sqlite"   # File of the http cache of crawled pages. ":memory:" keeps it only for the run.
+HC_COMMIT_EVERY = 100               # After how many stored pages shall the http cache be committed?
+EM_PARSE_PROCESSES = 0              # How many processes shall parse crawled pages? 0 parses them in the externals mapper thread.
+EM_PARSE_QUEUE_SIZE = 64            # Upper limit of downloaded pages waiting for a parse process. Fetching pauses when reached.
+EM_QUEUE_POLL_SECS = 1              # While crawling, how often shall externals mapper check for new domains?
 BQ_NOT_YET_READY_WAIT_SECS = 10     # How much shall NotYetReady error handler wait before querying again?
+BQ_MAX_TASKS_IN_FLIGHT = 5          # How many backlink tasks shall be started before their results are collected? 1 queries domains one by one.
+BQ_TOKEN_TASK_QUOTA = 10            # How many backlink tasks can a token have at the same time?
+BC_FILE_NAME = "backlinkcache.sqlite"   # File of the persistent backlink cache. ":memory:" keeps it only for the run.
+BC_TTL_SECS = 7 * 24 * 60 * 60      # How long shall cached backlinks and overviews be used?
+BC_MAX_BYTES = 512 * 1024 * 1024    # When the backlink cache grows larger than this, oldest entries are evicted
+BC_CACHE_ONLY = False               # If True, XXX is not queried at all; only cached domains are processed
+TP_LOW_WATER_MARK = 2               # How many authorization tokens shall be kept ready in advance?
+TP_WORKERS = 1                      # How many tokens shall be requested at the same time?
+TP_MAX_FAILURES = 3                 # After how many failed token requests in a row shall token requesting stop?
+BQ_MAX_NOT_YET_READY_POLLS = 5      # After how many NotYetReady answers shall a domain be skipped?
+BQ_BLOCKLIST = []                   # Domains, with their subdomains, backlinks are never queried for
+BQ_BLOCKLIST_FILE_NAME = "blocklist.txt"    # More blocked domains, one per line, if the file exists. "" disables it.
+# Platforms always exceeding BACKLINK_DOMAIN_FILTER. Their backlinks are never queried, not to waste the token quota.
+# Matched against the registrable domain only, so that ie. the blogs under blogspot.com are still queried.
+BQ_KNOWN_GIANTS = ["google.com", "youtube.com", "facebook.com", "twitter.com", "x.com", "instagram.com", "linkedin.com",
+    "wikipedia.org", "wikimedia.org", "amazon.com", "apple.com", "microsoft.com", "github.com", "pinterest.com",
+    "reddit.com", "tiktok.com", "yahoo.com", "bing.com", "wordpress.com", "wordpress.org", "blogspot.com",
+    "medium.com", "tumblr.com", "vimeo.com", "whatsapp.com", "t.me", "telegram.org", "adobe.com", "cloudflare.com",
+    "mozilla.org", "paypal.com", "ebay.com", "netflix.com", "spotify.com", "yandex.ru", "baidu.com", "vk.com"]
+API_RATE = 2                        # Upper limit of requests per second to XXX
+API_MIN_RATE = 0.1                  # Lower limit the request rate is slowed down to when XXX rate limits us
+API_BURST = 5                       # How many requests can be sent at once after being idle?
+API_MAX_RETRIES = 4                 # How many times shall a request failing with 5xx, a connection error or a 429 with Retry-After be retried?
+API_BACKOFF_BASE_SECS = 1           # First retry waits up to this long, every next one up to twice longer
+API_BACKOFF_MAX_SECS = 60           # Upper limit of the wait before a retry
+API_MAX_RETRY_AFTER_SECS = 300      # Longer Retry-After waits are not waited out, the answer is handled as a 429
+HS_POOL_HOSTS = 100                 # To how many hosts shall an http session keep connections alive?
+HS_POOL_SIZE_PER_HOST = 10          # How many idle connections shall an http session keep alive to a host?
+HS_DNS_CACHE_TTL_SECS = 300         # How long shall a resolved host name be used? 0 disables the DNS cache.
+HS_DNS_CACHE_SIZE = 10000           # Upper limit of host names kept in the DNS cache
+MX_HTTP_HOST = "127.0.0.1"          # Address the metrics are served at in the Prometheus text format
+MX_HTTP_PORT = 9108                 # Port the metrics are served at. 0 disables it.
+MX_SNAPSHOT_FILE_NAME = "metrics.json"  # File a json snapshot of the metrics is written to. "" disables it.
+MX_SNAPSHOT_INTERVAL_SECS = 10      # How often shall the metrics snapshot be written?
+DN_GRANULARITY = "registrable"      # Work items of domains: "registrable" (example.co.uk for www.example.co.uk) or "host"
+DN_PUBLIC_SUFFIX_FILE_NAME = "public_suffix_list.dat"   # Bundled public suffix list, relative to the project directory
+DN_PRIVATE_SUFFIXES = True          # Shall private suffixes, ie. blogspot.com, count as public suffixes?
+DN_CACHE_SIZE = 100000              # How many normalized domains shall each process remember?
+GR_FILE_NAME = "linkgraph.bin"      # Binary file the link graph of a run is saved to on close, and loaded from on resume. Links found since are journaled next to it. "" disables it.
+DC_HOST = "127.0.0.1"               # Address the coordinator of a distributed run listens at
+DC_PORT = 9110                      # Port of the coordinator
+DC_FILE_NAME = "frontier.sqlite"    # Domains of both stages of a distributed run, kept by the coordinator
+DC_LEASE_SECS = 300                 # How long is a domain leased to a worker? Leases of workers gone silent are re-issued after this.
+DC_LEASE_BATCH = 5                  # How many domains shall a worker lease at a time?
+DC_POLL_SECS = 2                    # How often shall a worker ask for domains when the coordinator has none?
+DC_MAX_ATTEMPTS = 3                 # After how many leases of a domain that did not complete shall it be given up?
+SC_MAX_DEPTH = 3                    # Domains more hops than this away from the initial domains are not queued. -1 for no limit.
+# Domains with the highest sum of weight * signal are processed first. Signals that are not known count 0.
+# depth: Hops from the initial domains. parentPriority: Priority of the domain it was found on.
+# links: Links to it from the domain it was found on. domainInlinkRank, inlinkRank: Best of the backlinks it was found in.
+# domainAuthority, backlinks, refDomains, domainTraffic: XXX overview of it, if it is cached.
+SC_WEIGHTS = {"depth": -20, "parentPriority": 0.5, "links": 5, "domainInlinkRank": 1, "inlinkRank": 0.5,
+    "domainAuthority": 1, "backlinks": 2, "refDomains": 5, "domainTraffic": 2}
+SC_LOG_SIGNALS = ["links", "backlinks", "refDomains", "domainTraffic"]     # Counts, weighted by their log10(1 + count)
 
 solver = TwoCaptcha(TWOCAPTCHA_KEY)
 
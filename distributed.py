@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Runs the scrapers as a coordinator and any number of workers, on one machine or many.
+
+python3 distributed.py coordinator example.com [--resume]
+python3 distributed.py worker backlinks --coordinator http://host:9110
+python3 distributed.py worker externals --coordinator http://host:9110
+
+The coordinator keeps the domains of both stages and which of them are processed. Workers lease
+domains of their stage, report the domains they find to the coordinator for the other stage and
+write their results to files of their own, named after the worker. Workers on the same machine
+shall run in directories of their own, as their caches are kept in the working directory.
+"""
+import os
+import time
+import argparse
+from config import *
+from SharedFrontier import SharedFrontier, BACKLINKS, EXTERNALS, STAGES
+from Coordinator import Coordinator, CoordinatorClient, RemoteQueue
+from Metrics import MetricsServer
+from LinkGraph import LinkGraph
+from Utils import *
+
+def runCoordinator(args):
+    fileName = ":memory:" if args.memory else DC_FILE_NAME
+    if not args.resume and fileName != ":memory:" and os.path.isfile(fileName):
+        # A new run starts with an empty frontier
+        os.remove(fileName)
+    frontier = SharedFrontier(fileName)
+    frontier.put(BACKLINKS, args.domains)
+    coordinator = Coordinator(frontier, args.host, args.port)
+    coordinator.start()
+    try:
+        while True:
+            time.sleep(args.report_secs)
+            print("Frontier: %s" % frontier.counts())
+    except KeyboardInterrupt:
+        print("Closing, workers are finishing their domains")
+        coordinator.close()
+        try:
+            # Workers notice on their next lease
+            time.sleep(max(DC_POLL_SECS * 2, 1))
+        except KeyboardInterrupt:
+            pass
+    finally:
+        print("Frontier: %s" % frontier.counts())
+        coordinator.stop()
+
+def runWorker(args):
+    # Imported here, so that the coordinator does not load the scrapers
+    from ExternalsMapper import ExternalsMapper
+    from BacklinksQuery import BacklinksQuery
+    client = CoordinatorClient(args.coordinator, args.id)
+    name = client.worker.replace(":", "-")
+    queue = RemoteQueue(client, args.stage, args.batch)
+    # Only put to, the priorities of the domains found are given here
+    otherQueue = RemoteQueue(client, EXTERNALS if args.stage == BACKLINKS else BACKLINKS)
+    graph = LinkGraph()
+    if args.stage == BACKLINKS:
+        scraper = BacklinksQuery([], args.report_nofollow, "backlinks-%s.csv" % name, [], [], queue, graph=graph)
+        scraper.setOnExternalSearchDomainFoundCallback(otherQueue.put)
+    else:
+        scraper = ExternalsMapper([], args.max_external_links, "externallinks-%s.csv" % name, queue, graph=graph)
+        scraper.setOnBacklinkSearchDomainFoundCallback(otherQueue.put)
+    def errorCallback(exception):
+        print("Worker had to be stopped, its domains are leased again after their leases expire. Details:")
+        printException(exception)
+        scraper.stop()
+    scraper.setErrorCallback(errorCallback)
+    metricsServer = MetricsServer(port=0, snapshotFileName="metrics-%s.json" % name)
+    metricsServer.start()
+    print("Worker '%s' is working on %s of %s" % (client.worker, args.stage, client.url))
+    scraper.start()
+    try:
+        # Wakes up now and then, so that KeyboardInterrupt is handled
+        while scraper.is_alive():
+            scraper.join(1)
+    except KeyboardInterrupt:
+        print("KeyboardInterrupt, giving back the domains not started")
+        scraper.stop()
+        scraper.join()
+    finally:
+        queue.close()
+        scraper.exporter.close()
+        if GR_FILE_NAME != "":
+            graph.save("%s-%s" % (name, GR_FILE_NAME))
+        metricsServer.stop()
+
+def main():
+    """
+    Runs the coordinator or a worker of a distributed run.
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    roles = parser.add_subparsers(dest="role", required=True)
+    coordinator = roles.add_parser("coordinator", help="Keeps the frontier of the run")
+    coordinator.add_argument("domains", nargs="+", help="Initial domains, their backlinks are queried first")
+    coordinator.add_argument("--host", default=DC_HOST)
+    coordinator.add_argument("--port", type=int, default=DC_PORT)
+    coordinator.add_argument("--resume", action="store_true", help="Continues the run kept in %s" % DC_FILE_NAME)
+    coordinator.add_argument("--memory", action="store_true", help="Keeps the frontier only in memory")
+    coordinator.add_argument("--report-secs", type=float, default=10, help="How often the frontier counts are printed")
+    worker = roles.add_parser("worker", help="Processes domains of a stage")
+    worker.add_argument("stage", choices=STAGES)
+    worker.add_argument("--coordinator", default="http://%s:%s" % (DC_HOST, DC_PORT))
+    worker.add_argument("--id", help="Name of the worker, by default host name and process id")
+    worker.add_argument("--batch", type=int, default=DC_LEASE_BATCH, help="How many domains are leased at a time")
+    worker.add_argument("--max-external-links", type=int, default=10, help="Limit of external links per domain, -1 for none")
+    worker.add_argument("--report-nofollow", action="store_true", help="Reports domains of no follow backlinks too")
+    args = parser.parse_args()
+    if args.role == "coordinator":
+        runCoordinator(args)
+    else:
+        runWorker(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+from Export import Export
+from SQLiteExport import exportCSV
+from BacklinksQuery import BacklinksQuery
+from ExternalsMapper import ExternalsMapper
+
+def main():
+    """
+    Writes backlinks or external links saved in a SQLite database to a csv file like the ones scrapers write.
+    """
+    if len(sys.argv) != 4 or sys.argv[2] not in ["backlinks", "externallinks"]:
+        print("Usage: python3 %s database.sqlite backlinks|externallinks output.csv" % sys.argv[0])
+        return
+    dbFileName, table, csvFileName = sys.argv[1:]
+    headers = BacklinksQuery.HEADERS if table == "backlinks" else ExternalsMapper.FIELDNAMES
+    with Export(csvFileName, headers) as exporter:
+        exportCSV(dbFileName, table, exporter)
+
+if __name__ == "__main__":
+    main()
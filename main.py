@@ -15,8 +15,11 @@ def main():
     """
     Scans for backlinks and external links in breadth first order.
     """
+    resume = "--resume" in sys.argv
+    if resume:
+        sys.argv.remove("--resume")
     if len(sys.argv) == 1:
-        print("Usage: python3 %s initial_domain [max external link per domain=10] [reportNoFollowLinks=0]" % sys.argv[0])
+        print("Usage: python3 %s initial_domain [max external link per domain=10] [reportNoFollowLinks=0] [--resume]" % sys.argv[0])
         return
     initial_domain = sys.argv[1]
     maxExternalLinkPerDomain = 10
@@ -39,7 +42,7 @@ def main():
     ipList = [""]
     proxies = buildProxies(ipList, 47685, "", "")
     proxies = []
-    scraper = WebScraperSEO([initial_domain], maxExternalLinkPerDomain, reportNoFollowLinks, proxies=proxies, tokens=tokens)
+    scraper = WebScraperSEO([initial_domain], maxExternalLinkPerDomain, reportNoFollowLinks, proxies=proxies, tokens=tokens, resume=resume)
     #scraper.loadState("recovery.ext", "recovery.bac")
     scraper.start()
     scraper.join()
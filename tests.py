@@ -1,18 +1,126 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from Export import Export
+from Export import Export, openExporter
 from ExternalsMapper import ExternalsMapper
+from CrawlFrontier import CrawlFrontier, canonicalizeUrl
+from LinkExtractor import extractLinks, extractClassifiedLinks
+from WorkQueue import WorkQueue
+from Scheduler import PriorityScheduler
+from LinkGraph import LinkGraph
+from WebScraperSEO import WebScraperSEO
+from SharedFrontier import SharedFrontier, BACKLINKS, EXTERNALS
+from Coordinator import Coordinator, CoordinatorClient, RemoteQueue
+from DomainData import DomainData
+from PublicSuffix import normalizeDomain, HOST, REGISTRABLE
+from TokenPool import TokenPool, TokenPoolExhausted, StandInTokenService
+from BacklinkCache import BacklinkCache, BACKLINKS, OVERVIEW
+from Journal import Journal
+from DomainFilter import DomainFilter
+from BacklinksQuery import BacklinksQuery, CRAWL_STARTED
+from ApiClient import ApiClient, TokenBucket, parseRetryAfter
+from types import SimpleNamespace
+from HttpSession import DnsCache
+from Metrics import Registry
+from BenchmarkServers import SyntheticSite, DEFAULTS as BENCHMARK_DEFAULTS
+from benchmark import findRegressions
+from Utils import Deadline
+from HttpSession import getSession
+from HttpCache import HttpCache
+from gevent.lock import BoundedSemaphore
+from config import WEBREQUEST_TIMEOUT
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from concurrent.futures.process import BrokenProcessPool
+import SitemapReader
+import PublicSuffix
+import exportcsv
+import csv
+import gzip
+import json
+import sqlite3
+import os
+import sys
+import socket
+import threading
+import time
+import pytest
+import requests
+from bs4 import BeautifulSoup
 
-def test_exporter():
+class LocalSite:
+    """
+    Serves 'pages' {path: (status, headers, body)} at 'address' from a background thread. Other paths are 404.
+    The paths and headers of the requests are kept in 'requests'.
+    delay: Seconds each answer takes
+    """
+    def __init__(self, pages=None, delay=0):
+        self.pages = pages if pages != None else {}
+        self.requests = []
+        site = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                site.requests.append((self.path, dict(self.headers)))
+                time.sleep(delay)
+                status, headers, body = site.pages.get(self.path, (404, {}, b""))
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+        self._server = HTTPServer(("127.0.0.1", 0), Handler)
+        self.address = "127.0.0.1:%s" % self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def paths(self):
+        return [path for path, _ in self.requests]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+def crawlingMapper(fileName, httpCache=None, **kwargs):
+    """
+    Returns an ExternalsMapper whose getExternalLinks can be called in this thread, without starting it.
+    """
+    httpCache = httpCache if httpCache != None else HttpCache(":memory:")
+    mapper = ExternalsMapper([], -1, fileName, httpCache=httpCache, **kwargs)
+    mapper._connectionSlots = BoundedSemaphore(4)
+    mapper._session = getSession()
+    return mapper
+
+def runMapper(mapper, domainCount, timeout=30):
+    """
+    Runs the thread of an ExternalsMapper till it has processed 'domainCount' domains, then stops it.
+    """
+    mapper.setOnBacklinkSearchDomainFoundCallback(lambda domains, depth, signals: None)
+    mapper.start()
+    deadline = time.monotonic() + timeout
+    while len(mapper._processedDomains) < domainCount and time.monotonic() < deadline:
+        time.sleep(0.05)
+    mapper.stop()
+    mapper.join(timeout)
+
+@pytest.fixture
+def plainSitemaps(monkeypatch):
+    """
+    Sitemaps and robots.txt are requested over http, so that a LocalSite can serve them.
+    """
+    monkeypatch.setattr(SitemapReader, "ROBOTS_REQ_URL", "http://%DOMAIN%/robots.txt")
+    monkeypatch.setattr(SitemapReader, "SITEMAP_REQ_URL", "http://%DOMAIN%/sitemap.xml")
+
+def test_exporter(tmp_path):
 	HEADERS = {"of_domain": "of_domain", "url_from": "url_from", "url_to": "url_to", "title": "title", "anchor": "anchor", "nofollow": "nofollow", "inlink_rank": "page_rank", "domain_inlink_rank": "domain_rank", "first_seen": "first_seen", "last_visited": "last_visited"}
 	FIELDNAMES = ["of_domain", "url_from", "url_to", "title", "anchor", 'nofollow', 'inlink_rank', 'domain_inlink_rank', 'first_seen', 'last_visited']
 
 	obj1 = {"of_domain": "1", "url_from": "2", "url_to": "3", "title": "title", "anchor": "anchor", "nofollow": "nofollow", "inlink_rank": "page_rank", "domain_inlink_rank": "domain_rank", "first_seen": "first_seen", "last_visited": "last_visited"}
 	obj2 = {"of_domain": "12", "url_from": "23", "url_to": "3", "title": "title", "anchor": "anchor", "nofollow": "nofollow", "inlink_rank": "page_rank", "domain_inlink_rank": "domain_rank", "first_seen": "first_seen", "last_visited": "last_visited"}
 
-	e = Export("test.csv", HEADERS)
-	e2 = Export("test2.csv", FIELDNAMES)
+	e = Export(str(tmp_path / "test.csv"), HEADERS)
+	e2 = Export(str(tmp_path / "test2.csv"), FIELDNAMES)
 
 	e.writerow(obj1)
 	e.writerow(obj2)
@@ -22,8 +130,717 @@ def test_exporter():
 	e2.close()
 	
 
-def testExternalsMapper(url=[""]):
-    externalsMapper = ExternalsMapper(url, 10, "test.csv")
+def testExternalsMapper(tmp_path):
+    externalsMapper = ExternalsMapper([""], 10, str(tmp_path / "externals.csv"), httpCache=HttpCache(":memory:"))
     externalsMapper.start()
+    externalsMapper.stop()
+    externalsMapper.join()
+
+
+
+def test_domainDeadline(tmp_path):
+    deadline = Deadline(60)
+    assert deadline.timeout(5) == 5 and not deadline.expired()
+    assert Deadline(0).timeout(5) == Deadline.MIN_TIMEOUT and Deadline().timeout(5) == 5
+    # A host that never answers takes the time span of the domain, not a timeout per request
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(8)
+    mapper = crawlingMapper(str(tmp_path / "externals.csv"))
+    mapper.MAX_TIME_FOR_DOMAIN = 0.5
+    startTime = time.monotonic()
+    assert mapper.getExternalLinks("127.0.0.1:%s" % listener.getsockname()[1]) == set()
+    assert time.monotonic() - startTime < WEBREQUEST_TIMEOUT
+    mapper.exporter.close()
+    listener.close()
+
+def test_redirectedInlinks(tmp_path, plainSitemaps):
+    site = LocalSite()
+    # The domain redirects to another host, whose relative links are still inlinks
+    otherHost = site.address.replace("127.0.0.1", "localhost")
+    html = {"Content-Type": "text/html"}
+    site.pages["/"] = (302, {"Location": "http://%s/home" % otherHost}, b"")
+    site.pages["/home"] = (200, html, b'<a href="/about">about</a><a href="http://ext.com/x">x</a>')
+    site.pages["/about"] = (200, html, b'<a href="http://%s/">home</a><a href="http://other.com/">o</a><a href="/a.pdf">pdf</a>' % otherHost.encode())
+    site.pages["/a.pdf"] = (200, {"Content-Type": "application/pdf"}, b"%PDF")
+    mapper = crawlingMapper(str(tmp_path / "externals.csv"))
+    try:
+        assert mapper.getExternalLinks(site.address) == {"http://ext.com/x", "http://other.com/"}
+        assert "/about" in site.paths() and "/a.pdf" in site.paths()
+        # Non-html pages are remembered only while their domain is crawled
+        assert mapper._nonHtmlUrls == {}
+    finally:
+        mapper.exporter.close()
+        site.close()
+    assert extractClassifiedLinks(b'<a href="/a">a</a>', "http://www.example.com/", "utf-8", "example.com") == (["http://www.example.com/a"], [])
+
+def test_connectionCap(tmp_path, plainSitemaps, monkeypatch):
+    module = sys.modules[ExternalsMapper.__module__]
+    monkeypatch.setattr(module, "EM_CONCURRENT_DOMAINS", 3)
+    monkeypatch.setattr(module, "EM_MAX_CONNECTIONS", 4)
+    inFlight = [0, 0]                               # Requests sent and not answered yet, the most of them
+    send = requests.adapters.HTTPAdapter.send
+    def countedSend(adapter, request, **kwargs):
+        inFlight[0] += 1
+        inFlight[1] = max(inFlight[1], inFlight[0])
+        try:
+            return send(adapter, request, **kwargs)
+        finally:
+            inFlight[0] -= 1
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, "send", countedSend)
+    html = {"Content-Type": "text/html"}
+    sites = []
+    for i in range(4):
+        site = LocalSite(delay=0.05)
+        # The first domain is done early, the last one starts while the others are crawling
+        pageCount = 1 if i == 0 else 8
+        site.pages["/"] = (200, html, b"".join(b'<a href="/%d">%d</a>' % (page, page) for page in range(pageCount)))
+        for page in range(pageCount):
+            site.pages["/%d" % page] = (200, html, b'<a href="http://ext%d.com/%d">x</a>' % (i, page))
+        sites.append(site)
+    mapper = ExternalsMapper([site.address for site in sites], -1, str(tmp_path / "externals.csv"), httpCache=HttpCache(":memory:"))
+    try:
+        runMapper(mapper, len(sites))
+        assert sorted(mapper.graph.externalsOf(sites[3].address)) == ["http://ext3.com/%d" % page for page in range(8)]
+        # Domains are crawled at the same time, but never over the cap, robots.txt and sitemaps included
+        assert 1 < inFlight[1] <= 4
+        assert all("/robots.txt" in site.paths() for site in sites)
+    finally:
+        mapper.exporter.close()
+        for site in sites:
+            site.close()
+
+def test_parseProcesses(tmp_path, plainSitemaps, monkeypatch):
+    monkeypatch.setattr(sys.modules[ExternalsMapper.__module__], "EM_PARSE_PROCESSES", 2)
+    html = {"Content-Type": "text/html"}
+    site = LocalSite()
+    site.pages["/"] = (200, html, b'<a href="/a">a</a><a href="http://ext.com/x">x</a>')
+    site.pages["/a"] = (200, html, b'<a href="/">home</a><a href="http://other.com/y">y</a>')
+    mapper = ExternalsMapper([site.address], -1, str(tmp_path / "externals.csv"), httpCache=HttpCache(":memory:"))
+    try:
+        runMapper(mapper, 1, 60)
+        # Pages are parsed by the spawned processes
+        assert mapper._parsePool != None
+        assert sorted(mapper.graph.externalsOf(site.address)) == ["http://ext.com/x", "http://other.com/y"]
+        assert "/a" in site.paths()
+    finally:
+        mapper.exporter.close()
+        site.close()
+
+def test_brokenParsePool(tmp_path, plainSitemaps):
+    site = LocalSite()
+    site.pages["/"] = (200, {"Content-Type": "text/html"}, b'<a href="http://ext.com/x">x</a>')
+    mapper = crawlingMapper(str(tmp_path / "externals.csv"))
+    mapper.MAX_TIME_FOR_DOMAIN = 30
+    def brokenParse(resp, domain):
+        raise BrokenProcessPool()
+    mapper._parsePool, mapper._parse = object(), brokenParse
+    startTime = time.monotonic()
+    try:
+        # The page is counted as a failed request rather than waited for until the deadline
+        assert mapper.getExternalLinks(site.address) == set()
+        assert time.monotonic() - startTime < mapper.MAX_TIME_FOR_DOMAIN
+    finally:
+        mapper.exporter.close()
+        site.close()
+
+def test_httpCacheRevalidation(tmp_path, plainSitemaps):
+    site = LocalSite()
+    html = {"Content-Type": "text/html"}
+    site.pages["/"] = (200, dict(html, ETag='"v1"'), b'<a href="/p">p</a><a href="http://ext1.com/">1</a>')
+    site.pages["/p"] = (200, dict(html, **{"Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"}), b'<a href="http://ext2.com/">2</a>')
+    cache = HttpCache(":memory:")
+    try:
+        mapper = crawlingMapper(str(tmp_path / "externals.csv"), cache)
+        assert mapper.getExternalLinks(site.address) == {"http://ext1.com/", "http://ext2.com/"}
+        mapper.exporter.close()
+        assert cache.get("http://%s/" % site.address) == {"etag": '"v1"', "lastModified": None, "links": ["http://%s/p" % site.address, "http://ext1.com/"]}
+        # Unchanged pages are answered with 304 and their links come from the cache
+        site.pages["/"] = (304, {}, b"")
+        site.pages["/p"] = (304, {}, b"")
+        del site.requests[:]
+        mapper = crawlingMapper(str(tmp_path / "externals.csv"), cache)
+        assert mapper.getExternalLinks(site.address) == {"http://ext1.com/", "http://ext2.com/"}
+        mapper.exporter.close()
+        headers = dict(site.requests)
+        assert headers["/"]["If-None-Match"] == '"v1"'
+        assert headers["/p"]["If-Modified-Since"] == "Wed, 21 Oct 2015 07:28:00 GMT"
+    finally:
+        site.close()
+
+def test_sitemapReader(plainSitemaps, monkeypatch):
+    site = LocalSite()
+    xml = {"Content-Type": "application/xml"}
+    def urlset(*paths):
+        locs = "".join("<url><loc>http://%s%s</loc></url>" % (site.address, path) for path in paths)
+        return ('<?xml version="1.0"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">%s</urlset>' % locs).encode()
+    index = "".join("<sitemap><loc>http://%s%s</loc></sitemap>" % (site.address, path) for path in ["/a.xml.gz", "/b.xml"])
+    site.pages["/robots.txt"] = (200, {}, b"User-agent: *\nSitemap: http://%s/index.xml\n" % site.address.encode())
+    site.pages["/index.xml"] = (200, xml, b'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">%s</sitemapindex>' % index.encode())
+    # Served gzipped without a content encoding, as .xml.gz files are
+    site.pages["/a.xml.gz"] = (200, {"Content-Type": "application/x-gzip"}, gzip.compress(urlset("/1", "/2")))
+    site.pages["/b.xml"] = (200, xml, urlset("/3"))
+    try:
+        pages = SitemapReader.iterSitemapPages(site.address)
+        assert [next(pages), next(pages)] == ["http://%s/1" % site.address, "http://%s/2" % site.address]
+        # Nested sitemaps are only read when the pages before them are consumed
+        assert "/b.xml" not in site.paths()
+        assert list(pages) == ["http://%s/3" % site.address]
+        assert site.paths() == ["/robots.txt", "/index.xml", "/a.xml.gz", "/b.xml"]
+        monkeypatch.setattr(SitemapReader, "EM_MAX_SITEMAPS_PER_DOMAIN", 2)
+        assert len(list(SitemapReader.iterSitemapPages(site.address))) == 2
+        # Without a robots.txt, the default sitemap is read
+        del site.pages["/robots.txt"]
+        site.pages["/sitemap.xml"] = (200, xml, urlset("/4"))
+        assert list(SitemapReader.iterSitemapPages(site.address)) == ["http://%s/4" % site.address]
+    finally:
+        site.close()
+
+def test_canonicalizeUrl():
+    base = "http://example.com/a/page.html"
+    assert canonicalizeUrl("two.html#top", base) == "http://example.com/a/two.html"
+    assert canonicalizeUrl("/b/", base) == "http://example.com/b"
+    assert canonicalizeUrl("HTTP://Example.com:80") == "http://example.com/"
+    assert canonicalizeUrl("https://example.com:8443/x?q=1") == "https://example.com:8443/x?q=1"
+    assert canonicalizeUrl("mailto:someone@example.com", base) == None
+    assert canonicalizeUrl("http://[::1]:8080/x/") == "http://[::1]:8080/x"
+    assert canonicalizeUrl("HTTP://[FE80::1]:80") == "http://[fe80::1]/"
+    frontier = CrawlFrontier(["http://example.com/", "http://example.com:80/#x"])
+    assert len(frontier) == 1
+    assert frontier.add("/", "http://example.com/a") == None
+
+def test_extractLinks():
+    page = """<!DOCTYPE html><html><head><title>Page</title></head><body>
+    <a href="/a">1</a><A HREF="http://ext.com/x?y=1&amp;z=2">2</A><a name="anchor">no href</a>
+    <p><a href='rel/b.html#f'>3</a><a href="">empty</a></p><a href="http://çay.com/">unicode</a>
+    <div><a href="mailto:x@y.z">mail</a><a href=unquoted>4</a></div></body></html>"""
+    content = page.encode("utf8")
+    # Same links as the BeautifulSoup html.parser way, even if fed in small chunks
+    soup = BeautifulSoup(content, "html.parser")
+    expected = [a.get("href") for a in soup.find_all("a") if a.get("href") != None]
+    chunks = [content[i:i+7] for i in range(0, len(content), 7)]
+    assert list(extractLinks(chunks, "http://example.com/", "utf-8")) == expected
+    page = b'<html><head><base href="/sub/"></head><a href="x.html">x</a><a href="http://other.com/">o</a></html>'
+    assert list(extractLinks(page, "http://example.com/p")) == ["http://example.com/sub/x.html", "http://other.com/"]
+    assert list(extractLinks(b"")) == []
+
+def test_extractClassifiedLinks():
+    page = b'<a href="/a/">in</a><a href="http://EXT.com/x#f">ex</a><a href="mailto:x@y.z">mail</a><a href="b">in</a>'
+    inlinks, exlinks = extractClassifiedLinks(page, "http://example.com/p/", "utf-8", "example.com")
+    assert inlinks == ["http://example.com/a", "http://example.com/p/b"]
+    assert exlinks == ["http://ext.com/x"]
+
+def test_workQueue():
+    queue = WorkQueue(["a.com", "b.com"])
+    assert queue.put(["b.com", "c.com", "c.com"]) == 1
+    assert [queue.get(), queue.get(), queue.get()] == ["a.com", "b.com", "c.com"]
+    assert queue.get(timeout=0) == None
+    queue.close()
+    assert queue.get() == None
+    assert queue.known() == {"a.com", "b.com", "c.com"}
+
+def test_workQueueWakesConsumers():
+    queue = WorkQueue()
+    taken = []
+    def consume():
+        while True:
+            domain = queue.get()
+            taken.append(domain)
+            if domain == None:
+                return
+    consumer = threading.Thread(target=consume, daemon=True)
+    consumer.start()
+    time.sleep(0.1)
+    assert taken == [] and consumer.is_alive()         # Blocked in get
+    queue.put(["a.com"])
+    deadline = time.monotonic() + 5
+    while taken != ["a.com"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert taken == ["a.com"]
+    queue.close()
+    consumer.join(5)
+    assert not consumer.is_alive() and taken == ["a.com", None]
+
+def test_priorityScheduler():
+    scheduler = PriorityScheduler({"depth": -10, "links": 1, "domainAuthority": 1}, maxDepth=2, logSignals=[],
+        overviews=lambda domain: {"domainAuthority": 30} if domain == "big.com" else None)
+    assert scheduler.priority("a.com", 1, {"links": 4, "other": "x"}) == -6
+    assert scheduler.priority("big.com", 0) == 30
+    queue = WorkQueue(["big.com"], scheduler=scheduler)
+    assert queue.put(["a.com", "b.com", "c.com"], 1, {"b.com": {"links": 5}}) == 3
+    assert queue.put(["d.com"], 3) == 0
+    # Found again with more links, a.com moves up
+    assert queue.put(["a.com"], 1, {"a.com": {"links": 9}}) == 0
+    assert queue.pending() == ["big.com", "a.com", "b.com", "c.com"]
+    assert [queue.get(), queue.get(), queue.get()] == ["big.com", "a.com", "b.com"]
+    assert queue.depth("a.com") == 1 and queue.priority("a.com") == -1 and len(queue) == 1
+
+def test_sharedFrontier():
+    frontier = SharedFrontier(":memory:", leaseSecs=60, maxAttempts=2)
+    assert frontier.put(BACKLINKS, ["a.com", "www.a.com", "b.com", "c.com"]) == 3
+    assert frontier.put(EXTERNALS, ["a.com"]) == 1
+    assert frontier.put(BACKLINKS, ["c.com"], 1, {"c.com": 5}) == 0
+    assert frontier.lease(BACKLINKS, "w1", 2) == [("c.com", 0, 5), ("a.com", 0, 0)]
+    assert frontier.lease(BACKLINKS, "w2", 5) == [("b.com", 0, 0)]
+    assert frontier.renew(BACKLINKS, "w1", ["a.com", "b.com"]) == ["a.com"]
+    frontier.complete(BACKLINKS, "a.com")
+    frontier.release(BACKLINKS, "w2", ["b.com"])
+    assert frontier.lease(BACKLINKS, "w2", 5) == [("b.com", 0, 0)]
+    assert frontier.counts()[BACKLINKS] == {"pending": 0, "leased": 2, "done": 1, "failed": 0}
+    # Leases expiring right away are leased again, till maxAttempts
+    frontier = SharedFrontier(":memory:", leaseSecs=0, maxAttempts=2)
+    frontier.put(EXTERNALS, ["b.com"])
+    assert frontier.lease(EXTERNALS, "w1", 5) == [("b.com", 0, 0)]
+    assert frontier.lease(EXTERNALS, "w2", 5) == [("b.com", 0, 0)]
+    assert frontier.renew(EXTERNALS, "w1", ["b.com"]) == []
+    assert frontier.lease(EXTERNALS, "w3", 5) == []
+    assert frontier.counts()[EXTERNALS]["failed"] == 1
+
+def test_coordinator():
+    coordinator = Coordinator(SharedFrontier(":memory:"), port=0)
+    coordinator.start()
+    try:
+        client = CoordinatorClient("http://%s:%s" % coordinator.address, "w1")
+        queue = RemoteQueue(client, EXTERNALS, batch=2, pollSecs=0.05)
+        assert queue.put(["a.com", "b.com", "c.com"]) == 3
+        assert [queue.get(timeout=5), queue.get(timeout=5)] == ["a.com", "b.com"]
+        queue.completed("a.com")
+        assert client.stats()["stages"][EXTERNALS]["done"] == 1
+        coordinator.close()
+        # c.com is either taken or, if it is still queued when the queue closes, given back
+        taken = queue.get(timeout=5)
+        assert taken in ("c.com", None) and queue.get(timeout=5) == None
+        counts = client.stats()["stages"][EXTERNALS]
+        assert counts["done"] == 1 and counts["leased"] == (2 if taken != None else 1) and counts["pending"] + counts["leased"] == 2
+    finally:
+        coordinator.stop()
+
+def test_lostLease():
+    answers = iter([[["d.com", 2, 1.5]]])
+    client = SimpleNamespace(lease=lambda stage, count: {"domains": next(answers, []), "closed": False, "leaseSecs": 60},
+        renew=lambda stage, domains: [])
+    queue = RemoteQueue(client, EXTERNALS, batch=1, pollSecs=0.05)
+    assert queue.get(timeout=5) == "d.com"
+    queue._renew()                                  # The lease expired meanwhile
+    # Domains found on it are still put one hop deeper
+    assert queue.known() == set() and queue.depth("d.com") == 2 and queue.priority("d.com") == 1.5
+    queue.close()
+
+def test_linkGraph(tmp_path):
+    graph = LinkGraph()
+    graph.addExternals("a.com", ["http://b.com/x", "http://www.c.com/"])
+    graph.addBacklinks("a.com", [("http://c.com/y", True), ("http://b.com/x", False)])
+    graph.addExternals("b.com", ["http://a.com/"])
+    assert graph.externalsOf("a.com") == ["http://b.com/x", "http://www.c.com/"]
+    assert graph.backlinksOf("a.com") == ["http://c.com/y", "http://b.com/x"]
+    assert graph.externalsOf("d.com") == [] and graph.edgeCount() == 5
+    assert graph.urlDomain("http://www.c.com/") == "c.com"
+    fileName = str(tmp_path / "linkgraph.bin")
+    graph.save(fileName)
+    loaded = LinkGraph.load(fileName)
+    assert loaded.backlinksOf("a.com") == graph.backlinksOf("a.com")
+    assert list(loaded.backlinks.flags) == [1, 0]
+    assert list(loaded.urls) == list(graph.urls) and list(loaded.urlDomainIds) == list(graph.urlDomainIds)
+    # Journaled links are replayed on top of the graph they were added to, once
+    journaled = LinkGraph()
+    journaled.openJournal(fileName)
+    journaled.addExternals("a.com", ["http://b.com/x"])
+    with open(fileName + ".journal") as f:
+        unsaved = f.read()
+    journaled.save(fileName)
+    journaled.addExternals("b.com", ["http://c.com/"])
+    journaled.closeJournal()
+    resumed = LinkGraph.load(fileName)
+    resumed.openJournal(fileName, resume=True)
+    assert resumed.edgeCount() == 2 and resumed.generation == 1
+    resumed.closeJournal()
+    with open(fileName + ".journal", "w") as f:
+        f.write(unsaved)                            # A crash before the journal was emptied on save
+    resumed = LinkGraph.load(fileName)
+    resumed.openJournal(fileName, resume=True)
+    assert resumed.externalsOf("a.com") == ["http://b.com/x"] and resumed.edgeCount() == 1
+    resumed.closeJournal()
+    # DomainData of the same domain are equal, ie. "ab.com" and "ba.com" used to have the same hash
+    assert loaded.domainData("a.com") == DomainData("a.com", [], [])
+    assert len({DomainData("ab.com", [], []), DomainData("ba.com", [], []), DomainData("ab.com", [], [])}) == 2
+
+def test_analytics(tmp_path):
+    pytest.importorskip("scipy")
+    import analytics
+    graph = LinkGraph()
+    # a.com and b.com are competitors, c.com and d.com link to both, e.com only to a.com
+    graph.addBacklinks("a.com", [("http://c.com/1", False), ("http://www.d.com/2", False), ("http://e.com/3", True)])
+    graph.addBacklinks("b.com", [("http://c.com/4", False), ("http://d.com/5", False)])
+    graph.addExternals("d.com", ["http://mine.com/", "http://d.com/self"])
+    graph.addExternals("x.com", ["http://y.com/"])
+    graphFileName = str(tmp_path / "linkgraph.bin")
+    graph.save(graphFileName)
+    edges = analytics.DomainEdges()
+    analytics.readInput(graphFileName, edges)
+    columns = analytics.analyze(edges, ["a.com", "b.com"], "mine.com")
+    rows = {row[1]: dict(zip(analytics.COLUMNS, row)) for row in analytics.tableRows(columns)}
+    assert abs(sum(row["pagerank"] for row in rows.values()) - 1) < 1e-9
+    assert [row[1] for row in analytics.tableRows(columns, 1)] == ["a.com"]
+    assert rows["a.com"]["in_degree"] == 3 and rows["d.com"]["out_degree"] == 3 and rows["d.com"]["out_links"] == 3
+    assert rows["x.com"]["component_size"] == 2 and rows["a.com"]["component"] == 0
+    # d.com also links to the site, so only c.com is a candidate
+    assert [domain for domain, row in rows.items() if row["intersect_candidate"]] == ["c.com"]
+    assert rows["d.com"]["competitors_linked"] == 2 and rows["e.com"]["competitors_linked"] == 1
+    # The same links from the csv files of the scrapers
+    backlinksFileName, externalsFileName = str(tmp_path / "backlinks.csv"), str(tmp_path / "externals.csv")
+    with Export(backlinksFileName, ["of_domain", "url_from", "nofollow"]) as exporter:
+        exporter.writerow({"of_domain": "a.com", "url_from": "http://www.c.com/1", "nofollow": False})
+        exporter.writerow({"of_domain": "a.com", "url_from": "http://e.com/3", "nofollow": True})
+    with Export(externalsFileName, ["of_domain", "url_to"]) as exporter:
+        exporter.writerow({"of_domain": "a.com", "url_to": "http://b.com/"})
+    edges = analytics.DomainEdges()
+    analytics.readInput(backlinksFileName, edges, followOnly=True)
+    analytics.readInput(externalsFileName, edges)
+    columns = analytics.analyze(edges)
+    assert list(columns["domain"]) == ["b.com", "a.com", "c.com"] and edges.edgeCount() == 2
+
+def test_normalizeDomain():
+    for domain in ["www.example.com", "blog.example.com", "example.com:443", "user@example.com", "EXAMPLE.com.", "https://www.example.com/page"]:
+        assert normalizeDomain(domain, REGISTRABLE) == "example.com"
+    assert normalizeDomain("blog.example.co.uk", REGISTRABLE) == "example.co.uk"
+    assert normalizeDomain("blog.example.com:8080", REGISTRABLE) == "example.com:8080"
+    assert normalizeDomain("127.0.0.1:8001", REGISTRABLE) == "127.0.0.1:8001"
+    # Wildcard rule *.ck with the exception !www.ck
+    assert normalizeDomain("a.b.example.ck", REGISTRABLE) == "b.example.ck"
+    assert normalizeDomain("a.www.ck", REGISTRABLE) == "www.ck"
+    # Public suffixes themselves and hosts under no rule
+    assert normalizeDomain("co.uk", REGISTRABLE) == "co.uk"
+    assert normalizeDomain("a.b.localdomain", REGISTRABLE) == "b.localdomain"
+    assert normalizeDomain("user@www.example.com:80", HOST) == "www.example.com"
+    queue = WorkQueue(["www.example.com", "example.com:443"], normalize=lambda domain: normalizeDomain(domain, REGISTRABLE))
+    assert queue.pending() == ["example.com"]
+    # Urls on one host share one cache entry
+    PublicSuffix._normalizeHost.cache_clear()
+    for page in range(5):
+        assert normalizeDomain("https://www.example.org/%s" % page, REGISTRABLE) == "example.org"
+    assert PublicSuffix._normalizeHost.cache_info().currsize == 1
+
+def test_apiClient():
+    class ScriptedApiClient(ApiClient):
+        def __init__(self, answers, **kwargs):
+            ApiClient.__init__(self, TokenBucket(rate=1000, burst=10), backoffBase=0.01, **kwargs)
+            self.answers = answers
+            self.sent = 0
+        def _send(self, method, url, **kwargs):
+            self.sent += 1
+            status, headers = self.answers.pop(0)
+            return SimpleNamespace(status_code=status, headers=headers)
+    assert parseRetryAfter("3") == 3
+    assert parseRetryAfter("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert parseRetryAfter("soon") == None
+    client = ScriptedApiClient([(500, {}), (429, {"Retry-After": "0"}), (200, {})])
+    assert client.get("http://api").status_code == 200 and client.sent == 3
+    assert client.bucket.rate < 1000
+    # A 429 without Retry-After means the token is exhausted, it is not retried
+    client = ScriptedApiClient([(429, {}), (200, {})])
+    assert client.get("http://api").status_code == 429 and client.sent == 1
+    client = ScriptedApiClient([(502, {})] * 3, maxRetries=2)
+    assert client.post("http://api").status_code == 502 and client.sent == 3
+
+def test_dnsCache():
+    lookups = []
+    cache = DnsCache(ttl=60, maxSize=2)
+    cache._getaddrinfo = lambda host, port: lookups.append(host) or [(host, port)]
+    assert cache.getaddrinfo("a.com", 80) == [("a.com", 80)]
+    assert cache.getaddrinfo("a.com", 80) == [("a.com", 80)]
+    cache.getaddrinfo("b.com", 80)
+    cache.getaddrinfo("c.com", 80)
+    cache.getaddrinfo("a.com", 80)
+    assert lookups == ["a.com", "b.com", "c.com", "a.com"]
+    cache.ttl = 0
+    cache.getaddrinfo("d.com", 80)
+    cache.getaddrinfo("d.com", 80)
+    assert lookups[-2:] == ["d.com", "d.com"]
+
+def test_metrics():
+    registry = Registry()
+    registry.counter("requests_total", "Requests").inc(status=200)
+    registry.counter("requests_total", "Requests").inc(2, status=200)
+    depth = registry.gauge("queue_depth", "Queue depth")
+    depth.setFunction(lambda: 7)
+    seconds = registry.histogram("request_seconds", "Latency", (0.1, 1))
+    seconds.observe(0.05)
+    seconds.observe(0.5)
+    lines = registry.render().splitlines()
+    assert 'requests_total{status="200"} 3' in lines
+    assert "queue_depth 7" in lines
+    assert 'request_seconds_bucket{le="0.1"} 1' in lines
+    assert 'request_seconds_bucket{le="+Inf"} 2' in lines
+    assert "request_seconds_count 2" in lines
+    assert registry.snapshot()["metrics"]["request_seconds"]["values"][0]["sum"] == 0.55
+
+def test_benchmark():
+    site = SyntheticSite(BENCHMARK_DEFAULTS, 3, 8001, [8001, 8002])
+    again = SyntheticSite(BENCHMARK_DEFAULTS, 3, 8001, [8001, 8002])
+    assert site.pageHtml(7) == again.pageHtml(7)
+    internals, externals = site.pageLinks(7)
+    assert len(internals) == BENCHMARK_DEFAULTS["fanout"] and len(externals) == BENCHMARK_DEFAULTS["externalsPerPage"]
+    assert site.answer("/p/%s" % BENCHMARK_DEFAULTS["pages"])[0] == 404
+    baseline = {"results": {"crawl": {"pagesPerSec": 100, "peakRssMB": 50}}}
+    assert findRegressions({"crawl": {"pagesPerSec": 90, "peakRssMB": 55}}, baseline, 0.25) == []
+    assert len(findRegressions({"crawl": {"pagesPerSec": 70, "peakRssMB": 70}}, baseline, 0.25)) == 2
+
+def test_tokenPool():
+    service = StandInTokenService(failAfter=3)
+    pool = TokenPool(service, tokens=["Bearer given"], proxies=[{"http": "proxy"}], lowWaterMark=2, workerCount=2, maxFailures=2)
+    pool.start()
+    assert pool.get(timeout=5) == "Bearer given"
+    tokens = set(pool.get(timeout=5) for _ in range(3))
+    assert tokens == {"Bearer stand-in-1", "Bearer stand-in-2", "Bearer stand-in-3"}
+    assert {"http": "proxy"} in service.proxiesUsed
+    try:
+        pool.get(timeout=5)
+        assert False
+    except TokenPoolExhausted:
+        pass
+    pool.stop()
+
+def test_backlinkCache():
+    cache = BacklinkCache(":memory:", ttl=60, maxBytes=100)
+    cache.put("a.com", BACKLINKS, [{"url_from": "http://b.com/"}])
+    assert cache.get("a.com", BACKLINKS) == [{"url_from": "http://b.com/"}]
+    assert cache.get("a.com", OVERVIEW) == None
+    # Oldest answers are evicted to fit in maxBytes
+    cache.put("b.com", BACKLINKS, ["x" * 80])
+    assert not cache.has("a.com", BACKLINKS)
+    assert cache.has("b.com", BACKLINKS)
+    cache.ttl = -1
+    assert cache.get("b.com", BACKLINKS) == None
+    cache.close()
+
+def test_cheapFirstFiltering(tmp_path):
+    assert DomainFilter(["Google.com"], "").isBlocked("mail.google.com:443")
+    assert not DomainFilter(["google.com"], "").isBlocked("notgoogle.com")
+    giants = DomainFilter([], "", ["google.com", "blogspot.com"])
+    assert giants.isBlocked("mail.google.com") and giants.isBlocked("blogspot.com")
+    # Sites of the users of a hosting platform are registrable domains of their own
+    assert not giants.isBlocked("myblog.blogspot.com")
+    cache = BacklinkCache(":memory:")
+    cache.put("big.com", OVERVIEW, {"domainAuthority": 95, "backlinks": 10**7, "refDomains": 10**7, "domainTraffic": 10**7})
+    cache.put("small.com", OVERVIEW, {"domainAuthority": 10, "backlinks": 100, "refDomains": 10, "domainTraffic": 1000})
+    cache.put("cached.com", BACKLINKS, [])
+    query = BacklinksQuery([], False, str(tmp_path / "backlinks.csv"), [], [], tokenService=StandInTokenService(), backlinkCache=cache, domainFilter=DomainFilter(["blocked.com"], ""))
+    started = []
+    overviews = []
+    query.startBacklinkTask = lambda domain: started.append(domain) or CRAWL_STARTED
+    query.getBacklinkOverview = lambda domain: overviews.append(domain) or cache.get(domain, OVERVIEW)
+    assert query._startDomain("www.blocked.com") == None
+    assert query._startDomain("big.com") == None
+    assert query._startDomain("small.com")["shallStartTask"] == False
+    assert query._startTaskIfNeededSafe(True, "small.com") == False
+    # Only the domain passing the filters has its task started, once
+    assert started == ["small.com"]
+    # Cached backlinks need neither a task nor an overview
+    assert query._startDomain("cached.com")["shallStartTask"] == False
+    assert started == ["small.com"] and overviews == ["big.com", "small.com"]
+    # A plain 200 answer starts the task too
+    query.startBacklinkTask = lambda domain: started.append(domain) or True
+    assert query._startTaskIfNeededSafe(True, "new.com") == False
+    assert query._startTaskIfNeededSafe(True, "new.com") == False
+    assert started == ["small.com", "new.com"]
+    query.exporter.close()
+
+class FakeBacklinksApi:
+    """
+    Stand-in of the XXX api for an ApiClient. The backlinks of a domain are ready after 'readyAfter[domain]' polls.
+    Keeps the order the backlinks were given in 'collected' and the most tasks running at a time in 'maxRunning'.
+    """
+    def __init__(self, readyAfter):
+        self.readyAfter = readyAfter
+        self.polls = {}
+        self.running = set()
+        self.maxRunning = 0
+        self.collected = []
+
+    @staticmethod
+    def _answer(obj, status=200):
+        return SimpleNamespace(status_code=status, text=json.dumps(obj))
+
+    def post(self, url, headers=None, json=None):
+        self.running.add(json["domain"])
+        self.maxRunning = max(self.maxRunning, len(self.running))
+        return FakeBacklinksApi._answer({"status": CRAWL_STARTED})
+
+    def get(self, url, headers=None):
+        kind, domain = url.split("/")
+        if kind == "overview":
+            return FakeBacklinksApi._answer({"domainAuthority": 1, "backlinks": 1, "refDomains": 1, "domainTraffic": 1})
+        self.polls[domain] = self.polls.get(domain, 0) + 1
+        if self.polls[domain] < self.readyAfter[domain]:
+            return FakeBacklinksApi._answer({"backlinks": [], "done": False})
+        self.running.discard(domain)
+        self.collected.append(domain)
+        backlink = {"url_from": "http://from-%s/" % domain, "url_to": "http://%s/" % domain, "nofollow": False, "inlink_rank": 1, "domain_inlink_rank": 2}
+        return FakeBacklinksApi._answer({"backlinks": [backlink], "done": True})
+
+def test_pipelinedBacklinks(tmp_path, monkeypatch):
+    module = sys.modules[BacklinksQuery.__module__]
+    monkeypatch.setattr(module, "BACKLINKS_TASK_URL", "task/")
+    monkeypatch.setattr(module, "BACKLINKS_OVERVIEW_URL", "overview/%DOMAIN%")
+    monkeypatch.setattr(module, "BACKLINKS_REQ_URL", "backlinks/%DOMAIN%")
+    monkeypatch.setattr(module, "BQ_MAX_TASKS_IN_FLIGHT", 3)
+    monkeypatch.setattr(module, "BQ_NOT_YET_READY_WAIT_SECS", 0.01)
+    api = FakeBacklinksApi({"a.com": 3, "b.com": 1, "c.com": 2, "d.com": 1})
+    query = BacklinksQuery(["a.com", "b.com", "c.com", "d.com"], False, str(tmp_path / "backlinks.csv"), [], [], tokenService=StandInTokenService(),
+        backlinkCache=BacklinkCache(":memory:"), apiClient=api, domainFilter=DomainFilter([], ""))
+    query.authToken = "Bearer stand-in"
+    found = []
+    def onFound(domains, depth, signals):
+        found.extend(domains)
+        if len(found) == 4:
+            # As a closing coordinator closes the queue of a worker
+            query.queue.close()
+    query.setOnExternalSearchDomainFoundCallback(onFound)
+    runner = threading.Thread(target=query._runPipelined, daemon=True)
+    runner.start()
+    runner.join(10)
+    assert not runner.is_alive()
+    query.exporter.close()
+    # Tasks are polled round robin and collected as they are ready, never more than 3 of them at a time
+    assert api.collected == ["b.com", "d.com", "c.com", "a.com"]
+    assert found == ["from-b.com", "from-d.com", "from-c.com", "from-a.com"]
+    assert api.maxRunning == 3 and query._processedDomains == {"a.com", "b.com", "c.com", "d.com"}
+
+def test_sqliteExport(tmp_path, monkeypatch):
+    dbFileName = str(tmp_path / "links.sqlite")
+    backlinks = [{"of_domain": "a.com", "url_from": "http://b.com/x", "url_to": "http://a.com/", "title": 'Say "hi", b', "anchor": "",
+        "nofollow": True, "inlink_rank": 3, "domain_inlink_rank": 4.5, "first_seen": "2020-01-01", "last_visited": None, "date_lost": None},
+        {"of_domain": "a.com", "url_from": "http://b.com/x", "url_to": "http://a.com/p", "title": "t", "anchor": "a",
+        "nofollow": False, "inlink_rank": 1, "domain_inlink_rank": 2, "first_seen": "", "last_visited": "", "date_lost": ""}]
+    exporter = openExporter(dbFileName, BacklinksQuery.HEADERS, "backlinks", batchSize=2)
+    other = openExporter(dbFileName, ExternalsMapper.FIELDNAMES, "externallinks", batchSize=2)
+    db = sqlite3.connect(dbFileName)
+    exporter.writerow(backlinks[0])
+    # Rows are inserted only when a batch is full
+    assert db.execute("SELECT COUNT(*) FROM backlinks").fetchone()[0] == 0
+    exporter.writerow(backlinks[1])
+    assert db.execute("SELECT COUNT(*) FROM backlinks").fetchone()[0] == 2
+    other.writerow({"of_domain": "b.com", "url_to": "http://a.com/"})
+    exporter.close()
+    other.close()
+    # Domains and urls are kept once, rows refer to them
+    assert db.execute("SELECT COUNT(*) FROM urls").fetchone()[0] == 3
+    assert sorted(name for name, in db.execute("SELECT name FROM domains")) == ["a.com", "b.com"]
+    assert db.execute("""SELECT d.name FROM externallinks e JOIN urls u ON u.id = e.url_to_id JOIN domains d ON d.id = u.domain_id""").fetchall() == [("a.com",)]
+    db.close()
+    # Exported back to csv, the file is the same as the csv backend writes
+    csvFileName = str(tmp_path / "backlinks.csv")
+    with openExporter(csvFileName, BacklinksQuery.HEADERS, "backlinks") as exporter:
+        for row in backlinks:
+            exporter.writerow(row)
+    monkeypatch.setattr(sys, "argv", ["exportcsv.py", dbFileName, "backlinks", str(tmp_path / "exported.csv")])
+    exportcsv.main()
+    with open(csvFileName, encoding="utf-8") as f, open(str(tmp_path / "exported.csv"), encoding="utf-8") as exported:
+        assert exported.read() == f.read()
+
+def test_bufferedExporter(tmp_path):
+    FIELDNAMES = ["of_domain", "url_to"]
+    fileName = str(tmp_path / "buffered.csv")
+    e = Export(fileName, FIELDNAMES, buffered=True, batchSize=2, flushInterval=60)
+    e.writerow({"of_domain": "a.com", "url_to": "http://b.com/"})
+    e.flush()
+    with open(fileName) as f:
+        assert f.read().splitlines() == ["of_domain,url_to", "a.com,http://b.com/"]
+    for i in range(5):
+        e.writerow({"of_domain": "a.com", "url_to": "http://c%s.com/" % i})
+    e.close()
+    with open(fileName) as f:
+        assert len(f.read().splitlines()) == 7
+
+def test_failedWriter(tmp_path):
+    e = Export(str(tmp_path / "failed.csv"), ["of_domain", "url_to"], buffered=True, flushInterval=60)
+    e.writerow({"of_domain": "a.com", "unknown": "x"})
+    # The writer thread fails on the row, waiting for it does not hang
+    with pytest.raises(ValueError):
+        e.flush()
+    with pytest.raises(ValueError):
+        e.writerow({"of_domain": "b.com", "url_to": "http://c.com/"})
+    with pytest.raises(ValueError):
+        e.close()
+
+def test_exportResume(tmp_path):
+    fileName = str(tmp_path / "resumed.csv")
+    e = Export(fileName, ["of_domain", "anchor"])
+    e.writerow({"of_domain": "a.com", "anchor": "two\nlines"})
+    e.close()
+    with open(fileName, "a", newline="") as f:
+        f.write('b.com,"cut\nafter a newline')     # Partially written before a crash
+    e = Export(fileName, ["of_domain", "anchor"], append=True)
+    e.writerow({"of_domain": "c.com", "anchor": "x"})
+    e.close()
+    with open(fileName, newline="") as f:
+        assert list(csv.reader(f)) == [["of_domain", "anchor"], ["a.com", "two\nlines"], ["c.com", "x"]]
+
+def test_resume(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    scraper = WebScraperSEO(["a.com", "b.com"], 10, False, "externals.csv", "backlinks.sqlite")
+    assert scraper.backlinksQueue.get() == "a.com"
+    scraper.graph.addBacklinks("a.com", [("http://c.com/", False)])
+    scraper.externalsQueue.put(["c.com"], 1)
+    scraper.backlinksQueue.completed("a.com")
+    scraper.flush()
+    # Crashes before the graph is saved
+    resumed = WebScraperSEO([], 10, False, "externals.csv", "backlinks.sqlite", resume=True)
+    assert resumed.backlinksQueue.pending() == ["b.com"]
+    assert resumed.externalsQueue.pending() == ["c.com"] and resumed.externalsQueue.depth("c.com") == 1
+    assert resumed.graph.backlinksOf("a.com") == ["http://c.com/"]
+    resumed.close()
+    assert LinkGraph.load("linkgraph.bin").backlinksOf("a.com") == ["http://c.com/"]
+    with open("linkgraph.bin.journal") as f:
+        assert f.read() == "G1\n"
+
+def test_completedAfterWritten(tmp_path):
+    journal = Journal(str(tmp_path / "test.journal"))
+    queue = WorkQueue(["a.com", "b.com"], journal)
+    e = Export(str(tmp_path / "externals.csv"), ["of_domain", "url_to"], buffered=True, flushInterval=60)
+    db = openExporter(str(tmp_path / "links.sqlite"), None, "externallinks")
+    for exporter, domain in [(e, "a.com"), (db, "b.com")]:
+        exporter.writerow({"of_domain": domain, "url_to": "http://c.com/"})
+        exporter.afterWritten(lambda domain=domain: queue.completed(domain))
+        # The domain is not completed while its rows may still be lost
+        assert domain in journal.pending()
+        exporter.flush()
+        exporter.afterWritten(lambda: queue.completed("x.com"))     # Nothing waits to be written
+    assert journal.pending() == [] and journal.processed == {"a.com", "b.com", "x.com"}
+    e.close()
+    db.close()
+    journal.close()
 
+def test_keyboardInterrupt(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    scraper = WebScraperSEO(["a.com"], 10, False, "externals.csv", "backlinks.csv")
+    events = []
+    def interruptedJoin():
+        events.append("backlinks joined")
+        if events.count("backlinks joined") == 1:
+            raise KeyboardInterrupt()
+    scraper.backlinksQuery.join = interruptedJoin
+    scraper.externalsMapper.join = lambda: events.append("externals joined")
+    scraper.stop = lambda: events.append("stopped")
+    close = scraper.externalsMapper.exporter.close
+    scraper.externalsMapper.exporter.close = lambda: events.append("closed") or close()
+    scraper.join()
+    # The scrapers finish their domains before the files are closed
+    assert events == ["backlinks joined", "stopped", "backlinks joined", "externals joined", "closed"]
+    assert os.path.isfile("recovery_keyboardinterrupt.ext") and os.path.isfile("linkgraph.bin")
 
+def test_journal(tmp_path):
+    fileName = str(tmp_path / "test.journal")
+    journal = Journal(fileName, compactEvery=3)
+    queue = WorkQueue(["a.com", "b.com"], journal)
+    journal.completed("a.com")                      # Compacts into the snapshot
+    queue.put(["c.com"])
+    journal.close()
+    with open(fileName, "a") as f:
+        f.write('C"b.c')                            # Partially written before a crash
+    journal = Journal(fileName, resume=True)
+    assert journal.pending() == ["b.com", "c.com"]
+    assert WorkQueue(["a.com"], journal).pending() == ["b.com", "c.com"]
+    journal.close()
+    with open(fileName) as f:
+        assert f.read() == 'E["c.com", 0, 0]\n'